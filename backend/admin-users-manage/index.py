@@ -1,9 +1,10 @@
 import json
-import os
 import hashlib
 import psycopg2
 from typing import Optional
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """Управление администраторами: CRUD операции с учётными записями"""
     method = event.get('httpMethod', 'GET')
@@ -24,7 +25,7 @@ def handler(event: dict, context) -> dict:
         # TODO: Добавить проверку, что пользователь - super_admin
         # Пока закомментировано, т.к. нужно интегрировать auth_middleware
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
 
         if method == 'GET':
@@ -1,10 +1,11 @@
 import json
 import os
 import hashlib
-import psycopg2
 import jwt
 from datetime import datetime, timedelta
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """Авторизация администратора с JWT токенами и защитой от брутфорса"""
     method = event.get('httpMethod', 'POST')
@@ -43,7 +44,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
 
         cur.execute("""
@@ -0,0 +1,74 @@
+"""Лексический поиск BM25 по инвертированному индексу тенанта (tenant_chunk_terms)"""
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+BM25_K1 = float(os.environ.get('BM25_K1', '1.2'))
+BM25_B = float(os.environ.get('BM25_B', '0.75'))
+RRF_K = int(os.environ.get('RRF_K', '60'))
+
+
+class BM25Index:
+    """
+    Постинги тенанта в памяти: term -> (номера строк EmbeddingIndex, tf).
+
+    Постинги и длины чанков считаются при индексации в process-pdf;
+    df, число чанков и средняя длина выводятся из них при загрузке.
+    """
+
+    def __init__(self, postings: Dict[str, Tuple[np.ndarray, np.ndarray]], doc_lens: np.ndarray):
+        self.postings = postings
+        self.doc_lens = doc_lens.astype(np.float32)
+        indexed = self.doc_lens > 0
+        self.n_docs = int(indexed.sum())
+        self.avg_len = float(self.doc_lens[indexed].mean()) if self.n_docs else 0.0
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple[int, str, int]], chunk_rows: Dict[int, int], doc_lens: np.ndarray) -> 'BM25Index':
+        """
+        Построить индекс из строк (chunk_id, term, tf); chunk_rows сопоставляет
+        chunk_id с номером строки в EmbeddingIndex.
+        """
+        grouped: Dict[str, Tuple[List[int], List[int]]] = {}
+        for chunk_id, term, tf in rows:
+            row = chunk_rows.get(chunk_id)
+            if row is None:
+                continue
+            ids, tfs = grouped.setdefault(term, ([], []))
+            ids.append(row)
+            tfs.append(tf)
+
+        postings = {
+            term: (np.asarray(ids, dtype=np.int32), np.asarray(tfs, dtype=np.float32))
+            for term, (ids, tfs) in grouped.items()
+        }
+        return cls(postings, doc_lens)
+
+    @property
+    def nbytes(self) -> int:
+        return self.doc_lens.nbytes + sum(ids.nbytes + tfs.nbytes for ids, tfs in self.postings.values())
+
+    def scores(self, query_terms: Sequence[str]) -> np.ndarray:
+        scores = np.zeros(len(self.doc_lens), dtype=np.float32)
+        if not self.n_docs:
+            return scores
+
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lens / self.avg_len)
+        for term in set(query_terms):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            ids, tfs = posting
+            idf = np.log(1 + (self.n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[ids])
+        return scores
+
+
+def reciprocal_rank_fusion(rankings: Sequence[np.ndarray], k: int = RRF_K) -> List[int]:
+    """Слияние ранжирований: score = сумма 1 / (k + rank) по всем спискам"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking.tolist()):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=lambda row: fused[row], reverse=True)
@@ -32,6 +32,8 @@ RAG_TOPK_FALLBACK = int(os.environ.get('RAG_TOPK_FALLBACK', '10'))
 RAG_LOW_OVERLAP_WINDOW = int(os.environ.get('RAG_LOW_OVERLAP_WINDOW', '50'))
 RAG_LOW_OVERLAP_THRESHOLD = float(os.environ.get('RAG_LOW_OVERLAP_THRESHOLD', '0.25'))
 RAG_LOW_OVERLAP_START_TOPK5 = os.environ.get('RAG_LOW_OVERLAP_START_TOPK5', 'true').lower() == 'true'
+RAG_HYBRID_SEARCH = os.environ.get('RAG_HYBRID_SEARCH', 'true').lower() == 'true'
+RAG_HYBRID_CANDIDATES = int(os.environ.get('RAG_HYBRID_CANDIDATES', '50'))
 
 low_overlap_window = deque(maxlen=RAG_LOW_OVERLAP_WINDOW)
 
@@ -68,6 +70,10 @@ def tokenize(text: str, lang: str) -> List[str]:
         return [t for t in raw if t not in STOPWORDS_EN]
     return raw
 
+def index_terms(text: str) -> List[str]:
+    """Термины чанка для BM25: язык документа заранее неизвестен, убираем стоп-слова обоих языков"""
+    return [t for t in tokenize(text, "other") if t not in STOPWORDS_RU and t not in STOPWORDS_EN]
+
 def sanitize_chunk(text: str) -> str:
     patterns = [
         r"\bpage_number\b\s*[:=]\s*\d+",
@@ -97,11 +103,15 @@ def classify_query_type(user_text: str) -> str:
 
     return "services"
 
-def build_context_with_scores(scored_chunks: List[Tuple[str, float]], top_k: int = 3, max_chars_per_chunk: int = 2200) -> Tuple[str, List[float]]:
+def build_context_with_scores(scored_chunks: List[Tuple[str, float]], top_k: int = 3, max_chars_per_chunk: int = 2200, presorted: bool = False) -> Tuple[str, List[float]]:
     if not scored_chunks:
         return "", []
 
-    sorted_chunks = sorted(scored_chunks, key=lambda x: x[1], reverse=True)[:top_k]
+    # presorted: порядок уже задан гибридным ранжированием, similarity нужны только для gate
+    if presorted:
+        sorted_chunks = scored_chunks[:top_k]
+    else:
+        sorted_chunks = sorted(scored_chunks, key=lambda x: x[1], reverse=True)[:top_k]
 
     parts: List[str] = []
     sims: List[float] = []
@@ -0,0 +1,81 @@
+"""Кэш ai_settings тенантов между тёплыми вызовами с проверкой версии по updated_at"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from db import execute_prepared
+
+# Сколько секунд доверяем кэшу без единого запроса; дальше — только дешёвая проверка версии
+SETTINGS_CACHE_TTL = float(os.environ.get('SETTINGS_CACHE_TTL', '5'))
+
+# tenant_id -> (checked_at, version, ai_settings, settings_hash)
+_entries: Dict[int, Tuple[float, Optional[str], Optional[dict], str]] = {}
+_lock = threading.Lock()
+_stats = {'fresh_hits': 0, 'version_hits': 0, 'misses': 0}
+
+
+def settings_hash(settings: Optional[dict]) -> str:
+    """Отпечаток ai_settings: любое сохранение настроек делает старые ответы недействительными"""
+    return hashlib.sha256(json.dumps(settings or {}, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def get_settings_version(cur, tenant_id: int) -> Optional[str]:
+    """
+    Версия настроек тенанта — tenant_settings.updated_at.
+    update-ai-settings и update-widget-settings обновляют её при каждом сохранении.
+    """
+    execute_prepared(cur, 'tenant_settings_version', (tenant_id,))
+    row = cur.fetchone()
+    return row[0].isoformat() if row and row[0] else None
+
+
+def _count(outcome: str) -> Dict:
+    with _lock:
+        _stats[outcome] += 1
+        return {**_stats, 'entries': len(_entries)}
+
+
+def get_tenant_ai_settings(cur, tenant_id: int) -> Tuple[Optional[dict], str, Dict]:
+    """
+    ai_settings тенанта из кэша или из БД.
+
+    Полный JSONB читается только при смене версии. Возвращённый dict общий
+    для всех вызовов процесса — изменять его нельзя.
+
+    Returns:
+        (ai_settings или None, settings_hash, cache_info)
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(tenant_id)
+
+    if entry is not None and now - entry[0] < SETTINGS_CACHE_TTL:
+        return entry[2], entry[3], {'level': 'fresh', **_count('fresh_hits')}
+
+    version = get_settings_version(cur, tenant_id)
+    if entry is not None and entry[1] == version:
+        with _lock:
+            _entries[tenant_id] = (now, version, entry[2], entry[3])
+        return entry[2], entry[3], {'level': 'version', **_count('version_hits')}
+
+    execute_prepared(cur, 'tenant_ai_settings', (tenant_id,))
+    row = cur.fetchone()
+    ai_settings = row[0] if row else None
+    version = row[1].isoformat() if row and row[1] else None
+    digest = settings_hash(ai_settings)
+
+    with _lock:
+        _entries[tenant_id] = (now, version, ai_settings, digest)
+    return ai_settings, digest, {'level': 'miss', **_count('misses')}
+
+
+def invalidate_tenant(tenant_id: Optional[int]):
+    """Сбросить настройки тенанта; None — сбросить все"""
+    with _lock:
+        if tenant_id is None:
+            _entries.clear()
+        else:
+            _entries.pop(tenant_id, None)
@@ -1,11 +1,11 @@
 import json
-import os
-import psycopg2
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """Проверка истечения подписок и отправка уведомлений (запускается ежедневно)"""
     method = event.get('httpMethod', 'GET')
@@ -23,7 +23,7 @@ def handler(event: dict, context) -> dict:
         }
 
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         now = datetime.utcnow()
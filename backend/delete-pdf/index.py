@@ -1,8 +1,10 @@
 import json
 import os
-import psycopg2
 import boto3
 from auth_middleware import get_tenant_id_from_request
+from invalidation_bus import notify_invalidation, KIND_CORPUS
+
+from db import get_connection
 
 def handler(event: dict, context) -> dict:
     """Удаление PDF документа и всех связанных данных"""
@@ -44,7 +46,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
 
         cur.execute("""
@@ -81,6 +83,15 @@ def handler(event: dict, context) -> dict:
             WHERE document_id = %s
         """, (document_id,))
 
+        # Удаление чанков меняет версию корпуса тенанта и сбрасывает кэш индекса в chat
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks 
+            WHERE document_id = %s
+            RETURNING tenant_id
+        """, (document_id,))
+        for chunks_tenant_id in {row[0] for row in cur.fetchall()}:
+            notify_invalidation(cur, chunks_tenant_id, KIND_CORPUS)
+
         cur.execute("""
             DELETE FROM t_p56134400_telegram_ai_bot_pdf.documents 
             WHERE id = %s
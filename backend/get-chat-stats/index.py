@@ -1,9 +1,13 @@
 import json
 import os
-import psycopg2
 from datetime import datetime, timedelta
 from auth_middleware import get_tenant_id_from_request
 
+from db import get_connection
+
+# Окно по умолчанию для перцентилей стадий chat (часы), переопределяется ?timingsWindow=
+TIMINGS_WINDOW_HOURS = int(os.environ.get('TIMINGS_WINDOW_HOURS', '24'))
+
 def handler(event: dict, context) -> dict:
     """Получение статистики сообщений чата"""
     method = event.get('httpMethod', 'GET')
@@ -33,7 +37,7 @@ def handler(event: dict, context) -> dict:
         if auth_error:
             return auth_error
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
 
         cur.execute("""
@@ -104,6 +108,49 @@ def handler(event: dict, context) -> dict:
         top_users = cur.fetchall()
         top_users_list = [{'user': u[0], 'messages': u[1]} for u in top_users]
 
+        params = event.get('queryStringParameters') or {}
+        try:
+            window_hours = max(1, int(params.get('timingsWindow', TIMINGS_WINDOW_HOURS)))
+        except ValueError:
+            window_hours = TIMINGS_WINDOW_HOURS
+
+        # Перцентили по каждой стадии: stages — JSONB {стадия: мс}, плюс wall_ms всего вызова
+        cur.execute("""
+            SELECT stage,
+                   COUNT(*),
+                   PERCENTILE_CONT(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY ms)
+            FROM (
+                SELECT s.key AS stage, s.value::float AS ms
+                FROM t_p56134400_telegram_ai_bot_pdf.chat_timings t,
+                     jsonb_each_text(t.stages) s
+                WHERE t.tenant_id = %s
+                AND t.created_at >= NOW() - make_interval(hours => %s)
+                UNION ALL
+                SELECT 'total', wall_ms
+                FROM t_p56134400_telegram_ai_bot_pdf.chat_timings
+                WHERE tenant_id = %s
+                AND created_at >= NOW() - make_interval(hours => %s)
+            ) stage_samples
+            GROUP BY stage
+            ORDER BY stage
+        """, (tenant_id, window_hours, tenant_id, window_hours))
+        stage_latency = {}
+        for stage, count, percentiles in cur.fetchall():
+            stage_latency[stage] = {
+                'count': count,
+                'p50': round(percentiles[0], 1),
+                'p95': round(percentiles[1], 1),
+                'p99': round(percentiles[2], 1)
+            }
+
+        cur.execute("""
+            SELECT COUNT(*), AVG(chunk_count), AVG(prompt_chars), AVG(completion_tokens)
+            FROM t_p56134400_telegram_ai_bot_pdf.chat_timings
+            WHERE tenant_id = %s
+            AND created_at >= NOW() - make_interval(hours => %s)
+        """, (tenant_id, window_hours))
+        timings_row = cur.fetchone()
+
         cur.close()
         conn.close()
 
@@ -117,7 +164,15 @@ def handler(event: dict, context) -> dict:
                 'messagesWeek': messages_week,
                 'popularQuestions': popular_questions_list,
                 'dailyStats': daily_stats_list,
-                'topUsers': top_users_list
+                'topUsers': top_users_list,
+                'stageLatency': {
+                    'windowHours': window_hours,
+                    'requests': timings_row[0],
+                    'avgChunkCount': round(float(timings_row[1]), 1) if timings_row[1] is not None else None,
+                    'avgPromptChars': round(float(timings_row[2])) if timings_row[2] is not None else None,
+                    'avgCompletionTokens': round(float(timings_row[3]), 1) if timings_row[3] is not None else None,
+                    'stages': stage_latency
+                }
             }),
             'isBase64Encoded': False
         }
@@ -1,8 +1,8 @@
 import json
-import os
-import psycopg2
 from auth_middleware import get_tenant_id_from_request
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """Получение списка всех документов"""
     method = event.get('httpMethod', 'GET')
@@ -32,7 +32,7 @@ def handler(event: dict, context) -> dict:
         if auth_error:
             return auth_error
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("""
@@ -1,9 +1,10 @@
 import json
 import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
 from auth_middleware import get_tenant_id_from_request, require_auth
 
+from db import get_connection
+
 
 def handler(event: dict, context) -> dict:
     """Получение и сохранение настроек мессенджеров (Telegram, WhatsApp, VK)"""
@@ -66,7 +67,7 @@ def handle_get(event: dict, dsn: str) -> dict:
                 'body': json.dumps({'error': 'Invalid messenger_type'})
             }
         
-        conn = psycopg2.connect(dsn)
+        conn = get_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         cur.execute("""
@@ -156,7 +157,7 @@ def handle_post(event: dict, dsn: str) -> dict:
                 'body': json.dumps({'error': 'Invalid messenger_type'})
             }
         
-        conn = psycopg2.connect(dsn)
+        conn = get_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         cur.execute("""
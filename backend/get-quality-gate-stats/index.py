@@ -1,8 +1,8 @@
 import json
-import os
-import psycopg2
 from auth_middleware import get_tenant_id_from_request
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """Получение статистики Quality Gate"""
     method = event.get('httpMethod', 'GET')
@@ -32,64 +32,89 @@ def handler(event: dict, context) -> dict:
         if auth_error:
             return auth_error
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
 
         cur.execute("""
             SELECT 
                 COUNT(*) as total,
                 SUM(CASE WHEN context_ok THEN 1 ELSE 0 END) as passed,
-                SUM(CASE WHEN NOT context_ok THEN 1 ELSE 0 END) as failed
+                SUM(CASE WHEN NOT context_ok THEN 1 ELSE 0 END) as failed,
+                SUM(CASE WHEN answer_cache_hit THEN 1 ELSE 0 END) as answer_cache_hits
             FROM t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
-        """)
+            WHERE tenant_id = %s
+        """, (tenant_id,))
         totals = cur.fetchone()
         total = int(totals[0]) if totals[0] else 0
         passed = int(totals[1]) if totals[1] else 0
         failed = int(totals[2]) if totals[2] else 0
+        answer_cache_hits = int(totals[3]) if totals[3] else 0
         pass_rate = (passed / total * 100) if total > 0 else 0
 
+        cur.execute("""
+            SELECT streamed,
+                   COUNT(ttft_ms),
+                   AVG(ttft_ms),
+                   PERCENTILE_CONT(0.95) WITHIN GROUP (ORDER BY ttft_ms),
+                   AVG(llm_ms)
+            FROM t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
+            WHERE tenant_id = %s AND llm_ms IS NOT NULL
+            GROUP BY streamed
+        """, (tenant_id,))
+        ttft = {}
+        for row in cur.fetchall():
+            ttft['stream' if row[0] else 'blocking'] = {
+                'count': int(row[1]),
+                'avg_ms': round(float(row[2]), 1) if row[2] is not None else None,
+                'p95_ms': round(float(row[3]), 1) if row[3] is not None else None,
+                'avg_llm_ms': round(float(row[4]), 1) if row[4] is not None else None
+            }
+
         cur.execute("""
             SELECT gate_reason, COUNT(*) 
             FROM t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
+            WHERE tenant_id = %s
             GROUP BY gate_reason
             ORDER BY COUNT(*) DESC
-        """)
+        """, (tenant_id,))
         by_reason = {row[0]: int(row[1]) for row in cur.fetchall()}
 
         cur.execute("""
             SELECT query_type, COUNT(*) 
             FROM t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
-            WHERE query_type IS NOT NULL
+            WHERE tenant_id = %s AND query_type IS NOT NULL
             GROUP BY query_type
             ORDER BY COUNT(*) DESC
-        """)
+        """, (tenant_id,))
         by_query_type = {row[0]: int(row[1]) for row in cur.fetchall()}
 
         cur.execute("""
             SELECT lang, COUNT(*) 
             FROM t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
-            WHERE lang IS NOT NULL
+            WHERE tenant_id = %s AND lang IS NOT NULL
             GROUP BY lang
             ORDER BY COUNT(*) DESC
-        """)
+        """, (tenant_id,))
         by_lang = {row[0]: int(row[1]) for row in cur.fetchall()}
 
         cur.execute("""
             SELECT top_k_used, COUNT(*) 
             FROM t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
-            WHERE top_k_used IS NOT NULL
+            WHERE tenant_id = %s AND top_k_used IS NOT NULL
             GROUP BY top_k_used
             ORDER BY top_k_used
-        """)
+        """, (tenant_id,))
         by_top_k = {int(row[0]): int(row[1]) for row in cur.fetchall()}
 
         cur.execute("""
             SELECT id, user_message, context_ok, gate_reason, query_type, 
-                   lang, best_similarity, context_len, overlap, key_tokens, top_k_used, created_at
+                   lang, best_similarity, context_len, overlap, key_tokens, top_k_used, created_at,
+                   ttft_ms, streamed
             FROM t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
+            WHERE tenant_id = %s
             ORDER BY created_at DESC
             LIMIT 50
-        """)
+        """, (tenant_id,))
         logs_rows = cur.fetchall()
         recent_logs = []
         for row in logs_rows:
@@ -105,7 +130,9 @@ def handler(event: dict, context) -> dict:
                 'overlap': float(row[8]) if row[8] is not None else None,
                 'key_tokens': row[9],
                 'top_k_used': row[10],
-                'created_at': row[11].isoformat() if row[11] else None
+                'created_at': row[11].isoformat() if row[11] else None,
+                'ttft_ms': float(row[12]) if row[12] is not None else None,
+                'streamed': bool(row[13])
             })
 
         cur.close()
@@ -120,10 +147,12 @@ def handler(event: dict, context) -> dict:
                     'passed': passed,
                     'failed': failed,
                     'pass_rate': pass_rate,
+                    'answer_cache_hits': answer_cache_hits,
                     'by_reason': by_reason,
                     'by_query_type': by_query_type,
                     'by_lang': by_lang,
-                    'by_top_k': by_top_k
+                    'by_top_k': by_top_k,
+                    'ttft': ttft
                 },
                 'recent_logs': recent_logs
             }),
@@ -0,0 +1,128 @@
+"""Семантический кэш ответов ассистента для повторяющихся вопросов гостей"""
+import os
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedding_codec import normalize_embedding, pack_embedding
+from retrieval import EmbeddingIndex
+
+ANSWER_CACHE_THRESHOLD = float(os.environ.get('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', '500'))
+
+# tenant_id -> (версия набора записей, id записей, gate_reason записей, индекс вопросов)
+_entries: Dict[int, Tuple[tuple, list, list, EmbeddingIndex]] = {}
+_lock = threading.Lock()
+
+
+def _load_entries(cur, tenant_id: int, corpus_version: str, settings_digest: str):
+    cur.execute("""
+        SELECT COUNT(*), COALESCE(MAX(id), 0)
+        FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+        WHERE tenant_id = %s AND corpus_version = %s AND settings_hash = %s
+    """, (tenant_id, corpus_version, settings_digest))
+    version = (corpus_version, settings_digest) + tuple(cur.fetchone())
+
+    with _lock:
+        cached = _entries.get(tenant_id)
+    if cached is not None and cached[0] == version:
+        return cached
+
+    cur.execute("""
+        SELECT id, answer, gate_reason, query_embedding
+        FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+        WHERE tenant_id = %s AND corpus_version = %s AND settings_hash = %s
+        ORDER BY id DESC
+        LIMIT %s
+    """, (tenant_id, corpus_version, settings_digest, ANSWER_CACHE_MAX_ENTRIES))
+    rows = cur.fetchall()
+
+    ids = [row[0] for row in rows]
+    gate_reasons = [row[2] for row in rows]
+    # Вопросы хранятся нормализованными, поэтому близость — скалярное произведение
+    index = EmbeddingIndex.from_rows([(row[1], row[3], 'float32', None, True) for row in rows])
+
+    entry = (version, ids, gate_reasons, index)
+    with _lock:
+        _entries[tenant_id] = entry
+    return entry
+
+
+def lookup_cached_answer(cur, tenant_id: int, corpus_version: str, settings_digest: str,
+                         query_embedding: Sequence[float], threshold: float) -> Tuple[Optional[Dict], Dict]:
+    """
+    Найти ответ на достаточно близкий вопрос при той же версии корпуса и настроек.
+
+    Returns:
+        (cached или None, cache_info) - cached содержит answer, gate_reason, similarity
+    """
+    cur.execute("SAVEPOINT answer_cache")
+    try:
+        _, ids, gate_reasons, index = _load_entries(cur, tenant_id, corpus_version, settings_digest)
+        cur.execute("RELEASE SAVEPOINT answer_cache")
+    except Exception as e:
+        print(f"Answer cache read error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT answer_cache")
+        return None, {'hit': False, 'error': str(e)}
+
+    if not len(index):
+        return None, {'hit': False, 'entries': 0}
+
+    scores = index.scores(query_embedding)
+    best = int(np.argmax(scores))
+    similarity = float(scores[best])
+    info = {'hit': similarity >= threshold, 'entries': len(index), 'best_similarity': round(similarity, 4)}
+    if not info['hit']:
+        return None, info
+
+    cur.execute("""
+        UPDATE t_p56134400_telegram_ai_bot_pdf.answer_cache
+        SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    """, (ids[best],))
+
+    return {
+        'answer': index.chunk_texts[best],
+        'gate_reason': gate_reasons[best],
+        'similarity': similarity,
+    }, info
+
+
+def store_answer(cur, tenant_id: int, corpus_version: str, settings_digest: str,
+                 user_message: str, query_embedding: Sequence[float], answer: str, gate_reason: str):
+    """Сохранить ответ и убрать записи от прошлых версий корпуса/настроек и сверх лимита"""
+    cur.execute("SAVEPOINT answer_cache")
+    try:
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+            WHERE tenant_id = %s AND (corpus_version <> %s OR settings_hash <> %s)
+        """, (tenant_id, corpus_version, settings_digest))
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.answer_cache
+            (tenant_id, corpus_version, settings_hash, query_text, query_embedding, answer, gate_reason)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, (tenant_id, corpus_version, settings_digest, user_message,
+              pack_embedding(normalize_embedding(query_embedding), 'float32'), answer, gate_reason))
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+            WHERE tenant_id = %s AND id NOT IN (
+                SELECT id FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+                WHERE tenant_id = %s
+                ORDER BY last_used_at DESC
+                LIMIT %s
+            )
+        """, (tenant_id, tenant_id, ANSWER_CACHE_MAX_ENTRIES))
+        cur.execute("RELEASE SAVEPOINT answer_cache")
+    except Exception as e:
+        print(f"Answer cache write error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT answer_cache")
+
+
+def invalidate_tenant(tenant_id: Optional[int]):
+    """Сбросить записи тенанта; None — сбросить все"""
+    with _lock:
+        if tenant_id is None:
+            _entries.clear()
+        else:
+            _entries.pop(tenant_id, None)
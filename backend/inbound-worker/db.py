@@ -0,0 +1,196 @@
+"""
+Общий пул соединений с Postgres для функций backend.
+
+Исходник — backend/shared/db.py; каждая функция деплоится отдельно, поэтому
+рядом с её index.py лежит копия, которую обновляет python sync_shared.py.
+
+Пул живёт в глобальной переменной модуля и переживает тёплые вызовы.
+conn.close() у соединения из пула не закрывает сокет, а возвращает его
+в пул, поэтому обработчикам достаточно заменить psycopg2.connect(...)
+на get_connection(). Соединение, брошенное без close() (ранний return),
+просто закрывается сборщиком мусора и в пул не попадает.
+"""
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Sequence
+
+import psycopg2
+import psycopg2.extensions
+
+DB_POOL_MAX_IDLE = int(os.environ.get('DB_POOL_MAX_IDLE', '4'))
+# После такого простоя соединение перед выдачей проверяется SELECT 1
+DB_POOL_HEALTHCHECK_AFTER = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30'))
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))
+DB_POOL_LOG = os.environ.get('DB_POOL_LOG', 'true').lower() == 'true'
+# За pgbouncer в режиме transaction серверные prepared statements не живут между транзакциями
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', 'true').lower() == 'true'
+
+# Горячие запросы: PREPARE один раз на соединение, дальше EXECUTE без разбора и планирования
+PREPARED_STATEMENTS = {
+    'tenant_settings_version': """
+        SELECT updated_at
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
+        WHERE tenant_id = %s
+    """,
+    'tenant_ai_settings': """
+        SELECT ai_settings, updated_at
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
+        WHERE tenant_id = %s
+    """,
+    'tenant_corpus_version': """
+        SELECT COUNT(*), COALESCE(MAX(id), 0)
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        WHERE tenant_id = %s AND (embedding_bin IS NOT NULL OR embedding_text IS NOT NULL)
+    """,
+    # JSON тянем только для строк, ещё не переведённых в embedding_bin
+    'tenant_chunks': """
+        SELECT id, COALESCE(token_count, 0), chunk_text, embedding_bin, embedding_dtype,
+               CASE WHEN embedding_bin IS NULL THEN embedding_text END,
+               embedding_normalized
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        WHERE tenant_id = %s AND (embedding_bin IS NOT NULL OR embedding_text IS NOT NULL)
+    """,
+    'tenant_chunk_terms': """
+        SELECT chunk_id, term, tf
+        FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunk_terms
+        WHERE tenant_id = %s
+    """,
+    'insert_chat_message': """
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_messages (session_id, role, content)
+        VALUES (%s, %s, %s)
+    """,
+}
+
+_idle: List['PooledConnection'] = []
+_lock = threading.Lock()
+_stats = {'connects': 0, 'reuses': 0, 'healthchecks': 0, 'healthcheck_failures': 0, 'discarded': 0, 'prepares': 0}
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Соединение пула: close() возвращает его в пул, physical_close() закрывает сокет"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.released_at = self.created_at
+        self.prepared = set()
+
+    def close(self):
+        release_connection(self)
+
+    def physical_close(self):
+        super().close()
+
+
+def _count(outcome: str):
+    with _lock:
+        _stats[outcome] += 1
+
+
+def pool_stats() -> Dict:
+    """Счётчики пула процесса; процесс обслуживает одну функцию, поэтому это статистика функции"""
+    with _lock:
+        checkouts = _stats['connects'] + _stats['reuses']
+        return {
+            **_stats,
+            'idle': len(_idle),
+            'reuse_ratio': round(_stats['reuses'] / checkouts, 4) if checkouts else None,
+        }
+
+
+def _is_healthy(conn: 'PooledConnection', now: float) -> bool:
+    if conn.closed or now - conn.created_at > DB_POOL_MAX_LIFETIME:
+        return False
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return False
+    if now - conn.released_at < DB_POOL_HEALTHCHECK_AFTER:
+        return True
+
+    _count('healthchecks')
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except Exception as e:
+        print(f"DB pool health check failed: {e}")
+        _count('healthcheck_failures')
+        return False
+
+
+def get_connection() -> 'PooledConnection':
+    """Соединение из пула (с проверкой перед повторным использованием) или новое"""
+    while True:
+        with _lock:
+            conn = _idle.pop() if _idle else None
+        if conn is None:
+            break
+        if _is_healthy(conn, time.monotonic()):
+            _count('reuses')
+            if DB_POOL_LOG:
+                print(f"DB pool: reused connection, {pool_stats()}")
+            return conn
+        _discard(conn)
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=PooledConnection)
+    _count('connects')
+    if DB_POOL_LOG:
+        print(f"DB pool: new connection, {pool_stats()}")
+    return conn
+
+
+def _discard(conn: 'PooledConnection'):
+    _count('discarded')
+    try:
+        conn.physical_close()
+    except Exception:
+        pass
+
+
+def release_connection(conn: 'PooledConnection'):
+    """Вернуть соединение в пул; незавершённая транзакция откатывается"""
+    if conn.closed:
+        return
+    try:
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except Exception:
+        _discard(conn)
+        return
+
+    now = time.monotonic()
+    conn.released_at = now
+    with _lock:
+        keep = len(_idle) < DB_POOL_MAX_IDLE and now - conn.created_at <= DB_POOL_MAX_LIFETIME
+        if keep:
+            _idle.append(conn)
+    if not keep:
+        _discard(conn)
+
+
+def _to_server_params(sql: str) -> str:
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f'${next(counter)}', sql)
+
+
+def execute_prepared(cur, name: str, params: Sequence):
+    """
+    Выполнить запрос из PREPARED_STATEMENTS через серверный prepared statement.
+    Для соединений не из пула (или заглушек) выполняется обычный cur.execute.
+    """
+    sql = PREPARED_STATEMENTS[name]
+    prepared = getattr(getattr(cur, 'connection', None), 'prepared', None)
+    if prepared is None or not DB_PREPARED_STATEMENTS:
+        cur.execute(sql, params)
+        return
+
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {_to_server_params(sql)}")
+        prepared.add(name)
+        _count('prepares')
+
+    placeholders = ', '.join(['%s'] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})", params)
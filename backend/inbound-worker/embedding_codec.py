@@ -0,0 +1,37 @@
+"""Упаковка эмбеддингов в компактный бинарный формат для колонки embedding_bin"""
+import math
+import os
+import struct
+from typing import List, Sequence
+
+# Тип элементов -> формат struct / dtype NumPy (всегда little-endian)
+EMBEDDING_DTYPES = {
+    'float32': ('f', '<f4'),
+    'float16': ('e', '<f2'),
+}
+
+EMBEDDING_STORAGE_DTYPE = os.environ.get('EMBEDDING_STORAGE_DTYPE', 'float32')
+EMBEDDING_WRITE_JSON = os.environ.get('EMBEDDING_WRITE_JSON', 'true').lower() == 'true'
+
+
+def normalize_embedding(vector: Sequence[float]) -> List[float]:
+    """L2-нормализация: после неё косинусная близость равна скалярному произведению"""
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        return list(vector)
+    return [x / norm for x in vector]
+
+
+def pack_embedding(vector: Sequence[float], dtype: str = EMBEDDING_STORAGE_DTYPE) -> bytes:
+    """Упаковать вектор в little-endian float32/float16 байты"""
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f'Неизвестный тип эмбеддинга: {dtype}')
+    fmt = EMBEDDING_DTYPES[dtype][0]
+    return struct.pack(f'<{len(vector)}{fmt}', *vector)
+
+
+def unpack_embedding(data: bytes, dtype: str = 'float32') -> List[float]:
+    """Распаковать байты embedding_bin обратно в список float (без NumPy)"""
+    fmt = EMBEDDING_DTYPES[dtype][0]
+    size = struct.calcsize(f'<{fmt}')
+    return list(struct.unpack(f'<{len(data) // size}{fmt}', data))
@@ -0,0 +1,131 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append('/function/code')
+from api_keys_helper import invalidate_tenant_api_keys
+from db import get_connection
+from inbound_queue import claim_messages, complete_message, fail_message, queue_stats, worker_authorized
+from invalidation_bus import drain_invalidations, register_handler, KIND_API_KEYS
+from messenger_reply import deliver_reply
+
+# Сколько секунд один вызов выбирает очередь (должно быть меньше таймаута функции)
+INBOUND_WORKER_BUDGET = float(os.environ.get('INBOUND_WORKER_BUDGET', '25'))
+INBOUND_WORKER_THREADS = int(os.environ.get('INBOUND_WORKER_THREADS', '8'))
+
+register_handler(KIND_API_KEYS, lambda tenant_id, version: invalidate_tenant_api_keys(tenant_id))
+
+# Пул живёт между тёплыми вызовами
+_executor = ThreadPoolExecutor(max_workers=INBOUND_WORKER_THREADS)
+
+
+def process_message(message: dict) -> str:
+    """Ответить на одно сообщение очереди; возвращает итоговый статус"""
+    try:
+        error = deliver_reply(message['tenant_id'], message['channel'], message['session_id'],
+                              message['reply_to'], message['user_message'], message['idempotency_key'])
+        if error:
+            raise Exception(json.loads(error['body'])['error'])
+    except Exception as e:
+        print(f"Inbound message {message['id']} attempt {message['attempts']} failed: {e}")
+        conn = get_connection()
+        try:
+            return fail_message(conn, message['id'], message['attempts'], str(e))
+        finally:
+            conn.close()
+
+    conn = get_connection()
+    try:
+        complete_message(conn, message['id'])
+    finally:
+        conn.close()
+    return 'done'
+
+
+def handler(event: dict, context) -> dict:
+    """Воркер очереди входящих сообщений мессенджеров: вызывает chat и отправляет ответы гостям
+
+    Запускается webhook-ами сразу после постановки сообщения в очередь и по
+    таймеру (раз в минуту) — для отложенных повторов и сообщений, которые
+    не забрал ни один вызов. GET возвращает состояние очереди.
+
+    HTTP-вызовы (webhook-и, GET) должны передать INBOUND_WORKER_SECRET в
+    заголовке X-Inbound-Worker-Secret; у вызова таймером нет httpMethod,
+    снаружи его не отправить.
+    """
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Inbound-Worker-Secret'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if 'httpMethod' in event and not worker_authorized(event):
+        print(f"Inbound worker: rejected {method} without valid secret")
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Forbidden'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        if method == 'GET':
+            conn = get_connection()
+            stats = queue_stats(conn)
+            conn.close()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'queue': stats}),
+                'isBase64Encoded': False
+            }
+
+        drain_invalidations()
+        started = time.monotonic()
+        processed = {'done': 0, 'pending': 0, 'dead': 0}
+
+        while time.monotonic() - started < INBOUND_WORKER_BUDGET:
+            conn = get_connection()
+            try:
+                batch = claim_messages(conn, INBOUND_WORKER_THREADS)
+            finally:
+                conn.close()
+            if not batch:
+                break
+            for status in _executor.map(process_message, batch):
+                processed[status] += 1
+
+        elapsed = time.monotonic() - started
+        print(f"Inbound worker: {processed} за {elapsed:.1f} c")
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'ok': True,
+                'processed': processed['done'],
+                'retried': processed['pending'],
+                'dead': processed['dead'],
+                'elapsed_seconds': round(elapsed, 2)
+            }),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        print(f'Inbound worker error: {e}')
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
@@ -0,0 +1,74 @@
+"""ANN-поиск по чанкам тенанта внутри Postgres (pgvector, HNSW)"""
+import json
+import os
+from typing import List, Optional, Sequence, Tuple
+
+PGVECTOR_EF_SEARCH = int(os.environ.get('PGVECTOR_EF_SEARCH', '100'))
+# Итеративный обход HNSW (pgvector >= 0.8) добирает кандидатов, пока фильтр по tenant_id не даст k строк;
+# off — не включать (старые версии pgvector)
+PGVECTOR_ITERATIVE_SCAN = os.environ.get('PGVECTOR_ITERATIVE_SCAN', 'strict_order')
+
+
+def _enable_iterative_scan(cur):
+    """SET hnsw.iterative_scan в своём SAVEPOINT: на pgvector < 0.8 параметра нет"""
+    if PGVECTOR_ITERATIVE_SCAN == 'off':
+        return
+    cur.execute("SAVEPOINT pgvector_iterative_scan")
+    try:
+        cur.execute(f"SET LOCAL hnsw.iterative_scan = {PGVECTOR_ITERATIVE_SCAN}")
+        cur.execute("RELEASE SAVEPOINT pgvector_iterative_scan")
+    except Exception as e:
+        print(f"pgvector iterative scan unavailable: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT pgvector_iterative_scan")
+
+
+def search_pgvector(cur, tenant_id: int, query_embedding: Sequence[float], top_k: int) -> Optional[List[Tuple[str, float]]]:
+    """
+    Вернуть top_k пар (chunk_text, similarity) по косинусной близости,
+    посчитанной в БД через ORDER BY embedding <=> query LIMIT k.
+
+    HNSW-индексы общие для всех тенантов, а tenant_id фильтруется после
+    обхода графа, поэтому у небольшого тенанта ANN может вернуть меньше k
+    строк. Тогда выполняется точный поиск по строкам тенанта (выражение без
+    приведения к vector(dim) индекс не использует), и результат логируется.
+
+    Выполняется в SAVEPOINT: при ошибке (нет расширения, колонки или индекса)
+    транзакция не ломается, а вызывающий код получает None и считает в функции.
+    """
+    dim = len(query_embedding)
+    query_vector = json.dumps([float(x) for x in query_embedding])
+
+    cur.execute("SAVEPOINT pgvector_search")
+    try:
+        # ef_search не меньше top_k, иначе HNSW вернёт меньше строк, чем просили
+        cur.execute("SET LOCAL hnsw.ef_search = %s", (max(PGVECTOR_EF_SEARCH, top_k),))
+        _enable_iterative_scan(cur)
+        # Приведение к vector(dim) должно совпадать с выражением частичного индекса из миграции
+        cur.execute(f"""
+            SELECT chunk_text, 1 - (embedding_vec::vector({dim}) <=> %s::vector({dim}))
+            FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+            WHERE tenant_id = %s AND embedding_dim = %s
+            ORDER BY embedding_vec::vector({dim}) <=> %s::vector({dim})
+            LIMIT %s
+        """, (query_vector, tenant_id, dim, query_vector, top_k))
+        rows = cur.fetchall()
+
+        if len(rows) < top_k:
+            cur.execute("""
+                SELECT chunk_text, 1 - (embedding_vec <=> %s::vector)
+                FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+                WHERE tenant_id = %s AND embedding_dim = %s
+                ORDER BY embedding_vec <=> %s::vector
+                LIMIT %s
+            """, (query_vector, tenant_id, dim, query_vector, top_k))
+            exact_rows = cur.fetchall()
+            print(f"pgvector ANN returned {len(rows)} of {top_k} rows for tenant {tenant_id}, "
+                  f"exact scan returned {len(exact_rows)}")
+            rows = exact_rows
+        cur.execute("RELEASE SAVEPOINT pgvector_search")
+    except Exception as e:
+        print(f"pgvector search error, falling back to in-function scoring: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT pgvector_search")
+        return None
+
+    return [(chunk_text, float(similarity)) for chunk_text, similarity in rows]
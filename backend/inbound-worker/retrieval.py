@@ -0,0 +1,126 @@
+"""Векторный поиск по чанкам тенанта на NumPy"""
+import json
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+from embedding_codec import EMBEDDING_DTYPES
+
+
+def top_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Номера top_k строк по убыванию score: argpartition и сортировка только отобранных"""
+    if top_k <= 0 or len(scores) == 0:
+        return np.array([], dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.sort(np.argpartition(-scores, top_k - 1)[:top_k])
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def decode_embedding(embedding_bin, embedding_dtype: str, embedding_text: str) -> np.ndarray:
+    """
+    Вектор чанка из бинарной колонки (без копирования) или, в период
+    двойного чтения, из старого JSON в embedding_text.
+    """
+    if embedding_bin is not None:
+        return np.frombuffer(embedding_bin, dtype=EMBEDDING_DTYPES[embedding_dtype or 'float32'][1])
+    return np.asarray(json.loads(embedding_text), dtype=np.float32)
+
+
+class EmbeddingIndex:
+    """
+    Эмбеддинги чанков тенанта в виде непрерывной матрицы float32.
+
+    Нормы строк считаются один раз при построении, поэтому поиск — это одно
+    умножение матрицы на вектор запроса и частичный отбор top-k (argpartition).
+    Для строк, нормализованных при записи (embedding_normalized), норма
+    принимается равной 1; если так у всех строк, деление на нормы пропускается.
+    """
+
+    def __init__(self, chunk_texts: List[str], matrix: np.ndarray, normalized: Optional[np.ndarray] = None):
+        self.chunk_texts = chunk_texts
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if normalized is None:
+            normalized = np.zeros(len(chunk_texts), dtype=bool)
+        self.all_normalized = bool(normalized.all())
+        self.norms = np.ones(len(chunk_texts), dtype=np.float32)
+        if not self.all_normalized:
+            self.norms[~normalized] = np.linalg.norm(self.matrix[~normalized], axis=1)
+        # Лексический индекс подключается отдельно, если у тенанта есть постинги BM25
+        self.bm25: Optional[BM25Index] = None
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[tuple]) -> 'EmbeddingIndex':
+        """
+        Построить индекс из строк
+        (chunk_text, embedding_bin, embedding_dtype, embedding_text, embedding_normalized).
+
+        Векторы разной длины дополняются нулями до максимальной размерности:
+        скалярное произведение и нормы при этом не меняются.
+        """
+        chunk_texts: List[str] = []
+        vectors: List[np.ndarray] = []
+        normalized: List[bool] = []
+        for chunk_text, embedding_bin, embedding_dtype, embedding_text, embedding_normalized in rows:
+            chunk_texts.append(chunk_text)
+            vectors.append(decode_embedding(embedding_bin, embedding_dtype, embedding_text))
+            normalized.append(bool(embedding_normalized))
+
+        dim = max((len(v) for v in vectors), default=0)
+        matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            matrix[i, :len(vector)] = vector
+
+        return cls(chunk_texts, matrix, np.array(normalized, dtype=bool))
+
+    def __len__(self) -> int:
+        return len(self.chunk_texts)
+
+    def scores(self, query_embedding: Sequence[float]) -> np.ndarray:
+        """Косинусная близость запроса ко всем чанкам (0 для нулевых векторов)"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        dim = min(len(query), self.matrix.shape[1])
+        query_norm = float(np.linalg.norm(query))
+        if query_norm == 0:
+            return np.zeros(len(self), dtype=np.float32)
+
+        dots = self.matrix[:, :dim] @ (query[:dim] / query_norm)
+        if self.all_normalized:
+            return dots
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        np.divide(dots, self.norms, out=scores, where=self.norms > 0)
+        return scores
+
+    def search(self, query_embedding: Sequence[float], top_k: int) -> List[Tuple[str, float]]:
+        """
+        Вернуть top_k пар (chunk_text, similarity) по убыванию близости —
+        в формате, который принимает build_context_with_scores.
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+
+        scores = self.scores(query_embedding)
+        return [(self.chunk_texts[i], float(scores[i])) for i in top_indices(scores, top_k)]
+
+    def hybrid_search(self, query_embedding: Sequence[float], query_terms: Sequence[str],
+                      top_k: int, candidates: int) -> List[Tuple[str, float]]:
+        """
+        Гибридный поиск: top-candidates по вектору и по BM25 сливаются через
+        reciprocal rank fusion. Пары возвращаются в порядке слияния, а similarity
+        остаётся косинусной, чтобы пороги quality gate не менялись.
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+
+        scores = self.scores(query_embedding)
+        rankings = [top_indices(scores, candidates)]
+        if self.bm25 is not None and query_terms:
+            lexical = self.bm25.scores(query_terms)
+            lexical_top = top_indices(lexical, candidates)
+            rankings.append(lexical_top[lexical[lexical_top] > 0])
+
+        fused = reciprocal_rank_fusion(rankings)[:top_k]
+        return [(self.chunk_texts[i], float(scores[i])) for i in fused]
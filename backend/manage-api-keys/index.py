@@ -2,9 +2,10 @@
 Управление API ключами клиентов - сохранение и получение индивидуальных ключей
 """
 import json
-import os
-import psycopg2
 from auth_middleware import get_tenant_id_from_request
+from invalidation_bus import notify_invalidation, KIND_API_KEYS
+
+from db import get_connection
 
 def handler(event: dict, context) -> dict:
     """Управление API ключами клиента"""
@@ -28,8 +29,7 @@ def handler(event: dict, context) -> dict:
         return auth_error
     
     try:
-        dsn = os.environ['DATABASE_URL']
-        conn = psycopg2.connect(dsn)
+        conn = get_connection()
         cur = conn.cursor()
         
         if method == 'GET':
@@ -86,7 +86,9 @@ def handler(event: dict, context) -> dict:
                 ON CONFLICT (tenant_id, provider, key_name)
                 DO UPDATE SET key_value = EXCLUDED.key_value, 
                               updated_at = CURRENT_TIMESTAMP
+                RETURNING updated_at
             """, (tenant_id, provider, key_name, key_value))
+            notify_invalidation(cur, tenant_id, KIND_API_KEYS, cur.fetchone()[0].isoformat())
             
             conn.commit()
             cur.close()
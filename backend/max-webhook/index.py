@@ -1,11 +1,15 @@
 import json
-import os
 import sys
-import requests
-import psycopg2
 
 sys.path.append('/function/code')
-from api_keys_helper import get_tenant_api_key
+from api_keys_helper import invalidate_tenant_api_keys
+from inbound_queue import queue_enabled, enqueue_message, kick_worker
+from invalidation_bus import drain_invalidations, register_handler, KIND_API_KEYS
+from messenger_reply import deliver_reply
+from tenant_routing import resolve_tenant, channel_session_id
+
+# Ключи, сохранённые через manage-api-keys, сбрасываются во всех тёплых экземплярах
+register_handler(KIND_API_KEYS, lambda tenant_id, version: invalidate_tenant_api_keys(tenant_id))
 
 def handler(event: dict, context) -> dict:
     """Webhook для MAX-бота: принимает сообщения и отвечает через AI-консьержа"""
@@ -32,6 +36,7 @@ def handler(event: dict, context) -> dict:
         }
 
     try:
+        drain_invalidations()
         body = json.loads(event.get('body', '{}'))
         
         if 'message' not in body:
@@ -54,43 +59,20 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        session_id = f"max-{chat_id}"
-        tenant_id = 1
-        chat_function_url = 'https://functions.poehali.dev/7b58f4fb-5db0-4f85-bb3b-55bafa4cbf73'
-
-        chat_response = requests.post(
-            chat_function_url,
-            json={
-                'message': user_message,
-                'sessionId': session_id,
-                'tenantId': tenant_id
-            },
-            headers={'Content-Type': 'application/json'},
-            timeout=30
-        )
-
-        if not chat_response.ok:
-            raise Exception(f'Chat function error: {chat_response.status_code}')
-
-        chat_data = chat_response.json()
-        ai_message = chat_data.get('message', 'Извините, не могу ответить')
-
-        bot_token, error = get_tenant_api_key(tenant_id, 'max', 'bot_token')
+        tenant_id, error = resolve_tenant('max', event, body)
         if error:
             return error
-
-        max_api_url = f'https://platform-api.max.ru/bot{bot_token}/sendMessage'
-        max_response = requests.post(
-            max_api_url,
-            json={
-                'chat_id': chat_id,
-                'text': ai_message
-            },
-            timeout=10
-        )
-
-        if not max_response.ok:
-            raise Exception(f'MAX API error: {max_response.status_code}')
+        session_id = channel_session_id('max', tenant_id, chat_id)
+
+        message_id = message.get('message_id') or (message.get('body') or {}).get('mid')
+        idempotency_key = f"max:{message_id}" if message_id else None
+        # Ответ готовит inbound-worker; без очереди (или если запись не удалась) — синхронно
+        if queue_enabled() and enqueue_message(tenant_id, 'max', session_id, chat_id, user_message, idempotency_key) is not None:
+            kick_worker()
+        else:
+            error = deliver_reply(tenant_id, 'max', session_id, chat_id, user_message, idempotency_key)
+            if error:
+                return error
 
         return {
             'statusCode': 200,
@@ -0,0 +1,146 @@
+"""Двухуровневый кэш эмбеддингов запросов: in-process LRU + таблица query_embedding_cache"""
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from embedding_codec import pack_embedding, unpack_embedding
+
+QUERY_EMB_CACHE_SIZE = int(os.environ.get('QUERY_EMB_CACHE_SIZE', '1000'))
+QUERY_EMB_CACHE_TTL = int(os.environ.get('QUERY_EMB_CACHE_TTL', str(7 * 24 * 3600)))
+QUERY_EMB_DB_MAX_ROWS = int(os.environ.get('QUERY_EMB_DB_MAX_ROWS', '50000'))
+# Доля записей, после которых чистим таблицу: вытеснение не должно стоить запроса на каждый промах
+QUERY_EMB_DB_EVICT_PROB = float(os.environ.get('QUERY_EMB_DB_EVICT_PROB', '0.02'))
+
+# cache_key -> (expires_at, embedding); порядок — от самого давнего использования
+_entries: 'OrderedDict[str, Tuple[float, List[float]]]' = OrderedDict()
+_lock = threading.Lock()
+_stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
+
+
+def normalize_query(text: str) -> str:
+    """Приводим вопрос к каноническому виду: регистр, пробелы, финальная пунктуация"""
+    text = text.lower().replace('ё', 'е')
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.…")
+
+
+def make_cache_key(embedding_provider: str, embedding_model: str, user_message: str) -> str:
+    raw = f"{embedding_provider}\n{embedding_model}\n{normalize_query(user_message)}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _l1_get(cache_key: str) -> Optional[List[float]]:
+    with _lock:
+        entry = _entries.get(cache_key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del _entries[cache_key]
+            return None
+        _entries.move_to_end(cache_key)
+        return entry[1]
+
+
+def _l1_put(cache_key: str, embedding: List[float]):
+    with _lock:
+        _entries[cache_key] = (time.time() + QUERY_EMB_CACHE_TTL, embedding)
+        _entries.move_to_end(cache_key)
+        while len(_entries) > QUERY_EMB_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def _count(outcome: str) -> Dict:
+    with _lock:
+        _stats[outcome] += 1
+        lookups = sum(_stats.values())
+        hits = _stats['l1_hits'] + _stats['l2_hits']
+        return {
+            **_stats,
+            'hit_rate': round(hits / lookups, 4),
+            'l1_entries': len(_entries),
+        }
+
+
+def get_cached_query_embedding(cur, embedding_provider: str, embedding_model: str, user_message: str) -> Tuple[Optional[List[float]], Dict]:
+    """
+    Найти эмбеддинг запроса сначала в памяти, затем в БД.
+
+    Returns:
+        (embedding или None, cache_info) - cache_info идёт в rag_debug_log
+    """
+    cache_key = make_cache_key(embedding_provider, embedding_model, user_message)
+
+    embedding = _l1_get(cache_key)
+    if embedding is not None:
+        return embedding, {'level': 'l1', 'key': cache_key[:12], **_count('l1_hits')}
+
+    cur.execute("SAVEPOINT query_embedding_cache")
+    try:
+        cur.execute("""
+            UPDATE t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+            SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+            WHERE cache_key = %s
+              AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+            RETURNING embedding_bin
+        """, (cache_key, QUERY_EMB_CACHE_TTL))
+        row = cur.fetchone()
+        cur.execute("RELEASE SAVEPOINT query_embedding_cache")
+    except Exception as e:
+        print(f"Query embedding cache read error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT query_embedding_cache")
+        row = None
+
+    if row:
+        embedding = unpack_embedding(bytes(row[0]), 'float32')
+        _l1_put(cache_key, embedding)
+        return embedding, {'level': 'l2', 'key': cache_key[:12], **_count('l2_hits')}
+
+    return None, {'level': 'miss', 'key': cache_key[:12], **_count('misses')}
+
+
+def put_query_embedding(cur, embedding_provider: str, embedding_model: str, user_message: str, embedding: List[float]):
+    """Сохранить свежий эмбеддинг запроса в оба уровня кэша"""
+    cache_key = make_cache_key(embedding_provider, embedding_model, user_message)
+    _l1_put(cache_key, list(embedding))
+
+    cur.execute("SAVEPOINT query_embedding_cache")
+    try:
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+            (cache_key, embedding_provider, embedding_model, query_text, embedding_bin)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE
+            SET embedding_bin = EXCLUDED.embedding_bin,
+                created_at = CURRENT_TIMESTAMP,
+                last_used_at = CURRENT_TIMESTAMP
+        """, (cache_key, embedding_provider, embedding_model, normalize_query(user_message),
+              pack_embedding(embedding, 'float32')))
+
+        if random.random() < QUERY_EMB_DB_EVICT_PROB:
+            evict_query_embeddings(cur)
+        cur.execute("RELEASE SAVEPOINT query_embedding_cache")
+    except Exception as e:
+        print(f"Query embedding cache write error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT query_embedding_cache")
+
+
+def evict_query_embeddings(cur):
+    """Удалить просроченные записи и самые давно использованные сверх QUERY_EMB_DB_MAX_ROWS"""
+    cur.execute("""
+        DELETE FROM t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+        WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+    """, (QUERY_EMB_CACHE_TTL,))
+    cur.execute("""
+        DELETE FROM t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+        WHERE cache_key IN (
+            SELECT cache_key
+            FROM t_p56134400_telegram_ai_bot_pdf.query_embedding_cache
+            ORDER BY last_used_at DESC
+            OFFSET %s
+        )
+    """, (QUERY_EMB_DB_MAX_ROWS,))
@@ -1,8 +1,8 @@
 import json
-import os
-import psycopg2
 from auth_middleware import get_tenant_id_from_request
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     '''Управление настройками автосообщений для мессенджеров'''
     
@@ -24,8 +24,7 @@ def handler(event: dict, context) -> dict:
         if auth_error:
             return auth_error
 
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = get_connection()
         cur = conn.cursor()
         
         if method == 'GET':
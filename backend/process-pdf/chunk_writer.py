@@ -0,0 +1,93 @@
+"""Пакетная запись чанков документа в document_chunks, tenant_chunks и tenant_chunk_terms"""
+import os
+from typing import Dict, List, Sequence
+
+from psycopg2.extras import execute_values
+
+# Строк на один INSERT ... VALUES: один round trip на пачку для каждой таблицы
+CHUNK_INSERT_PAGE_SIZE = int(os.environ.get('CHUNK_INSERT_PAGE_SIZE', '500'))
+TERM_INSERT_PAGE_SIZE = int(os.environ.get('TERM_INSERT_PAGE_SIZE', '5000'))
+
+
+def _insert_tenant_chunks(cur, tenant_id: int, document_id: int, chunks: Sequence[Dict], with_vector: bool) -> List[tuple]:
+    """INSERT в tenant_chunks; embedding_vec и embedding_dim — только для pgvector"""
+    vector_columns = ', embedding_vec, embedding_dim' if with_vector else ''
+    vector_template = ', %s::vector, %s' if with_vector else ''
+    rows = []
+    for c in chunks:
+        row = (tenant_id, document_id, c['chunk_text'], c['chunk_index'], c['embedding_text'], c['embedding_bin'],
+               c['embedding_dtype'], c['embedding_normalized'], sum(c['terms'].values()))
+        rows.append((row + (c['embedding_vec'], c['embedding_dim'])) if with_vector else row)
+
+    # RETURNING не гарантирует порядок строк, поэтому id сопоставляем по chunk_index
+    return execute_values(cur, f"""
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        (tenant_id, document_id, chunk_text, chunk_index, embedding_text, embedding_bin, embedding_dtype,
+         embedding_normalized, token_count{vector_columns})
+        VALUES %s
+        RETURNING id, chunk_index
+    """, rows, template=f"(%s, %s, %s, %s, %s, %s, %s, %s, %s{vector_template})",
+        page_size=CHUNK_INSERT_PAGE_SIZE, fetch=True)
+
+
+def write_chunks(cur, tenant_id: int, document_id: int, chunks: Sequence[Dict], with_vector: bool = False) -> Dict:
+    """
+    Записать подготовленные чанки документа.
+
+    Каждый элемент chunks содержит chunk_index, chunk_text, embedding_text,
+    embedding_bin, embedding_dtype, embedding_vec, embedding_dim,
+    embedding_normalized и terms (Counter терминов BM25).
+
+    with_vector (тенант ищет через pgvector) дополнительно пишет embedding_vec.
+    Запись идёт в SAVEPOINT: если расширения или колонки нет, чанки
+    записываются без вектора и документ всё равно индексируется.
+
+    Returns:
+        Число записанных строк по таблицам и признак записи embedding_vec
+    """
+    if not chunks:
+        return {'document_chunks': 0, 'tenant_chunks': 0, 'tenant_chunk_terms': 0, 'pgvector': False}
+
+    execute_values(cur, """
+        INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunks
+        (document_id, chunk_text, chunk_index, embedding_text, embedding_bin, embedding_dtype, embedding_normalized)
+        VALUES %s
+    """, [
+        (document_id, c['chunk_text'], c['chunk_index'], c['embedding_text'], c['embedding_bin'],
+         c['embedding_dtype'], c['embedding_normalized'])
+        for c in chunks
+    ], page_size=CHUNK_INSERT_PAGE_SIZE)
+
+    returned = None
+    if with_vector:
+        cur.execute("SAVEPOINT chunk_vectors")
+        try:
+            returned = _insert_tenant_chunks(cur, tenant_id, document_id, chunks, True)
+            cur.execute("RELEASE SAVEPOINT chunk_vectors")
+        except Exception as e:
+            print(f"pgvector columns unavailable, writing chunks without embedding_vec: {e}")
+            cur.execute("ROLLBACK TO SAVEPOINT chunk_vectors")
+    vector_written = returned is not None
+    if returned is None:
+        returned = _insert_tenant_chunks(cur, tenant_id, document_id, chunks, False)
+    chunk_ids = {chunk_index: chunk_id for chunk_id, chunk_index in returned}
+
+    term_rows: List[tuple] = [
+        (tenant_id, chunk_ids[c['chunk_index']], term, tf)
+        for c in chunks
+        for term, tf in c['terms'].items()
+    ]
+    if term_rows:
+        execute_values(cur, """
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunk_terms
+            (tenant_id, chunk_id, term, tf)
+            VALUES %s
+        """, term_rows, page_size=TERM_INSERT_PAGE_SIZE)
+
+    return {
+        'document_chunks': len(chunks),
+        'tenant_chunks': len(chunk_ids),
+        'tenant_chunk_terms': len(term_rows),
+        'pgvector': vector_written,
+    }
+
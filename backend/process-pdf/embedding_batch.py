@@ -0,0 +1,150 @@
+"""Пакетная генерация эмбеддингов чанков при индексации документа"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# OpenAI принимает список текстов: один запрос на EMBED_BATCH_SIZE чанков
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '64'))
+# Yandex принимает один текст: ограниченный пул потоков и лимит запросов в секунду
+EMBED_CONCURRENCY = int(os.environ.get('EMBED_CONCURRENCY', '8'))
+EMBED_RATE_LIMITS = {
+    'openai': float(os.environ.get('OPENAI_EMBED_RPS', '50')),
+    'yandexgpt': float(os.environ.get('YANDEX_EMBED_RPS', '10')),
+}
+EMBED_MAX_RETRIES = int(os.environ.get('EMBED_MAX_RETRIES', '4'))
+EMBED_BACKOFF_BASE = float(os.environ.get('EMBED_BACKOFF_BASE', '0.5'))
+
+YANDEX_EMBEDDING_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding'
+
+# stats пишут потоки пула Yandex
+_stats_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Равномерно разносит запросы: не больше rps стартов в секунду на все потоки"""
+
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_at)
+            self.next_at = start_at + self.interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
+class RetryableError(Exception):
+    """Ответ провайдера, который имеет смысл повторить (429, 5xx)"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """429/5xx и сетевые ошибки повторяем, остальные 4xx (ключ, модель, формат) — нет"""
+    if isinstance(error, RetryableError):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError', 'ConnectionError',
+                                    'Timeout', 'ConnectTimeout', 'ReadTimeout')
+
+
+def with_retry(call: Callable, limiter: RateLimiter, stats: Dict):
+    """Вызов провайдера с лимитом частоты и экспоненциальной задержкой с джиттером"""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        limiter.wait()
+        try:
+            return call()
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES or not is_retryable(e):
+                raise
+            with _stats_lock:
+                stats['retries'] += 1
+            delay = EMBED_BACKOFF_BASE * (2 ** attempt)
+            print(f"Embedding request failed (attempt {attempt + 1}), retry in {delay:.1f}s: {e}")
+            time.sleep(delay + random.uniform(0, delay / 2))
+
+
+def _embed_openai_batches(client, model: str, texts: Sequence[str], limiter: RateLimiter,
+                          stats: Dict) -> List[Optional[List[float]]]:
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = list(texts[start:start + EMBED_BATCH_SIZE])
+        try:
+            response = with_retry(lambda: client.embeddings.create(model=model, input=batch), limiter, stats)
+        except Exception as e:
+            print(f"Embedding error for chunks {start}-{start + len(batch) - 1}: {e}")
+            continue
+        stats['requests'] += 1
+        # Порядок в ответе гарантирован полем index, а не позицией в списке
+        for item in response.data:
+            embeddings[start + item.index] = item.embedding
+    return embeddings
+
+
+def _embed_yandex_concurrent(api_key: str, folder_id: str, texts: Sequence[str], limiter: RateLimiter,
+                             stats: Dict) -> List[Optional[List[float]]]:
+    import requests
+
+    session = requests.Session()
+    session.headers.update({'Authorization': f'Api-Key {api_key}', 'Content-Type': 'application/json'})
+    # Для документов всегда используем text-search-doc
+    model_uri = f'emb://{folder_id}/text-search-doc/latest'
+
+    def request_one(text: str) -> List[float]:
+        response = session.post(YANDEX_EMBEDDING_URL, json={'modelUri': model_uri, 'text': text}, timeout=30)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableError(f'HTTP {response.status_code}: {response.text[:200]}')
+        response.raise_for_status()
+        return response.json()['embedding']
+
+    def embed_one(idx: int) -> Optional[List[float]]:
+        try:
+            embedding = with_retry(lambda: request_one(texts[idx]), limiter, stats)
+        except Exception as e:
+            print(f"Embedding error for chunk {idx}: {e}")
+            return None
+        with _stats_lock:
+            stats['requests'] += 1
+        return embedding
+
+    with ThreadPoolExecutor(max_workers=max(1, EMBED_CONCURRENCY)) as pool:
+        return list(pool.map(embed_one, range(len(texts))))
+
+
+def embed_chunks(embedding_provider: str, embedding_model: str, texts: Sequence[str]) -> Tuple[List[Optional[List[float]]], Dict]:
+    """
+    Эмбеддинги всех чанков документа.
+
+    Returns:
+        (embeddings, stats) - embeddings[i] равен None, если чанк не удалось
+        обработать после всех повторов; stats идёт в ответ process-pdf
+    """
+    stats = {'provider': embedding_provider, 'requests': 0, 'retries': 0}
+    limiter = RateLimiter(EMBED_RATE_LIMITS.get(embedding_provider, EMBED_RATE_LIMITS['openai']))
+    started = time.monotonic()
+
+    if embedding_provider == 'yandexgpt':
+        embeddings = _embed_yandex_concurrent(
+            os.environ.get('YANDEXGPT_API_KEY'), os.environ.get('YANDEXGPT_FOLDER_ID'), texts, limiter, stats
+        )
+    else:
+        # Все провайдеры, кроме Yandex, эмбеддят через OpenAI, как и до пакетной обработки
+        from openai import OpenAI
+        client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+        embeddings = _embed_openai_batches(client, embedding_model, texts, limiter, stats)
+
+    elapsed = time.monotonic() - started
+    stats['embedded'] = sum(1 for e in embeddings if e is not None)
+    stats['failed'] = len(texts) - stats['embedded']
+    stats['seconds'] = round(elapsed, 3)
+    stats['chunks_per_sec'] = round(len(texts) / elapsed, 2) if elapsed > 0 else None
+    return embeddings, stats
@@ -1,10 +1,18 @@
 import json
 import os
+import time
 import boto3
 import psycopg2
+from collections import Counter
 from datetime import datetime
 from io import BytesIO
 from auth_middleware import get_tenant_id_from_request
+from embedding_codec import normalize_embedding, pack_embedding, EMBEDDING_STORAGE_DTYPE, EMBEDDING_WRITE_JSON
+from quality_gate import index_terms
+from embedding_batch import embed_chunks
+from chunk_writer import write_chunks
+from invalidation_bus import notify_invalidation, KIND_CORPUS
+from db import get_connection
 
 def handler(event: dict, context) -> dict:
     """Обработка PDF: извлечение текста и разбиение на чанки"""
@@ -36,7 +44,6 @@ def handler(event: dict, context) -> dict:
             return auth_error
         
         import PyPDF2
-        from openai import OpenAI
         
         body = json.loads(event.get('body', '{}'))
         document_id = body.get('documentId')
@@ -49,7 +56,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("SELECT file_key, tenant_id FROM t_p56134400_telegram_ai_bot_pdf.documents WHERE id = %s AND tenant_id = %s", (document_id, tenant_id))
@@ -104,51 +111,84 @@ def handler(event: dict, context) -> dict:
         embedding_provider = settings.get('embedding_provider', 'openai')
         embedding_model = settings.get('embedding_model', 'text-embedding-3-small')
 
-        for idx, chunk_text in enumerate(chunks):
-            try:
-                if embedding_provider == 'yandexgpt':
-                    import requests
-                    yandex_api_key = os.environ.get('YANDEXGPT_API_KEY')
-                    yandex_folder_id = os.environ.get('YANDEXGPT_FOLDER_ID')
-                    
-                    # Для документов всегда используем text-search-doc
-                    emb_response = requests.post(
-                        'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding',
-                        headers={
-                            'Authorization': f'Api-Key {yandex_api_key}',
-                            'Content-Type': 'application/json'
-                        },
-                        json={
-                            'modelUri': f'emb://{yandex_folder_id}/text-search-doc/latest',
-                            'text': chunk_text
-                        }
-                    )
-                    emb_data = emb_response.json()
-                    embedding_vector = emb_data['embedding']
-                    embedding_json = json.dumps(embedding_vector)
-                else:
-                    client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-                    embedding_response = client.embeddings.create(
-                        model=embedding_model,
-                        input=chunk_text
-                    )
-                    embedding_vector = embedding_response.data[0].embedding
-                    embedding_json = json.dumps(embedding_vector)
-            except Exception as emb_error:
-                print(f"Embedding error for chunk {idx}: {emb_error}")
-                embedding_json = None
-
-            cur.execute("""
-                INSERT INTO t_p56134400_telegram_ai_bot_pdf.document_chunks 
-                (document_id, chunk_text, chunk_index, embedding_text)
-                VALUES (%s, %s, %s, %s)
-            """, (document_id, chunk_text, idx, embedding_json))
-            
+        # embedding_vec пишется только тенанту, который ищет через pgvector: без расширения индексация работает как прежде
+        cur.execute("""
+            SELECT ai_settings->>'retrieval_backend'
+            FROM t_p56134400_telegram_ai_bot_pdf.tenant_settings
+            WHERE tenant_id = %s
+        """, (tenant_id,))
+        backend_row = cur.fetchone()
+        pgvector_enabled = bool(backend_row) and backend_row[0] == 'pgvector'
+
+        # Все чанки документа эмбеддим пакетами до записи в БД
+        embeddings, embedding_stats = embed_chunks(embedding_provider, embedding_model, chunks)
+        print(f"Embedding stats for document {document_id}: {embedding_stats}")
+
+        # Ни одного эмбеддинга (ключ, модель, провайдер недоступен) — документ не готов,
+        # прежние чанки остаются: удаление откатывается
+        if chunks and embedding_stats['failed'] == len(chunks):
+            conn.rollback()
             cur.execute("""
-                INSERT INTO t_p56134400_telegram_ai_bot_pdf.tenant_chunks 
-                (tenant_id, document_id, chunk_text, chunk_index, embedding_text)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (1, document_id, chunk_text, idx, embedding_json))
+                UPDATE t_p56134400_telegram_ai_bot_pdf.documents
+                SET status = 'error', processed_at = %s
+                WHERE id = %s
+            """, (datetime.now(), document_id))
+            conn.commit()
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 502,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'error': 'Не удалось получить эмбеддинги ни для одного фрагмента',
+                    'documentId': document_id,
+                    'status': 'error',
+                    'embedding': embedding_stats
+                }),
+                'isBase64Encoded': False
+            }
+
+        prepared_chunks = []
+        for idx, (chunk_text, embedding_vector) in enumerate(zip(chunks, embeddings)):
+            if embedding_vector is not None:
+                # Храним нормализованный вектор: в chat близость — чистое скалярное произведение
+                embedding_vector = normalize_embedding(embedding_vector)
+                embedding_bin = psycopg2.Binary(pack_embedding(embedding_vector, EMBEDDING_STORAGE_DTYPE))
+                embedding_dtype = EMBEDDING_STORAGE_DTYPE
+                # JSON пишем, пока не закончился период двойного чтения
+                embedding_json = json.dumps(embedding_vector) if EMBEDDING_WRITE_JSON else None
+                # Текстовый литерал '[...]' для колонки pgvector
+                embedding_vec = json.dumps(embedding_vector) if pgvector_enabled else None
+                embedding_dim = len(embedding_vector)
+                embedding_normalized = True
+            else:
+                embedding_bin = None
+                embedding_dtype = None
+                embedding_json = None
+                embedding_vec = None
+                embedding_dim = None
+                embedding_normalized = False
+
+            prepared_chunks.append({
+                'chunk_index': idx,
+                'chunk_text': chunk_text,
+                'embedding_text': embedding_json,
+                'embedding_bin': embedding_bin,
+                'embedding_dtype': embedding_dtype,
+                'embedding_vec': embedding_vec,
+                'embedding_dim': embedding_dim,
+                'embedding_normalized': embedding_normalized,
+                # Постинги BM25 считаем здесь же, чтобы chat не токенизировал корпус на каждый запрос
+                'terms': Counter(index_terms(chunk_text)),
+            })
+
+        write_started = time.monotonic()
+        written = write_chunks(cur, tenant_id, document_id, prepared_chunks, with_vector=pgvector_enabled)
+        write_seconds = time.monotonic() - write_started
+        print(f"Chunk write stats for document {document_id}: {written}, {write_seconds:.3f}s")
+
+        # Корпус тенанта изменился: тёплые экземпляры chat сбросят индекс и кэш ответов
+        notify_invalidation(cur, tenant_id, KIND_CORPUS)
 
         cur.execute("""
             UPDATE t_p56134400_telegram_ai_bot_pdf.documents 
@@ -167,7 +207,13 @@ def handler(event: dict, context) -> dict:
                 'documentId': document_id,
                 'pages': pages_count,
                 'chunks': len(chunks),
-                'status': 'ready'
+                'status': 'ready',
+                'embedding': embedding_stats,
+                'write': {
+                    **written,
+                    'seconds': round(write_seconds, 3),
+                    'chunks_per_sec': round(len(prepared_chunks) / write_seconds, 2) if write_seconds > 0 else None
+                }
             }),
             'isBase64Encoded': False
         }
@@ -2,11 +2,11 @@
 Управление подписками - получение информации о тарифе и подписке клиента
 """
 import json
-import os
-import psycopg2
 from datetime import datetime
 from decimal import Decimal
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """Получение информации о подписке клиента"""
     
@@ -34,8 +34,7 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        dsn = os.environ['DATABASE_URL']
-        conn = psycopg2.connect(dsn)
+        conn = get_connection()
         cur = conn.cursor()
         
         # Получаем информацию о тенанте и его тарифе
@@ -1,8 +1,9 @@
 import json
 import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """API для управления тарифами (только для суперадмина)"""
     method = event.get('httpMethod', 'GET')
@@ -63,7 +64,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         schema = 't_p56134400_telegram_ai_bot_pdf'
 
@@ -1,52 +1,135 @@
 """Утилита для работы с API ключами клиентов"""
 import os
 import json
-import psycopg2
+import threading
+import time
+from db import get_connection
 
-def get_tenant_api_key(tenant_id: int, provider: str, key_name: str) -> tuple[str | None, dict | None]:
+# Ключи меняются редко (manage-api-keys): в пределах TTL кэшу верим без запросов,
+# дальше сверяем только версию ключей тенанта
+API_KEYS_CACHE_TTL = float(os.environ.get('API_KEYS_CACHE_TTL', '5'))
+
+# tenant_id -> {'checked_at', 'version', 'providers': {provider: {key_name: key_value}}}
+_cache: dict[int, dict] = {}
+_lock = threading.Lock()
+
+
+def _error_response(status_code: int, error_msg: str) -> dict:
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': error_msg}),
+        'isBase64Encoded': False
+    }
+
+
+def get_tenant_api_keys(tenant_id: int, providers: list[str], conn=None) -> tuple[dict | None, dict | None]:
     """
-    Получить API ключ клиента из tenant_api_keys.
-    
+    Получить все активные ключи клиента по списку провайдеров одним запросом.
+
     Args:
         tenant_id: ID клиента
-        provider: Провайдер (yandexgpt, openai, deepseek, telegram)
-        key_name: Название ключа (api_key, folder_id, bot_token)
-    
+        providers: Провайдеры (yandexgpt, openai, openrouter, deepseek, telegram, whatsapp, max, vk)
+        conn: Открытое соединение вызывающей функции; без него берётся соединение из пула
+
     Returns:
-        (key_value, error_response) - либо значение ключа, либо HTTP ошибка
+        ({provider: {key_name: key_value}}, error_response) - ключи провайдеров
+        (пустой dict, если ключей нет) либо HTTP ошибка
     """
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(tenant_id)
+        cached = dict(entry['providers']) if entry else {}
+        fresh = entry is not None and now - entry['checked_at'] < API_KEYS_CACHE_TTL
+
+    missing = [p for p in dict.fromkeys(providers) if p not in cached]
+    if fresh and not missing:
+        return {p: cached[p] for p in providers}, None
+
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        own_conn = conn is None
+        if own_conn:
+            conn = get_connection()
         cur = conn.cursor()
-        
+
+        # Версия ключей: manage-api-keys обновляет updated_at при каждом сохранении
         cur.execute("""
-            SELECT key_value
+            SELECT COUNT(*), MAX(updated_at)
             FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys
-            WHERE tenant_id = %s 
-              AND provider = %s 
-              AND key_name = %s 
-              AND is_active = true
-        """, (tenant_id, provider, key_name))
-        
-        row = cur.fetchone()
+            WHERE tenant_id = %s
+        """, (tenant_id,))
+        count, max_updated_at = cur.fetchone()
+        version = f"{count}:{max_updated_at.isoformat() if max_updated_at else ''}"
+
+        if entry is None or entry['version'] != version:
+            cached = {}
+            missing = list(dict.fromkeys(providers))
+
+        rows = []
+        if missing:
+            cur.execute("""
+                SELECT provider, key_name, key_value
+                FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys
+                WHERE tenant_id = %s
+                  AND provider = ANY(%s)
+                  AND is_active = true
+            """, (tenant_id, missing))
+            rows = cur.fetchall()
+
         cur.close()
-        conn.close()
-        
-        if not row:
-            error_msg = f"API ключ не настроен: {provider}.{key_name}. Добавьте ключи в админ-панели."
-            return None, {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': error_msg}),
-                'isBase64Encoded': False
-            }
-        
-        return row[0], None
-        
+        if own_conn:
+            conn.close()
+
     except Exception as e:
-        return None, {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Ошибка чтения API ключей: {str(e)}'}),
-            'isBase64Encoded': False
-        }
+        return None, _error_response(500, f'Ошибка чтения API ключей: {str(e)}')
+
+    fetched: dict[str, dict[str, str]] = {provider: {} for provider in missing}
+    for provider, key_name, key_value in rows:
+        fetched[provider][key_name] = key_value
+    cached.update(fetched)
+
+    with _lock:
+        _cache[tenant_id] = {'checked_at': now, 'version': version, 'providers': cached}
+
+    return {p: cached[p] for p in providers}, None
+
+
+def require_api_key(keys: dict, provider: str, key_name: str) -> tuple[str | None, dict | None]:
+    """
+    Достать ключ из результата get_tenant_api_keys.
+
+    Returns:
+        (key_value, error_response) - либо значение ключа, либо HTTP 400, если ключ не настроен
+    """
+    key_value = keys.get(provider, {}).get(key_name)
+    if not key_value:
+        return None, _error_response(400, f"API ключ не настроен: {provider}.{key_name}. Добавьте ключи в админ-панели.")
+    return key_value, None
+
+
+def get_tenant_api_key(tenant_id: int, provider: str, key_name: str, conn=None) -> tuple[str | None, dict | None]:
+    """
+    Получить API ключ клиента из tenant_api_keys.
+
+    Args:
+        tenant_id: ID клиента
+        provider: Провайдер (yandexgpt, openai, deepseek, telegram, whatsapp, max, vk)
+        key_name: Название ключа (api_key, folder_id, bot_token, access_token, phone_number_id, group_token, secret_key)
+        conn: Открытое соединение вызывающей функции (необязательно)
+
+    Returns:
+        (key_value, error_response) - либо значение ключа, либо HTTP ошибка
+    """
+    keys, error = get_tenant_api_keys(tenant_id, [provider], conn)
+    if error:
+        return None, error
+    return require_api_key(keys, provider, key_name)
+
+
+def invalidate_tenant_api_keys(tenant_id: int | None):
+    """Сбросить кэш ключей клиента в текущем процессе; None — всех клиентов"""
+    with _lock:
+        if tenant_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(tenant_id, None)
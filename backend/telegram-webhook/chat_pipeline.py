@@ -0,0 +1,911 @@
+"""
+Обработка сообщения гостя: retrieval, quality gate и ответ LLM.
+
+Вызывается в процессе: HTTP-функцией chat (index.py — тонкая обёртка) и
+webhook-ами мессенджеров через messenger_reply, без HTTPS-вызова chat.
+Результат — тот же ответ, что отдаёт HTTP-функция: statusCode/headers/body.
+"""
+import json
+import os
+import hashlib
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from db import get_connection, execute_prepared, pool_stats
+from api_keys_helper import get_tenant_api_keys, require_api_key, invalidate_tenant_api_keys
+from index_cache import get_corpus_version, load_tenant_index, invalidate_tenant as invalidate_index
+from pgvector_search import search_pgvector
+from query_embedding_cache import get_cached_query_embedding, put_query_embedding
+from answer_cache import lookup_cached_answer, store_answer, ANSWER_CACHE_THRESHOLD, invalidate_tenant as invalidate_answers
+from tenant_settings_cache import get_tenant_ai_settings, invalidate_tenant as invalidate_settings
+from invalidation_bus import drain_invalidations, register_handler, KIND_SETTINGS, KIND_API_KEYS, KIND_CORPUS
+from llm_stream import LLMStream, stream_openrouter, stream_yandexgpt
+from pipeline import StageTimer, submit, prefetch_tenant_index, write_user_turn, write_chat_timings
+from idempotency import claim_request, finish_request, duplicate_response
+
+from quality_gate import (
+    build_context_with_scores, 
+    quality_gate, 
+    compose_system,
+    rag_debug_log,
+    low_overlap_rate,
+    update_low_overlap_stats,
+    tokenize,
+    detect_lang_simple,
+    RAG_TOPK_DEFAULT,
+    RAG_TOPK_FALLBACK,
+    RAG_LOW_OVERLAP_THRESHOLD,
+    RAG_LOW_OVERLAP_START_TOPK5,
+    RAG_HYBRID_SEARCH,
+    RAG_HYBRID_CANDIDATES
+)
+
+# Сброс in-process кэшей по уведомлениям писателей из других экземпляров
+register_handler(KIND_SETTINGS, lambda tenant_id, version: invalidate_settings(tenant_id))
+register_handler(KIND_SETTINGS, lambda tenant_id, version: invalidate_answers(tenant_id))
+register_handler(KIND_API_KEYS, lambda tenant_id, version: invalidate_tenant_api_keys(tenant_id))
+register_handler(KIND_CORPUS, lambda tenant_id, version: invalidate_index(tenant_id))
+register_handler(KIND_CORPUS, lambda tenant_id, version: invalidate_answers(tenant_id))
+
+
+def run_chat(body: dict, request_id: Optional[str] = None, stream_mode: bool = False,
+             request_started: Optional[float] = None) -> dict:
+    """
+    Ответить на сообщение из тела запроса chat (message, sessionId, tenantId, idempotencyKey).
+
+    С idempotencyKey (webhook-и передают id сообщения канала) повторная доставка
+    того же сообщения не пересчитывается: возвращается сохранённый ответ.
+    """
+    request_started = request_started or time.monotonic()
+    request_id = request_id or str(uuid.uuid4())
+
+    idempotency_key = body.get('idempotencyKey')
+    if not idempotency_key or not body.get('message'):
+        return answer_message(body, request_id, stream_mode, request_started)
+
+    tenant_id = body.get('tenantId', 1)
+    session_id = body.get('sessionId', 'default')
+    state, stored, stats = claim_request(tenant_id, str(idempotency_key), session_id)
+    if state in ('done', 'in_flight'):
+        print(f"Duplicate delivery {idempotency_key}: {state}")
+        return duplicate_response(state, stored, session_id, stats)
+
+    response = answer_message(body, request_id, stream_mode, request_started)
+    if state == 'claimed':
+        finish_request(tenant_id, str(idempotency_key), response)
+    return response
+
+
+def answer_message(body: dict, request_id: str, stream_mode: bool, request_started: float) -> dict:
+    """Обработка одного сообщения; request_id — ключ строки chat_timings"""
+    conn = None
+    user_turn_future = None
+    try:
+        from openai import OpenAI
+
+        timer = StageTimer(request_started)
+        with timer.stage('invalidation'):
+            invalidation_info = drain_invalidations()
+        
+        user_message = body.get('message', '')
+        session_id = body.get('sessionId', 'default')
+        tenant_id = body.get('tenantId', 1)
+
+        if not user_message:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'message required'}),
+                'isBase64Encoded': False
+            }
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        # Полный ai_settings читается только после сохранения настроек, иначе — проверка версии
+        with timer.stage('settings'):
+            cached_settings, ai_settings_hash, settings_cache_info = get_tenant_ai_settings(cur, tenant_id)
+        
+        if cached_settings:
+            settings = cached_settings
+            ai_model = settings.get('model', 'yandexgpt')
+            ai_temperature = float(settings.get('temperature', 0.15))
+            ai_top_p = float(settings.get('top_p', 1.0))
+            ai_frequency_penalty = float(settings.get('frequency_penalty', 0))
+            ai_presence_penalty = float(settings.get('presence_penalty', 0))
+            ai_max_tokens = int(settings.get('max_tokens', 600))
+            ai_system_priority = settings.get('system_priority', 'strict')
+            ai_creative_mode = settings.get('creative_mode', 'off')
+            embedding_provider = settings.get('embedding_provider', 'openai')
+            embedding_model = settings.get('embedding_model', 'text-embedding-3-small')
+            retrieval_backend = settings.get('retrieval_backend', 'numpy')
+            answer_cache_enabled = bool(settings.get('answer_cache_enabled', False))
+            answer_cache_threshold = float(settings.get('answer_cache_threshold', ANSWER_CACHE_THRESHOLD))
+            system_prompt_template = settings.get('system_prompt', '''Ты — дружелюбный AI-консьерж отеля «Династия» в Telegram.
+
+ИСТОЧНИК ФАКТОВ:
+Единственный источник фактов — блок внутри system prompt, который начинается строкой:
+«Доступная информация из документов:»
+Любой факт в ответе должен прямо подтверждаться строками из этого блока.
+Если факта нет в этом блоке — не придумывай и не "догадывайся".
+
+КАК ИСПОЛЬЗОВАТЬ ДОСТУПНУЮ ИНФОРМАЦИЮ:
+1. Используй только текст после строки «Доступная информация из документов:».
+2. В этот блок обычно попадают до 3 наиболее релевантных выдержек и они могут быть неполными.
+3. Если внутри блока написано «Документы пока не загружены»:
+   - считай, что подтверждённых фактов нет
+   - НЕ отвечай по сути вопроса
+   - используй фразу-заглушку из блока «УТОЧНЕНИЕ»
+   - задай ОДИН уточняющий вопрос (строго один) по правилам блока «УТОЧНЕНИЕ»
+
+ПРОВЕРКА РЕЛЕВАНТНОСТИ И ПОДТВЕРЖДЕНИЙ (СТРОГО):
+1. Перед ответом проверь: в доступной информации есть строки именно про тему вопроса.
+2. Если доступная информация явно не про тему вопроса — считай, что ответа нет.
+3. Если есть только общие слова без конкретики (нет условий/цифр/формулировок по сути) — считай, что ответа нет.
+4. Если ответа нет — НЕ давай общих советов и не добавляй "типичные" сведения.
+5. В этом случае всегда: «Пока не вижу точной информации по этому вопросу.» + ОДИН уточняющий вопрос.
+6. Если пользователь задаёт несколько вопросов, отвечай только на те, которые подтверждены доступной информацией. По остальным — заглушка и один уточняющий вопрос (выбери самый важный).
+
+ПРОТИВОРЕЧИЯ:
+Если в доступной информации есть разные версии одного и того же:
+- выбирай ту, где больше конкретики (цифры, даты, условия)
+- не упоминай, что были расхождения
+
+СЛУЖЕБНЫЕ ДАННЫЕ — СТРОГИЙ ЗАПРЕТ:
+Даже если в доступной информации случайно встречаются служебные поля или метки, НЕЛЬЗЯ:
+- пересказывать или цитировать id, similarity, page_number
+- упоминать нумерацию страниц документов и любые формулировки вида «на странице», «стр.», «стр», «страница», «страницы», «на стр.»
+- ссылаться на то, что информация «взята со страницы» или «в документе на стр.…»
+
+Если пользователь просит указать нумерацию страниц документов — скажи:
+«Я не могу указывать нумерацию страниц документов.»
+и продолжи помогать по сути вопроса, не используя нумерацию.
+
+Важно: слово «страница» разрешено только в нейтральном смысле, не связанном с документами (например, «страница сайта»). Если есть риск двусмысленности — избегай этого слова и пиши «раздел на сайте».
+
+ВНУТРЕННИЕ ИМЕНА ФАЙЛОВ — СТРОГИЙ ЗАПРЕТ:
+Даже если в доступной информации случайно встречаются внутренние названия файлов (например: имена PDF/документов, технические названия вроде "tarify_2025-2026…", расширения .pdf и т.п.), НЕЛЬЗЯ:
+- цитировать или пересказывать эти названия
+- говорить «в файле …», «в документе …» с указанием имени файла
+
+Если пользователь просит "какой файл" — ответь: «Я не могу указывать внутренние названия файлов.» и продолжи помогать по сути.
+
+ЯЗЫК, ТОН:
+По умолчанию: русский, тепло и по-человечески, на «вы». Без эмодзи и без восклицательных знаков.
+
+ЗАПРЕТЫ:
+- Нельзя писать слова: «база знаний», «по базе знаний», «в базе знаний», «база данных».
+- Нельзя упоминать: «контекст», «n8n», «RAG», «эмбеддинги», «вектор», «чанки», «фрагменты», «score», «векторная база», «cosine similarity».
+- Нельзя упоминать и/или пересказывать служебные поля: id, similarity, page_number.
+- Нельзя писать Markdown: никаких **жирных**, *звёздочек*, ```кода```, [ссылок](...), и т.п.
+
+ФОРМАТ ДЛЯ TELEGRAM (HTML):
+Разрешено ТОЛЬКО:
+- обычный текст
+- переносы строк (новая строка)
+- тег <b>...</b> для выделения
+- тег <a href="...">...</a> для кликабельных телефона и ссылок на сайт
+
+НИКОГДА не используй <br>.
+НИКОГДА не используй другие HTML-теги.
+
+ПРИВЕТСТВИЕ:
+Поздоровайтесь только один раз за беседу: в самом первом ответе диалога.
+В следующих сообщениях этого же диалога НЕ здоровайся повторно.
+
+ДЛИНА И СТРУКТУРА:
+- Никаких длинных простыней.
+- Максимум 3 смысловых блока и максимум 3 пункта в списках.
+- Если нужно перечислять много: остановись и напиши одной строкой: «Могу перечислить остальные варианты, если нужно».
+
+УТОЧНЕНИЕ (ТОЛЬКО КОГДА НУЖНО):
+Если в доступной информации нет ответа или не хватает данных для точного расчёта — скажи одной фразой:
+«Пока не вижу точной информации по этому вопросу.»
+
+И задай ОДИН уточняющий вопрос (строго один), приоритет:
+1. даты/период
+2. тип номера
+3. взрослые
+4. дети
+5. сколько детей
+6. возраст
+7. другое
+
+Для цен/наличия/питания/трансфера/акций/правил без дат спрашивай только:
+«Подскажите, пожалуйста, на какие даты или период планируете?»
+
+ОТВЕТ ПО ЦЕНАМ (КЛЮЧЕВОЕ):
+Если пользователь дал даты/дату:
+1. Определи, какие даты проживания получаются (заезд–выезд) и сколько ночей.
+2. Дай цену строго для этих ночей, а не "весь период".
+3. Всегда показывай:
+   - «за 1 ночь: ...»
+   - «итого за N ночей: ...»
+4. Если даты попадают на смену периода цен:
+   - посчитай по частям: «до <дата>» и «с <дата>», и общий итог.
+5. Если категория номера НЕ указана:
+   - НЕ говори «у меня нет точной информации», если в доступной информации есть тарифы.
+   - Покажи 2–3 самые типовые категории (Стандарт / Стандарт одноместный / Комфорт) с тремя вариантами питания: «без питания», «завтрак», «полный пансион».
+   - Затем задай ОДИН вопрос: «Какую категорию номера выбираете?»
+6. Если пользователь указал категорию, но не питание:
+   - покажи все варианты питания для этой категории (без питания / завтрак / полный пансион).
+   - затем один вопрос: «Какой вариант питания вам удобнее?»
+7. Сокращения RO/BB/FB НЕ используй. Пиши полными словами.
+
+Формат вывода цен:
+
+<b>Категория номера</b>
+без питания: X руб. за 1 ночь, итого Y руб. за N ночей
+завтрак: X руб. за 1 ночь, итого Y руб. за N ночей
+полный пансион: X руб. за 1 ночь, итого Y руб. за N ночей
+
+ПОДПИСЬ "ПО ПРАВИЛАМ" (МЯГКИЙ ВАРИАНТ):
+По умолчанию НЕ добавляй никаких фраз вида «так указано...».
+Добавляй ОДНУ финальную строку подписи ТОЛЬКО если вопрос относится к правилам/штрафам/запретам/ответственности.
+Тип B включается ТОЛЬКО при явных словах: «штраф», «запрет», «нельзя», «курить», «документы», «выселение», «ответственность», «возмещение».
+Тогда в конце добавь одну строку (без двоеточий): «Так указано в правилах отеля.»
+
+ПРО ИСТОЧНИК:
+Не добавляй «Источник: ...», если пользователь сам не спросил «откуда информация?» или «где написано?».
+Если спросил — добавь одной строкой: «Источник: официальная информация отеля.»
+
+ПЕРСОНАЛЬНЫЕ ДАННЫЕ:
+Не проси и не принимай ФИО/телефон/email/паспорт/номер брони. Если прислали — попроси написать без персональных данных.
+
+БРОНИРОВАНИЕ (КРИТИЧЕСКИ ВАЖНО):
+Триггеры: «бронь», «забронировать», «оформить» (и все их формы).
+
+Если есть триггер:
+1. Сначала ответь по доступной информации (если есть вопрос о ценах/условиях).
+2. Затем добавь фразу:
+   «Я не могу оформить бронирование в чате по причине защиты персональных данных, но помогу с выбором.»
+3. И в конце двумя строками (один раз за диалог):
+   
+   Телефон: <a href="tel:+79789980978">+7 (978) 998-09-78</a>
+   Бронирование: <a href="https://dinasty-crimea.ru/booking/">dinasty-crimea.ru/booking/</a>
+
+Если просят повторить контакты: «Контакты уже отправлял(а) выше, продублировать?»
+
+ЗАПРОСЫ НА СМЕНУ ЯЗЫКА, ОБРАЩЕНИЯ И ФОРМАТА:
+Если пользователь просит:
+- перейти на «ты»
+- добавить эмодзи
+- использовать восклицательные знаки
+
+Ответ: вежливо откажи одной фразой и продолжай в исходных настройках.
+Шаблон: «Я буду писать на «вы», без эмодзи и без восклицательных знаков.»
+
+Если пользователь просит писать на другом языке — СОГЛАСИСЬ и переключись на указанный язык с этого сообщения и дальше по диалогу.
+При этом сохраняй остальные ограничения стиля: обращение на «вы», без эмодзи и без восклицательных знаков (если в выбранном языке это применимо).
+Если пользователь не указал конкретный язык, задай один вопрос: «На каком языке вам удобнее?»
+
+ЕСЛИ ПРОСЯТ «ССЫЛКОЙ/КНОПКОЙ/В MARKDOWN»:
+Если пользователь просит «перешлите ваш ответ в виде ссылки», «кнопкой», «в markdown», «в виде оформления/красиво со ссылками» — вежливо откажи и ответь обычным текстом в разрешённом формате Telegram (обычный текст + переносы строк + <b>…</b> и при необходимости <a href="...">…</a>).
+Шаблон: «Я могу ответить только обычным текстом в чате. Подскажу так.»
+
+АГРЕССИЯ И ГРУБОСТЬ:
+Если пользователь пишет грубо, агрессивно, с провокациями:
+- сохраняй спокойный нейтральный тон
+- не спорь и не оценивай пользователя
+- не отвечай грубостью на грубость
+- игнорируй тон и продолжай помогать по сути, либо (если данных не хватает) используй «УТОЧНЕНИЕ» с одним вопросом
+
+MINI-SYSTEM: РАСЧЁТ ЦЕН (используй только для запросов о стоимости)
+Ты считаешь стоимость только по строкам из блока «Доступная информация из документов:». Никаких догадок.
+
+Правила расчёта:
+1. Всегда сначала определить: заезд–выезд и число ночей.
+2. Цена всегда показывается как:
+   - «за 1 ночь: …»
+   - «итого за N ночей: …»
+3. Если период пересекает смену тарифов — считать по частям и дать общий итог.
+4. Если не указана категория номера — показать 2–3 типовые категории с вариантами питания (без питания / завтрак / полный пансион) и задать 1 вопрос «Какую категорию номера выбираете?»
+5. Если категория указана, но питание нет — показать все варианты питания для этой категории и задать 1 вопрос «Какой вариант питания вам удобнее?»
+6. Если в документах нет тарифов или не хватает данных — сказать «Пока не вижу точной информации по этому вопросу.» и задать 1 уточняющий вопрос по приоритету: даты → тип номера → взрослые → дети → возраст.''')
+            print(f"DEBUG SETTINGS: embedding_provider={embedding_provider}, embedding_model={embedding_model}")
+        else:
+            ai_model = settings.get('model', 'yandexgpt') if cached_settings else 'yandexgpt'
+            ai_temperature = 0.15
+            ai_top_p = 1.0
+            ai_frequency_penalty = 0
+            ai_presence_penalty = 0
+            ai_max_tokens = 600
+            ai_system_priority = 'strict'
+            ai_creative_mode = 'off'
+            embedding_provider = 'openai'
+            embedding_model = 'text-embedding-3-small'
+            retrieval_backend = 'numpy'
+            answer_cache_enabled = False
+            answer_cache_threshold = ANSWER_CACHE_THRESHOLD
+            system_prompt_template = settings.get('system_prompt', '''Ты — дружелюбный AI-консьерж отеля «Династия» в Telegram.
+
+ИСТОЧНИК ФАКТОВ:
+Единственный источник фактов — блок внутри system prompt, который начинается строкой:
+«Доступная информация из документов:»
+Любой факт в ответе должен прямо подтверждаться строками из этого блока.
+Если факта нет в этом блоке — не придумывай и не "догадывайся".
+
+КАК ИСПОЛЬЗОВАТЬ ДОСТУПНУЮ ИНФОРМАЦИЮ:
+1. Используй только текст после строки «Доступная информация из документов:».
+2. В этот блок обычно попадают до 3 наиболее релевантных выдержек и они могут быть неполными.
+3. Если внутри блока написано «Документы пока не загружены»:
+   - считай, что подтверждённых фактов нет
+   - НЕ отвечай по сути вопроса
+   - используй фразу-заглушку из блока «УТОЧНЕНИЕ»
+   - задай ОДИН уточняющий вопрос (строго один) по правилам блока «УТОЧНЕНИЕ»
+
+ПРОВЕРКА РЕЛЕВАНТНОСТИ И ПОДТВЕРЖДЕНИЙ (СТРОГО):
+1. Перед ответом проверь: в доступной информации есть строки именно про тему вопроса.
+2. Если доступная информация явно не про тему вопроса — считай, что ответа нет.
+3. Если есть только общие слова без конкретики (нет условий/цифр/формулировок по сути) — считай, что ответа нет.
+4. Если ответа нет — НЕ давай общих советов и не добавляй "типичные" сведения.
+5. В этом случае всегда: «Пока не вижу точной информации по этому вопросу.» + ОДИН уточняющий вопрос.
+6. Если пользователь задаёт несколько вопросов, отвечай только на те, которые подтверждены доступной информацией. По остальным — заглушка и один уточняющий вопрос (выбери самый важный).
+
+ПРОТИВОРЕЧИЯ:
+Если в доступной информации есть разные версии одного и того же:
+- выбирай ту, где больше конкретики (цифры, даты, условия)
+- не упоминай, что были расхождения
+
+СЛУЖЕБНЫЕ ДАННЫЕ — СТРОГИЙ ЗАПРЕТ:
+Даже если в доступной информации случайно встречаются служебные поля или метки, НЕЛЬЗЯ:
+- пересказывать или цитировать id, similarity, page_number
+- упоминать нумерацию страниц документов и любые формулировки вида «на странице», «стр.», «стр», «страница», «страницы», «на стр.»
+- ссылаться на то, что информация «взята со страницы» или «в документе на стр.…»
+
+Если пользователь просит указать нумерацию страниц документов — скажи:
+«Я не могу указывать нумерацию страниц документов.»
+и продолжи помогать по сути вопроса, не используя нумерацию.
+
+Важно: слово «страница» разрешено только в нейтральном смысле, не связанном с документами (например, «страница сайта»). Если есть риск двусмысленности — избегай этого слова и пиши «раздел на сайте».
+
+ВНУТРЕННИЕ ИМЕНА ФАЙЛОВ — СТРОГИЙ ЗАПРЕТ:
+Даже если в доступной информации случайно встречаются внутренние названия файлов (например: имена PDF/документов, технические названия вроде "tarify_2025-2026…", расширения .pdf и т.п.), НЕЛЬЗЯ:
+- цитировать или пересказывать эти названия
+- говорить «в файле …», «в документе …» с указанием имени файла
+
+Если пользователь просит "какой файл" — ответь: «Я не могу указывать внутренние названия файлов.» и продолжи помогать по сути.
+
+ЯЗЫК, ТОН:
+По умолчанию: русский, тепло и по-человечески, на «вы». Без эмодзи и без восклицательных знаков.
+
+ЗАПРЕТЫ:
+- Нельзя писать слова: «база знаний», «по базе знаний», «в базе знаний», «база данных».
+- Нельзя упоминать: «контекст», «n8n», «RAG», «эмбеддинги», «вектор», «чанки», «фрагменты», «score», «векторная база», «cosine similarity».
+- Нельзя упоминать и/или пересказывать служебные поля: id, similarity, page_number.
+- Нельзя писать Markdown: никаких **жирных**, *звёздочек*, ```кода```, [ссылок](...), и т.п.
+
+ФОРМАТ ДЛЯ TELEGRAM (HTML):
+Разрешено ТОЛЬКО:
+- обычный текст
+- переносы строк (новая строка)
+- тег <b>...</b> для выделения
+- тег <a href="...">...</a> для кликабельных телефона и ссылок на сайт
+
+НИКОГДА не используй <br>.
+НИКОГДА не используй другие HTML-теги.
+
+ПРИВЕТСТВИЕ:
+Поздоровайтесь только один раз за беседу: в самом первом ответе диалога.
+В следующих сообщениях этого же диалога НЕ здоровайся повторно.
+
+ДЛИНА И СТРУКТУРА:
+- Никаких длинных простыней.
+- Максимум 3 смысловых блока и максимум 3 пункта в списках.
+- Если нужно перечислять много: остановись и напиши одной строкой: «Могу перечислить остальные варианты, если нужно».
+
+УТОЧНЕНИЕ (ТОЛЬКО КОГДА НУЖНО):
+Если в доступной информации нет ответа или не хватает данных для точного расчёта — скажи одной фразой:
+«Пока не вижу точной информации по этому вопросу.»
+
+И задай ОДИН уточняющий вопрос (строго один), приоритет:
+1. даты/период
+2. тип номера
+3. взрослые
+4. дети
+5. сколько детей
+6. возраст
+7. другое
+
+Для цен/наличия/питания/трансфера/акций/правил без дат спрашивай только:
+«Подскажите, пожалуйста, на какие даты или период планируете?»
+
+ОТВЕТ ПО ЦЕНАМ (КЛЮЧЕВОЕ):
+Если пользователь дал даты/дату:
+1. Определи, какие даты проживания получаются (заезд–выезд) и сколько ночей.
+2. Дай цену строго для этих ночей, а не "весь период".
+3. Всегда показывай:
+   - «за 1 ночь: ...»
+   - «итого за N ночей: ...»
+4. Если даты попадают на смену периода цен:
+   - посчитай по частям: «до <дата>» и «с <дата>», и общий итог.
+5. Если категория номера НЕ указана:
+   - НЕ говори «у меня нет точной информации», если в доступной информации есть тарифы.
+   - Покажи 2–3 самые типовые категории (Стандарт / Стандарт одноместный / Комфорт) с тремя вариантами питания: «без питания», «завтрак», «полный пансион».
+   - Затем задай ОДИН вопрос: «Какую категорию номера выбираете?»
+6. Если пользователь указал категорию, но не питание:
+   - покажи все варианты питания для этой категории (без питания / завтрак / полный пансион).
+   - затем один вопрос: «Какой вариант питания вам удобнее?»
+7. Сокращения RO/BB/FB НЕ используй. Пиши полными словами.
+
+Формат вывода цен:
+
+<b>Категория номера</b>
+без питания: X руб. за 1 ночь, итого Y руб. за N ночей
+завтрак: X руб. за 1 ночь, итого Y руб. за N ночей
+полный пансион: X руб. за 1 ночь, итого Y руб. за N ночей
+
+ПОДПИСЬ "ПО ПРАВИЛАМ" (МЯГКИЙ ВАРИАНТ):
+По умолчанию НЕ добавляй никаких фраз вида «так указано...».
+Добавляй ОДНУ финальную строку подписи ТОЛЬКО если вопрос относится к правилам/штрафам/запретам/ответственности.
+Тип B включается ТОЛЬКО при явных словах: «штраф», «запрет», «нельзя», «курить», «документы», «выселение», «ответственность», «возмещение».
+Тогда в конце добавь одну строку (без двоеточий): «Так указано в правилах отеля.»
+
+ПРО ИСТОЧНИК:
+Не добавляй «Источник: ...», если пользователь сам не спросил «откуда информация?» или «где написано?».
+Если спросил — добавь одной строкой: «Источник: официальная информация отеля.»
+
+ПЕРСОНАЛЬНЫЕ ДАННЫЕ:
+Не проси и не принимай ФИО/телефон/email/паспорт/номер брони. Если прислали — попроси написать без персональных данных.
+
+БРОНИРОВАНИЕ (КРИТИЧЕСКИ ВАЖНО):
+Триггеры: «бронь», «забронировать», «оформить» (и все их формы).
+
+Если есть триггер:
+1. Сначала ответь по доступной информации (если есть вопрос о ценах/условиях).
+2. Затем добавь фразу:
+   «Я не могу оформить бронирование в чате по причине защиты персональных данных, но помогу с выбором.»
+3. И в конце двумя строками (один раз за диалог):
+   
+   Телефон: <a href="tel:+79789980978">+7 (978) 998-09-78</a>
+   Бронирование: <a href="https://dinasty-crimea.ru/booking/">dinasty-crimea.ru/booking/</a>
+
+Если просят повторить контакты: «Контакты уже отправлял(а) выше, продублировать?»
+
+ЗАПРОСЫ НА СМЕНУ ЯЗЫКА, ОБРАЩЕНИЯ И ФОРМАТА:
+Если пользователь просит:
+- перейти на «ты»
+- добавить эмодзи
+- использовать восклицательные знаки
+
+Ответ: вежливо откажи одной фразой и продолжай в исходных настройках.
+Шаблон: «Я буду писать на «вы», без эмодзи и без восклицательных знаков.»
+
+Если пользователь просит писать на другом языке — СОГЛАСИСЬ и переключись на указанный язык с этого сообщения и дальше по диалогу.
+При этом сохраняй остальные ограничения стиля: обращение на «вы», без эмодзи и без восклицательных знаков (если в выбранном языке это применимо).
+Если пользователь не указал конкретный язык, задай один вопрос: «На каком языке вам удобнее?»
+
+ЕСЛИ ПРОСЯТ «ССЫЛКОЙ/КНОПКОЙ/В MARKDOWN»:
+Если пользователь просит «перешлите ваш ответ в виде ссылки», «кнопкой», «в markdown», «в виде оформления/красиво со ссылками» — вежливо откажи и ответь обычным текстом в разрешённом формате Telegram (обычный текст + переносы строк + <b>…</b> и при необходимости <a href="...">…</a>).
+Шаблон: «Я могу ответить только обычным текстом в чате. Подскажу так.»
+
+АГРЕССИЯ И ГРУБОСТЬ:
+Если пользователь пишет грубо, агрессивно, с провокациями:
+- сохраняй спокойный нейтральный тон
+- не спорь и не оценивай пользователя
+- не отвечай грубостью на грубость
+- игнорируй тон и продолжай помогать по сути, либо (если данных не хватает) используй «УТОЧНЕНИЕ» с одним вопросом
+
+MINI-SYSTEM: РАСЧЁТ ЦЕН (используй только для запросов о стоимости)
+Ты считаешь стоимость только по строкам из блока «Доступная информация из документов:». Никаких догадок.
+
+Правила расчёта:
+1. Всегда сначала определить: заезд–выезд и число ночей.
+2. Цена всегда показывается как:
+   - «за 1 ночь: …»
+   - «итого за N ночей: …»
+3. Если период пересекает смену тарифов — считать по частям и дать общий итог.
+4. Если не указана категория номера — показать 2–3 типовые категории с вариантами питания (без питания / завтрак / полный пансион) и задать 1 вопрос «Какую категорию номера выбираете?»
+5. Если категория указана, но питание нет — показать все варианты питания для этой категории и задать 1 вопрос «Какой вариант питания вам удобнее?»
+6. Если в документах нет тарифов или не хватает данных — сказать «Пока не вижу точной информации по этому вопросу.» и задать 1 уточняющий вопрос по приоритету: даты → тип номера → взрослые → дети → возраст.''')
+        
+        chat_provider = ai_model
+
+        chat_provider = ai_model
+
+        # Ключи провайдеров эмбеддингов и LLM — одним запросом по уже открытому соединению
+        key_providers = [
+            embedding_provider if embedding_provider in ('yandexgpt', 'openrouter') else 'openai',
+            'yandexgpt' if chat_provider == 'yandexgpt' else 'openrouter'
+        ]
+        with timer.stage('api_keys'):
+            api_keys, error = get_tenant_api_keys(tenant_id, key_providers, conn)
+        if error:
+            return error
+
+        # Индекс тенанта не зависит от эмбеддинга запроса: грузим его, пока идёт HTTP-запрос к провайдеру.
+        # Для pgvector индекс нужен только как запасной путь, его не предзагружаем.
+        index_future = None
+        if retrieval_backend != 'pgvector':
+            index_future = submit(timer.wrap('index_load', prefetch_tenant_index), tenant_id)
+
+        cached_answer = None
+        answer_cache_info = None
+        corpus_version = None
+
+        try:
+            embedding_started = time.monotonic()
+            query_embedding, embedding_cache_info = get_cached_query_embedding(
+                cur, embedding_provider, embedding_model, user_message
+            )
+
+            if query_embedding is None:
+                if embedding_provider == 'yandexgpt':
+                    import requests
+                    yandex_api_key, error = require_api_key(api_keys, 'yandexgpt', 'api_key')
+                    if error:
+                        return error
+                    yandex_folder_id, error = require_api_key(api_keys, 'yandexgpt', 'folder_id')
+                    if error:
+                        return error
+                
+                    # Для запросов пользователей всегда используем text-search-query
+                    emb_response = requests.post(
+                        'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding',
+                        headers={
+                            'Authorization': f'Api-Key {yandex_api_key}',
+                            'Content-Type': 'application/json'
+                        },
+                        json={
+                            'modelUri': f'emb://{yandex_folder_id}/text-search-query/latest',
+                            'text': user_message
+                        }
+                    )
+                    emb_data = emb_response.json()
+                    query_embedding = emb_data['embedding']
+                elif embedding_provider == 'openrouter':
+                    openrouter_key, error = require_api_key(api_keys, 'openrouter', 'api_key')
+                    if error:
+                        return error
+                    embedding_client = OpenAI(
+                        api_key=openrouter_key,
+                        base_url="https://openrouter.ai/api/v1"
+                    )
+                    query_embedding_response = embedding_client.embeddings.create(
+                        model=embedding_model,
+                        input=user_message
+                    )
+                    query_embedding = query_embedding_response.data[0].embedding
+                else:
+                    openai_key, error = require_api_key(api_keys, 'openai', 'api_key')
+                    if error:
+                        return error
+                    embedding_client = OpenAI(api_key=openai_key)
+                    query_embedding_response = embedding_client.embeddings.create(
+                        model=embedding_model,
+                        input=user_message
+                    )
+                    query_embedding = query_embedding_response.data[0].embedding
+
+                put_query_embedding(cur, embedding_provider, embedding_model, user_message, query_embedding)
+            timer.record('embedding', (time.monotonic() - embedding_started) * 1000)
+
+            query_embedding_json = json.dumps(query_embedding)
+
+            if answer_cache_enabled:
+                with timer.stage('answer_cache'):
+                    corpus_version = get_corpus_version(cur, tenant_id)
+                    cached_answer, answer_cache_info = lookup_cached_answer(
+                        cur, tenant_id, corpus_version, ai_settings_hash, query_embedding, answer_cache_threshold
+                    )
+
+            if cached_answer is not None:
+                # Ответ на почти такой же вопрос уже есть: retrieval, gate и LLM не нужны
+                rag_debug_log({
+                    'event': 'answer_cache_hit',
+                    'request_id': request_id,
+                    'query_hash': hashlib.sha256(user_message.encode()).hexdigest()[:12],
+                    'timestamp': datetime.utcnow().isoformat(),
+                    'answer_cache': answer_cache_info,
+                    'embedding_cache': embedding_cache_info
+                })
+
+                context = ""
+                context_ok = True
+                gate_reason = cached_answer['gate_reason'] or 'answer_cache'
+                sims = []
+                gate_debug = {'top_k_used': None, 'answer_cache_similarity': cached_answer['similarity']}
+            else:
+                overlap_rate = low_overlap_rate()
+                start_top_k = RAG_TOPK_FALLBACK if (RAG_LOW_OVERLAP_START_TOPK5 and overlap_rate >= RAG_LOW_OVERLAP_THRESHOLD) else RAG_TOPK_DEFAULT
+                # Берём сразу столько кандидатов, сколько может понадобиться для fallback-попытки
+                candidates_top_k = max(start_top_k, RAG_TOPK_FALLBACK)
+
+                scored_chunks = None
+                index_cache_info = None
+                hybrid_used = False
+                if retrieval_backend == 'pgvector':
+                    # Выборка и скоринг идут одним SQL-запросом
+                    with timer.stage('chunk_fetch'):
+                        scored_chunks = search_pgvector(cur, tenant_id, query_embedding, candidates_top_k)
+                if not scored_chunks:
+                    if retrieval_backend == 'pgvector':
+                        # Ошибка или ни одного чанка с embedding_vec (например, документы до переключения)
+                        print(f"pgvector returned no chunks for tenant {tenant_id}, falling back to in-function scoring")
+                    # Включая ожидание предзагрузки индекса, если она не успела к этому моменту
+                    with timer.stage('chunk_fetch'):
+                        if index_future is not None:
+                            embedding_index, index_cache_info = index_future.result()
+                        else:
+                            embedding_index, index_cache_info = load_tenant_index(cur, tenant_id)
+                    scoring_started = time.monotonic()
+                    # BM25 + вектор через RRF, если для корпуса тенанта построены постинги
+                    hybrid_used = RAG_HYBRID_SEARCH and embedding_index.bm25 is not None
+                    if hybrid_used:
+                        query_terms = tokenize(user_message, detect_lang_simple(user_message))
+                        scored_chunks = embedding_index.hybrid_search(
+                            query_embedding, query_terms, top_k=candidates_top_k,
+                            candidates=max(RAG_HYBRID_CANDIDATES, candidates_top_k)
+                        )
+                    else:
+                        scored_chunks = embedding_index.search(query_embedding, top_k=candidates_top_k)
+                    timer.record('scoring', (time.monotonic() - scoring_started) * 1000)
+
+                if scored_chunks:
+                    print(f"DEBUG: Top 3 chunks for query '{user_message}':")
+                    for i, (chunk, sim) in enumerate(scored_chunks[:3]):
+                        print(f"  {i+1}. Similarity: {sim:.4f}, Text: {chunk[:200]}...")
+
+                    query_hash = hashlib.sha256(user_message.encode()).hexdigest()[:12]
+
+                    gate_started = time.monotonic()
+                    context, sims = build_context_with_scores(scored_chunks, top_k=start_top_k, presorted=hybrid_used)
+                    context_ok, gate_reason, gate_debug = quality_gate(user_message, context, sims)
+                
+                    gate_debug['top_k_used'] = start_top_k
+                    gate_debug['overlap_rate'] = overlap_rate
+                
+                    rag_debug_log({
+                        'event': 'rag_gate',
+                        'request_id': request_id,
+                        'query_hash': query_hash,
+                        'timestamp': datetime.utcnow().isoformat(),
+                        'attempt': 1,
+                        'top_k': start_top_k,
+                        'ok': context_ok,
+                        'reason': gate_reason,
+                        'metrics': gate_debug,
+                        'retrieval_backend': retrieval_backend,
+                        'hybrid': hybrid_used,
+                        'index_cache': index_cache_info,
+                        'settings_cache': settings_cache_info,
+                        'invalidation_bus': invalidation_info,
+                        'db_pool': pool_stats(),
+                        'embedding_cache': embedding_cache_info,
+                        'answer_cache': answer_cache_info
+                    })
+                
+                    if 'low_overlap' in gate_reason and start_top_k < RAG_TOPK_FALLBACK:
+                        context2, sims2 = build_context_with_scores(scored_chunks, top_k=RAG_TOPK_FALLBACK, presorted=hybrid_used)
+                        context_ok2, gate_reason2, gate_debug2 = quality_gate(user_message, context2, sims2)
+                    
+                        gate_debug2['top_k_used'] = RAG_TOPK_FALLBACK
+                        gate_debug2['overlap_rate'] = overlap_rate
+                    
+                        rag_debug_log({
+                            'event': 'rag_gate_fallback',
+                            'request_id': request_id,
+                            'query_hash': query_hash,
+                            'timestamp': datetime.utcnow().isoformat(),
+                            'attempt': 2,
+                            'top_k': RAG_TOPK_FALLBACK,
+                            'ok': context_ok2,
+                            'reason': gate_reason2,
+                            'metrics': gate_debug2
+                        })
+                    
+                        context = context2
+                        sims = sims2
+                        context_ok = context_ok2
+                        gate_reason = gate_reason2
+                        gate_debug = gate_debug2
+                
+                    update_low_overlap_stats('low_overlap' in gate_reason)
+                    timer.record('gate', (time.monotonic() - gate_started) * 1000)
+                else:
+                    context = ""
+                    context_ok = False
+                    gate_reason = "no_chunks"
+                    sims = []
+                    gate_debug = {}
+        except Exception as emb_error:
+            print(f"Embedding search error: {emb_error}")
+            cur.execute("""
+                SELECT chunk_text FROM t_p56134400_telegram_ai_bot_pdf.document_chunks 
+                ORDER BY id DESC 
+                LIMIT 3
+            """)
+            chunks = cur.fetchall()
+            context = "\n\n".join([chunk[0] for chunk in chunks]) if chunks else ""
+            context_ok = False
+            gate_reason = "embedding_error"
+            sims = []
+            gate_debug = {"error": str(emb_error)}
+
+        gate_row = (
+            user_message,
+            context_ok,
+            gate_reason,
+            gate_debug.get('query_type'),
+            gate_debug.get('lang'),
+            gate_debug.get('best_similarity'),
+            gate_debug.get('context_len'),
+            gate_debug.get('overlap'),
+            gate_debug.get('key_tokens'),
+            gate_debug.get('top_k_used', 3),
+            cached_answer is not None,
+            gate_debug.get('answer_cache_similarity'),
+            stream_mode
+        )
+
+        # Ключи LLM проверяем до запуска записи в пуле, чтобы ранний return не оставил её без присмотра
+        if cached_answer is None and chat_provider == 'yandexgpt':
+            yandex_api_key, error = require_api_key(api_keys, 'yandexgpt', 'api_key')
+            if error:
+                return error
+            yandex_folder_id, error = require_api_key(api_keys, 'yandexgpt', 'folder_id')
+            if error:
+                return error
+        elif cached_answer is None:
+            openrouter_key, error = require_api_key(api_keys, 'openrouter', 'api_key')
+            if error:
+                return error
+
+        # Сообщение пользователя и лог gate пишутся в пуле, пока LLM генерирует ответ
+        user_turn_future = submit(write_user_turn, conn, tenant_id, session_id, user_message, gate_row, timer)
+        
+        system_prompt = compose_system(system_prompt_template, context, context_ok)
+
+        stream = LLMStream(request_started) if stream_mode else None
+        llm_usage = {}
+        llm_started = time.monotonic()
+
+        if cached_answer is not None:
+            assistant_message = cached_answer['answer']
+            if stream:
+                stream.consume([assistant_message])
+        elif chat_provider == 'yandexgpt':
+            import requests
+            completion_options = {
+                'temperature': ai_temperature,
+                'maxTokens': ai_max_tokens
+            }
+            yandex_messages = [
+                {'role': 'system', 'text': system_prompt},
+                {'role': 'user', 'text': user_message}
+            ]
+            
+            if stream:
+                assistant_message = stream.consume(
+                    stream_yandexgpt(yandex_api_key, yandex_folder_id, completion_options, yandex_messages, llm_usage)
+                )
+            else:
+                yandex_response = requests.post(
+                    'https://llm.api.cloud.yandex.net/foundationModels/v1/completion',
+                    headers={
+                        'Authorization': f'Api-Key {yandex_api_key}',
+                        'Content-Type': 'application/json'
+                    },
+                    json={
+                        'modelUri': f'gpt://{yandex_folder_id}/yandexgpt/latest',
+                        'completionOptions': completion_options,
+                        'messages': yandex_messages
+                    }
+                )
+                yandex_data = yandex_response.json()
+                assistant_message = yandex_data['result']['alternatives'][0]['message']['text']
+                if 'usage' in yandex_data['result']:
+                    llm_usage['completion_tokens'] = int(yandex_data['result']['usage'].get('completionTokens', 0))
+        else:
+            chat_client = OpenAI(
+                api_key=openrouter_key,
+                base_url="https://openrouter.ai/api/v1"
+            )
+            chat_messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ]
+            chat_params = {
+                'temperature': ai_temperature,
+                'top_p': ai_top_p,
+                'frequency_penalty': ai_frequency_penalty,
+                'presence_penalty': ai_presence_penalty,
+                'max_tokens': ai_max_tokens
+            }
+            if stream:
+                # Передаём название модели напрямую (например, 'deepseek/deepseek-chat')
+                assistant_message = stream.consume(
+                    stream_openrouter(chat_client, chat_provider, chat_messages, llm_usage, **chat_params)
+                )
+            else:
+                response = chat_client.chat.completions.create(
+                    model=chat_provider,  # Передаём название модели напрямую (например, 'deepseek/deepseek-chat')
+                    messages=chat_messages,
+                    **chat_params
+                )
+                assistant_message = response.choices[0].message.content
+                if response.usage:
+                    llm_usage['completion_tokens'] = response.usage.completion_tokens
+        timer.record('llm', (time.monotonic() - llm_started) * 1000)
+
+        gate_log_id = user_turn_future.result()
+
+        # Без стриминга первого токена не видно: время до всего ответа — это llm_ms, а не TTFT
+        ttft_ms = stream.ttft_ms if stream else None
+        llm_ms = stream.llm_ms if stream else round((time.monotonic() - llm_started) * 1000, 1)
+        with timer.stage('db_gate_timing'):
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
+                SET ttft_ms = %s, llm_ms = %s
+                WHERE id = %s
+            """, (ttft_ms, llm_ms, gate_log_id))
+
+        if answer_cache_enabled and cached_answer is None and context_ok and corpus_version is not None:
+            with timer.stage('db_answer_cache'):
+                store_answer(cur, tenant_id, corpus_version, ai_settings_hash,
+                             user_message, query_embedding, assistant_message, gate_reason)
+
+        with timer.stage('db_assistant_message'):
+            execute_prepared(cur, 'insert_chat_message', (session_id, 'assistant', assistant_message))
+            conn.commit()
+
+        timings = timer.summary()
+        write_chat_timings(conn, request_id, tenant_id, session_id, timings, {
+            'chunk_count': len(sims),
+            'prompt_chars': len(system_prompt) + len(user_message),
+            'completion_tokens': llm_usage.get('completion_tokens'),
+            'ttft_ms': ttft_ms,
+            'streamed': stream_mode,
+            'answer_cache_hit': cached_answer is not None
+        })
+
+        cur.close()
+        rag_debug_log({
+            'event': 'llm_stream' if stream else 'llm_complete',
+            'request_id': request_id,
+            'timestamp': datetime.utcnow().isoformat(),
+            'gate_log_id': gate_log_id,
+            'ok': context_ok,
+            'reason': gate_reason,
+            'ttft_ms': ttft_ms,
+            'llm_ms': llm_ms,
+            'deltas': len(stream.parts) if stream else None,
+            'answer_cache_hit': cached_answer is not None,
+            'timings': timings
+        })
+
+        debug_info = {
+            'context_ok': context_ok,
+            'gate_reason': gate_reason,
+            'gate_info': gate_debug,
+            'ttft_ms': ttft_ms,
+            'streamed': stream_mode,
+            'timings': timings
+        }
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'message': assistant_message,
+                'sessionId': session_id,
+                'debug': debug_info
+            }),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        # Соединение возвращается в пул и на ранних return; запись в пуле ещё может его держать
+        if user_turn_future is not None:
+            user_turn_future.exception()
+        if conn is not None:
+            conn.close()
\ No newline at end of file
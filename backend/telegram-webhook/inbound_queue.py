@@ -0,0 +1,228 @@
+"""
+Очередь входящих сообщений мессенджеров (inbound_messages в Postgres).
+
+Webhook сохраняет нормализованное сообщение (enqueue_message), будит
+inbound-worker (kick_worker) и сразу отвечает 200, не дожидаясь LLM.
+Воркер забирает строки claim_messages через FOR UPDATE SKIP LOCKED,
+поэтому несколько экземпляров воркера не берут одно и то же сообщение.
+
+При захвате соблюдаются:
+- не больше INBOUND_TENANT_CONCURRENCY сообщений тенанта в обработке;
+- сообщение сессии гостя берётся, только когда все более ранние завершены
+  (ответы по порядку, в том числе пока предыдущее ждёт повтора).
+
+Неудачная попытка откладывается с экспоненциальной задержкой, после
+INBOUND_MAX_ATTEMPTS попыток сообщение переходит в dead. Строка в
+processing дольше INBOUND_STALE_SECONDS (воркер упал или вышел по
+таймауту) снова становится доступной.
+"""
+import hmac
+import json
+import os
+import random
+from typing import Dict, List, Optional
+
+import requests
+
+from db import get_connection
+
+# Адрес функции inbound-worker; пока он не задан, webhook-и отвечают синхронно, как раньше
+INBOUND_WORKER_URL = os.environ.get('INBOUND_WORKER_URL', '')
+# Общий секрет webhook-ов и inbound-worker: без него HTTP-вызовы воркера получают 403
+INBOUND_WORKER_SECRET = os.environ.get('INBOUND_WORKER_SECRET', '')
+INBOUND_WORKER_SECRET_HEADER = 'X-Inbound-Worker-Secret'
+INBOUND_KICK_TIMEOUT = float(os.environ.get('INBOUND_KICK_TIMEOUT', '0.5'))
+INBOUND_MAX_ATTEMPTS = int(os.environ.get('INBOUND_MAX_ATTEMPTS', '5'))
+INBOUND_RETRY_BASE_SECONDS = float(os.environ.get('INBOUND_RETRY_BASE_SECONDS', '5'))
+INBOUND_RETRY_MAX_SECONDS = float(os.environ.get('INBOUND_RETRY_MAX_SECONDS', '600'))
+INBOUND_TENANT_CONCURRENCY = int(os.environ.get('INBOUND_TENANT_CONCURRENCY', '4'))
+INBOUND_STALE_SECONDS = int(os.environ.get('INBOUND_STALE_SECONDS', '120'))
+
+SCHEMA = 't_p56134400_telegram_ai_bot_pdf'
+
+
+def queue_enabled() -> bool:
+    return bool(INBOUND_WORKER_URL)
+
+
+def enqueue_message(tenant_id: int, channel: str, session_id: str, reply_to, user_message: str,
+                    idempotency_key: Optional[str] = None) -> Optional[int]:
+    """
+    Поставить сообщение в очередь; None, если записать не удалось (webhook ответит синхронно).
+    Повторная доставка с тем же idempotency_key возвращает id уже поставленного сообщения.
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.inbound_messages
+            (tenant_id, channel, session_id, reply_to, user_message, idempotency_key)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (tenant_id, idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+            RETURNING id
+        """, (tenant_id, channel, session_id, json.dumps(reply_to), user_message, idempotency_key))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute(f"""
+                SELECT id FROM {SCHEMA}.inbound_messages
+                WHERE tenant_id = %s AND idempotency_key = %s
+            """, (tenant_id, idempotency_key))
+            row = cur.fetchone()
+            print(f"Inbound message {idempotency_key} already queued as {row[0] if row else None}")
+        conn.commit()
+        cur.close()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"Inbound queue enqueue error: {e}")
+        return None
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def kick_worker():
+    """
+    Разбудить inbound-worker, не дожидаясь результата: запрос обрывается по
+    таймауту, а функция воркера доводит выборку до конца. Если вызов не дошёл,
+    сообщение заберёт следующий запуск воркера по таймеру.
+    """
+    try:
+        requests.post(INBOUND_WORKER_URL, json={}, timeout=INBOUND_KICK_TIMEOUT,
+                      headers={INBOUND_WORKER_SECRET_HEADER: INBOUND_WORKER_SECRET})
+    except requests.exceptions.Timeout:
+        pass
+    except Exception as e:
+        print(f"Inbound worker kick error: {e}")
+
+
+def worker_authorized(event: dict) -> bool:
+    """HTTP-вызов воркера с верным секретом; пока INBOUND_WORKER_SECRET не задан — никакой"""
+    if not INBOUND_WORKER_SECRET:
+        return False
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return hmac.compare_digest(headers.get(INBOUND_WORKER_SECRET_HEADER.lower()) or '', INBOUND_WORKER_SECRET)
+
+
+def claim_messages(conn, limit: int) -> List[Dict]:
+    """Забрать до limit сообщений в обработку с учётом лимита тенанта и порядка в сессии"""
+    cur = conn.cursor()
+    # Захваты сериализуются, иначе два воркера одновременно превысят лимит тенанта
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('inbound_messages_claim'))")
+
+    # Зависшие строки, у которых кончились попытки, больше не берём
+    cur.execute(f"""
+        UPDATE {SCHEMA}.inbound_messages
+        SET status = 'dead', last_error = COALESCE(last_error, 'worker timeout'), updated_at = NOW()
+        WHERE status = 'processing'
+          AND locked_at <= NOW() - make_interval(secs => %s)
+          AND attempts >= %s
+    """, (INBOUND_STALE_SECONDS, INBOUND_MAX_ATTEMPTS))
+
+    cur.execute(f"""
+        SELECT tenant_id, COUNT(*)
+        FROM {SCHEMA}.inbound_messages
+        WHERE status = 'processing' AND locked_at > NOW() - make_interval(secs => %s)
+        GROUP BY tenant_id
+    """, (INBOUND_STALE_SECONDS,))
+    busy_tenants: Dict[int, int] = {tenant_id: count for tenant_id, count in cur.fetchall()}
+
+    # Только самое раннее незавершённое сообщение сессии: пока предыдущее в обработке
+    # или ждёт повтора после ошибки, следующие сообщения той же сессии не берутся.
+    # LIMIT с запасом: часть строк отсеется по лимиту тенанта
+    cur.execute(f"""
+        SELECT m.id, m.tenant_id, m.channel, m.session_id, m.reply_to, m.user_message, m.attempts, m.idempotency_key
+        FROM {SCHEMA}.inbound_messages m
+        WHERE ((m.status = 'pending' AND m.next_attempt_at <= NOW())
+               OR (m.status = 'processing' AND m.locked_at <= NOW() - make_interval(secs => %s)))
+          AND NOT EXISTS (
+              SELECT 1 FROM {SCHEMA}.inbound_messages o
+              WHERE o.tenant_id = m.tenant_id AND o.session_id = m.session_id
+                AND o.id < m.id AND o.status IN ('pending', 'processing')
+          )
+        ORDER BY m.id
+        LIMIT %s
+        FOR UPDATE OF m SKIP LOCKED
+    """, (INBOUND_STALE_SECONDS, limit * 5))
+
+    claimed = []
+    for message_id, tenant_id, channel, session_id, reply_to, user_message, attempts, idempotency_key in cur.fetchall():
+        if busy_tenants.get(tenant_id, 0) >= INBOUND_TENANT_CONCURRENCY:
+            continue
+        busy_tenants[tenant_id] = busy_tenants.get(tenant_id, 0) + 1
+        claimed.append({
+            'id': message_id,
+            'tenant_id': tenant_id,
+            'channel': channel,
+            'session_id': session_id,
+            'reply_to': reply_to,
+            'user_message': user_message,
+            'attempts': attempts + 1,
+            'idempotency_key': idempotency_key
+        })
+        if len(claimed) >= limit:
+            break
+
+    if claimed:
+        cur.execute(f"""
+            UPDATE {SCHEMA}.inbound_messages
+            SET status = 'processing', attempts = attempts + 1, locked_at = NOW(), updated_at = NOW()
+            WHERE id = ANY(%s)
+        """, ([m['id'] for m in claimed],))
+    conn.commit()
+    cur.close()
+    return claimed
+
+
+def retry_delay(attempts: int) -> float:
+    """Экспоненциальная задержка с разбросом ±20%, чтобы повторы не шли пачкой"""
+    delay = min(INBOUND_RETRY_MAX_SECONDS, INBOUND_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def complete_message(conn, message_id: int):
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE {SCHEMA}.inbound_messages
+        SET status = 'done', locked_at = NULL, last_error = NULL, updated_at = NOW()
+        WHERE id = %s
+    """, (message_id,))
+    conn.commit()
+    cur.close()
+
+
+def fail_message(conn, message_id: int, attempts: int, error: str) -> str:
+    """Отложить повтор или перевести в dead; возвращает новый статус"""
+    status = 'dead' if attempts >= INBOUND_MAX_ATTEMPTS else 'pending'
+    cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE {SCHEMA}.inbound_messages
+        SET status = %s,
+            next_attempt_at = NOW() + make_interval(secs => %s),
+            locked_at = NULL,
+            last_error = %s,
+            updated_at = NOW()
+        WHERE id = %s
+    """, (status, retry_delay(attempts), error[:1000], message_id))
+    conn.commit()
+    cur.close()
+    return status
+
+
+def queue_stats(conn) -> Dict:
+    """Число сообщений по статусам и возраст самого старого ожидающего"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT status, COUNT(*),
+               EXTRACT(EPOCH FROM NOW() - MIN(created_at)) FILTER (WHERE status = 'pending')
+        FROM {SCHEMA}.inbound_messages
+        WHERE status <> 'done' OR updated_at > NOW() - INTERVAL '1 hour'
+        GROUP BY status
+    """)
+    stats = {'pending': 0, 'processing': 0, 'done_last_hour': 0, 'dead': 0, 'oldest_pending_seconds': None}
+    for status, count, oldest in cur.fetchall():
+        stats['done_last_hour' if status == 'done' else status] = count
+        if oldest is not None:
+            stats['oldest_pending_seconds'] = round(float(oldest), 1)
+    cur.close()
+    return stats
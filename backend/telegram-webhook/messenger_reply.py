@@ -0,0 +1,238 @@
+"""
+Ответ гостю в мессенджере: вызов chat и отправка текста в канал.
+
+Общий код webhook-ов и inbound-worker: webhook вызывает deliver_reply
+синхронно (очередь выключена), воркер — для сообщений из inbound_messages.
+Пачку сообщений из одного запроса webhook разбирает dispatch_messages.
+
+Конвейер chat (backend/chat/chat_pipeline.py) выполняется прямо в процессе
+вызывающей функции — без HTTPS-вызова функции chat, её холодного старта и
+JSON туда-обратно. Модули chat лежат в каталоге функции копиями
+(sync_shared.py). CHAT_IN_PROCESS=false возвращает вызов по HTTP.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from api_keys_helper import get_tenant_api_keys, require_api_key
+from inbound_queue import queue_enabled, enqueue_message, kick_worker
+
+CHAT_FUNCTION_URL = 'https://functions.poehali.dev/7b58f4fb-5db0-4f85-bb3b-55bafa4cbf73'
+CHAT_IN_PROCESS = os.environ.get('CHAT_IN_PROCESS', 'true').lower() == 'true'
+FALLBACK_ANSWER = 'Извините, не могу ответить'
+# Сколько сессий из одного запроса webhook обрабатываются одновременно
+WEBHOOK_DISPATCH_THREADS = int(os.environ.get('WEBHOOK_DISPATCH_THREADS', '4'))
+
+# Без копий модулей chat (или numpy/openai в requirements) — вызов по HTTP
+try:
+    from chat_pipeline import run_chat
+except ImportError as e:
+    print(f"Chat pipeline unavailable in process, using HTTP: {e}")
+    run_chat = None
+
+# Ключи канала, без которых ответ не отправить
+CHANNEL_KEYS = {
+    'telegram': ('bot_token',),
+    'max': ('bot_token',),
+    'vk': ('group_token',),
+    'whatsapp': ('phone_number_id', 'access_token'),
+}
+
+# Пул живёт между тёплыми вызовами webhook-а
+_dispatch_executor = ThreadPoolExecutor(max_workers=WEBHOOK_DISPATCH_THREADS)
+
+
+def ask_chat(tenant_id: int, session_id: str, user_message: str, idempotency_key: str | None = None) -> str | None:
+    """Ответ chat; None — повторная доставка, которую ещё обрабатывает первый вызов"""
+    chat_body = {
+        'message': user_message,
+        'sessionId': session_id,
+        'tenantId': tenant_id,
+        'idempotencyKey': idempotency_key
+    }
+
+    started = time.monotonic()
+    in_process = CHAT_IN_PROCESS and run_chat is not None
+    if in_process:
+        response = run_chat(chat_body)
+        status_code = response['statusCode']
+        chat_data = json.loads(response['body']) if status_code == 200 else None
+    else:
+        chat_response = requests.post(
+            CHAT_FUNCTION_URL,
+            json=chat_body,
+            headers={'Content-Type': 'application/json'},
+            timeout=30
+        )
+        status_code = chat_response.status_code
+        chat_data = chat_response.json() if chat_response.ok else None
+
+    print(f"Chat {'in-process' if in_process else 'http'}: {(time.monotonic() - started) * 1000:.0f} ms")
+    if chat_data is None:
+        raise Exception(f'Chat function error: {status_code}')
+
+    if chat_data.get('inFlight'):
+        return None
+    return chat_data.get('message') or FALLBACK_ANSWER
+
+
+def send_reply(channel: str, keys: dict, reply_to, text: str):
+    """Отправить ответ в канал; исключение, если API мессенджера вернул ошибку"""
+    if channel == 'telegram':
+        response = requests.post(
+            f"https://api.telegram.org/bot{keys['bot_token']}/sendMessage",
+            json={'chat_id': reply_to, 'text': text, 'parse_mode': 'Markdown'},
+            timeout=10
+        )
+        if not response.ok:
+            raise Exception(f'Telegram API error: {response.status_code}')
+
+    elif channel == 'max':
+        response = requests.post(
+            f"https://platform-api.max.ru/bot{keys['bot_token']}/sendMessage",
+            json={'chat_id': reply_to, 'text': text},
+            timeout=10
+        )
+        if not response.ok:
+            raise Exception(f'MAX API error: {response.status_code}')
+
+    elif channel == 'vk':
+        response = requests.post(
+            'https://api.vk.com/method/messages.send',
+            data={
+                'user_id': reply_to,
+                'message': text,
+                'random_id': 0,
+                'access_token': keys['group_token'],
+                'v': '5.131'
+            },
+            timeout=10
+        )
+        vk_data = response.json()
+        if 'error' in vk_data:
+            raise Exception(f'VK API error: {vk_data["error"]["error_msg"]}')
+
+    elif channel == 'whatsapp':
+        response = requests.post(
+            f"https://graph.facebook.com/v18.0/{keys['phone_number_id']}/messages",
+            json={
+                'messaging_product': 'whatsapp',
+                'to': reply_to,
+                'type': 'text',
+                'text': {'body': text}
+            },
+            headers={
+                'Authorization': f"Bearer {keys['access_token']}",
+                'Content-Type': 'application/json'
+            },
+            timeout=10
+        )
+        if not response.ok:
+            raise Exception(f'WhatsApp API error: {response.status_code} - {response.text}')
+
+    else:
+        raise ValueError(f'Неизвестный канал: {channel}')
+
+
+def deliver_reply(tenant_id: int, channel: str, session_id: str, reply_to, user_message: str,
+                  idempotency_key: str | None = None) -> dict | None:
+    """
+    Получить ответ chat и отправить его гостю.
+
+    Ключи канала проверяются до вызова chat, чтобы не тратить генерацию впустую.
+    Если то же сообщение (idempotency_key) ещё обрабатывает другой вызов,
+    ответ отправит он.
+
+    Returns:
+        None при успехе либо HTTP ошибка (ключ канала не настроен);
+        сбои chat и API мессенджера выбрасываются исключением
+    """
+    api_keys, error = get_tenant_api_keys(tenant_id, [channel])
+    if error:
+        return error
+
+    keys = {}
+    for key_name in CHANNEL_KEYS[channel]:
+        keys[key_name], error = require_api_key(api_keys, channel, key_name)
+        if error:
+            return error
+
+    ai_message = ask_chat(tenant_id, session_id, user_message, idempotency_key)
+    if ai_message is not None:
+        send_reply(channel, keys, reply_to, ai_message)
+    return None
+
+
+def _dispatch_session(messages: list) -> list:
+    """Сообщения одной сессии по порядку; исход каждого — queued, answered или HTTP ошибка"""
+    outcomes = []
+    for m in messages:
+        if queue_enabled() and enqueue_message(m['tenant_id'], m['channel'], m['session_id'], m['reply_to'],
+                                               m['user_message'], m['idempotency_key']) is not None:
+            outcomes.append('queued')
+            continue
+        try:
+            error = deliver_reply(m['tenant_id'], m['channel'], m['session_id'], m['reply_to'],
+                                  m['user_message'], m['idempotency_key'])
+        except Exception as e:
+            print(f"Webhook {m['channel']} message {m['idempotency_key']} failed: {e}")
+            error = {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
+        outcomes.append(error or 'answered')
+    return outcomes
+
+
+def dispatch_messages(messages: list, unrouted: int = 0) -> dict:
+    """
+    Поставить в очередь или ответить на все сообщения запроса webhook-а.
+
+    Мессенджеры присылают несколько сообщений одним запросом; разные сессии
+    обрабатываются параллельно (не больше WEBHOOK_DISPATCH_THREADS), сообщения
+    одной сессии — по порядку, как в inbound-worker. Воркер будится один раз
+    на запрос.
+
+    Args:
+        messages: словари tenant_id, channel, session_id, reply_to,
+                  user_message, idempotency_key
+        unrouted: сколько сообщений запроса пропущено, потому что тенант не найден
+
+    Returns:
+        Один ответ webhook-а: 200 со счётчиками, если все сообщения приняты,
+        иначе код первой ошибки — мессенджер повторит доставку, а уже
+        отвеченные сообщения отсеет idempotency_key
+    """
+    sessions = {}
+    for m in messages:
+        sessions.setdefault((m['tenant_id'], m['session_id']), []).append(m)
+
+    groups = list(sessions.values())
+    if len(groups) == 1:
+        results = [_dispatch_session(groups[0])]
+    else:
+        results = list(_dispatch_executor.map(_dispatch_session, groups))
+
+    summary = {'received': len(messages), 'queued': 0, 'answered': 0, 'failed': 0, 'unrouted': unrouted}
+    first_error = None
+    for outcome in (o for outcomes in results for o in outcomes):
+        if isinstance(outcome, dict):
+            summary['failed'] += 1
+            first_error = first_error or outcome
+        else:
+            summary[outcome] += 1
+
+    if summary['queued']:
+        kick_worker()
+    if len(messages) > 1 or unrouted:
+        print(f"Webhook batch: {summary}")
+
+    body = {'ok': first_error is None, **summary}
+    if first_error is not None:
+        body['error'] = json.loads(first_error['body']).get('error')
+    return {
+        'statusCode': 200 if first_error is None else first_error['statusCode'],
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(body),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,213 @@
+"""
+Маршрутизация webhook-ов мессенджеров к тенанту.
+
+Один развёрнутый webhook обслуживает всех тенантов. Тенант определяется по
+таблице в памяти процесса, без запроса к БД на каждое сообщение:
+
+1. slug тенанта в URL: ?tenant=<slug> или последний сегмент пути;
+2. секрет или идентификатор бота из самого запроса, сохранённый тенантом
+   через manage-api-keys (ROUTING_KEYS): заголовок secret_token Telegram и
+   MAX, secret / group_id Callback API VK, phone_number_id WhatsApp;
+3. WEBHOOK_DEFAULT_TENANT_ID, если задан, — для старых webhook-ов без slug
+   и секрета; иначе такой запрос получает 404.
+
+Таблица читается из tenants и tenant_api_keys целиком и сбрасывается по
+KIND_API_KEYS шины инвалидации, по TTL и (не чаще раза в
+TENANT_ROUTING_MISS_RELOAD_SECONDS) при неизвестном slug или секрете —
+так подхватываются только что созданные тенанты.
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from api_keys_helper import _error_response
+from db import get_connection
+from invalidation_bus import register_handler, KIND_API_KEYS
+
+TENANT_ROUTING_TTL = float(os.environ.get('TENANT_ROUTING_TTL', '300'))
+TENANT_ROUTING_MISS_RELOAD_SECONDS = float(os.environ.get('TENANT_ROUTING_MISS_RELOAD_SECONDS', '10'))
+# Тенант для запросов без slug и секрета; по умолчанию не задан — такие запросы получают 404
+WEBHOOK_DEFAULT_TENANT_ID = os.environ.get('WEBHOOK_DEFAULT_TENANT_ID', '')
+# До маршрутизации webhook-и обслуживали только этого тенанта, его сессии — без tenant_id
+LEGACY_SESSION_TENANT_ID = 1
+
+# channel -> ключи tenant_api_keys, по значению которых находится тенант
+ROUTING_KEYS = {
+    'telegram': ('webhook_secret',),
+    'max': ('webhook_secret',),
+    'vk': ('secret_key', 'group_id'),
+    'whatsapp': ('phone_number_id',),
+}
+
+# Ключ, который обязан совпасть с запросом, если тенант его задал
+VERIFY_KEYS = {
+    'telegram': 'webhook_secret',
+    'max': 'webhook_secret',
+    'vk': 'secret_key',
+}
+
+_table: Dict = {'slugs': {}, 'routes': {}, 'secrets': {}, 'loaded_at': None}
+_lock = threading.Lock()
+_last_miss_reload = 0.0
+_stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'defaults': 0}
+
+
+def invalidate_routing(tenant_id: Optional[int] = None):
+    """Ключи любого тенанта меняют общую таблицу, поэтому она перечитывается целиком"""
+    with _lock:
+        _table['loaded_at'] = None
+
+
+register_handler(KIND_API_KEYS, lambda tenant_id, version: invalidate_routing(tenant_id))
+
+
+def _load():
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, slug FROM t_p56134400_telegram_ai_bot_pdf.tenants")
+        slugs = {slug: tenant_id for tenant_id, slug in cur.fetchall()}
+
+        key_names = sorted({name for names in ROUTING_KEYS.values() for name in names})
+        cur.execute("""
+            SELECT tenant_id, provider, key_name, key_value
+            FROM t_p56134400_telegram_ai_bot_pdf.tenant_api_keys
+            WHERE is_active = true AND provider = ANY(%s) AND key_name = ANY(%s)
+        """, (list(ROUTING_KEYS), key_names))
+        routes, secrets = {}, {}
+        for tenant_id, provider, key_name, key_value in cur.fetchall():
+            if key_name not in ROUTING_KEYS[provider] or not key_value:
+                continue
+            routes[(provider, key_name, str(key_value))] = tenant_id
+            if VERIFY_KEYS.get(provider) == key_name:
+                secrets[(provider, tenant_id)] = str(key_value)
+        cur.close()
+    finally:
+        conn.close()
+
+    with _lock:
+        _table.update(slugs=slugs, routes=routes, secrets=secrets, loaded_at=time.monotonic())
+        _stats['reloads'] += 1
+
+
+def _snapshot(force: bool = False) -> Dict:
+    with _lock:
+        loaded_at = _table['loaded_at']
+    if force or loaded_at is None or time.monotonic() - loaded_at > TENANT_ROUTING_TTL:
+        _load()
+    with _lock:
+        return dict(_table)
+
+
+def _count(outcome: str):
+    with _lock:
+        _stats[outcome] += 1
+
+
+def routing_stats() -> Dict:
+    with _lock:
+        return {**_stats, 'slugs': len(_table['slugs']), 'routes': len(_table['routes'])}
+
+
+def _header(event: dict, name: str) -> Optional[str]:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def request_identifiers(channel: str, event: dict, body: dict) -> Dict[str, str]:
+    """Значения ROUTING_KEYS из запроса канала"""
+    values = {}
+    if channel == 'telegram':
+        values['webhook_secret'] = _header(event, 'x-telegram-bot-api-secret-token')
+    elif channel == 'max':
+        values['webhook_secret'] = _header(event, 'x-max-bot-api-secret')
+    elif channel == 'vk':
+        values['secret_key'] = body.get('secret')
+        values['group_id'] = body.get('group_id')
+    elif channel == 'whatsapp':
+        for entry in body.get('entry') or []:
+            for change in entry.get('changes') or []:
+                phone_number_id = ((change.get('value') or {}).get('metadata') or {}).get('phone_number_id')
+                if phone_number_id:
+                    values['phone_number_id'] = phone_number_id
+    return {k: str(v) for k, v in values.items() if v}
+
+
+def _request_slug(event: dict, table: Dict) -> Tuple[Optional[str], bool]:
+    """(slug, задан явно): ?tenant= всегда явный, сегмент пути — только если это известный slug"""
+    slug = (event.get('queryStringParameters') or {}).get('tenant')
+    if slug:
+        return slug, True
+    path = event.get('path') or (event.get('requestContext') or {}).get('path') or ''
+    last = path.rstrip('/').rsplit('/', 1)[-1]
+    return (last, False) if last in table['slugs'] else (None, False)
+
+
+def _lookup(channel: str, event: dict, body: dict, table: Dict) -> Tuple[Optional[int], Optional[str]]:
+    slug, explicit = _request_slug(event, table)
+    if slug:
+        return table['slugs'].get(slug), 'slug'
+    for key_name, value in request_identifiers(channel, event, body).items():
+        tenant_id = table['routes'].get((channel, key_name, value))
+        if tenant_id is not None:
+            return tenant_id, key_name
+    return None, None
+
+
+def resolve_tenant(channel: str, event: dict, body: dict) -> Tuple[Optional[int], Optional[dict]]:
+    """
+    Определить тенанта для входящего запроса webhook-а.
+
+    Returns:
+        (tenant_id, error_response) - тенант либо HTTP 404 (тенант не найден)
+        или 403 (секрет тенанта не совпал)
+    """
+    global _last_miss_reload
+    table = _snapshot()
+    tenant_id, source = _lookup(channel, event, body, table)
+
+    if tenant_id is None:
+        now = time.monotonic()
+        with _lock:
+            reload = now - _last_miss_reload >= TENANT_ROUTING_MISS_RELOAD_SECONDS
+            if reload:
+                _last_miss_reload = now
+        if reload:
+            table = _snapshot(force=True)
+            tenant_id, source = _lookup(channel, event, body, table)
+
+    if tenant_id is None:
+        slug, explicit = _request_slug(event, table)
+        if not explicit and WEBHOOK_DEFAULT_TENANT_ID:
+            _count('defaults')
+            tenant_id, source = int(WEBHOOK_DEFAULT_TENANT_ID), 'default'
+        else:
+            _count('misses')
+            print(f"Webhook {channel}: tenant not found (slug={slug}, "
+                  f"keys={sorted(request_identifiers(channel, event, body))})")
+            return None, _error_response(404, 'Tenant not found')
+    else:
+        _count('hits')
+
+    # Найденный по slug (или по умолчанию) тенант с заданным секретом проверяет его сам
+    expected = table['secrets'].get((channel, tenant_id))
+    if expected and request_identifiers(channel, event, body).get(VERIFY_KEYS[channel]) != expected:
+        return None, _error_response(403, 'Invalid secret')
+
+    print(f"Webhook {channel} -> tenant {tenant_id} ({source})")
+    return tenant_id, None
+
+
+def channel_session_id(channel: str, tenant_id: int, user_ref) -> str:
+    """
+    session_id гостя в канале. У разных ботов один и тот же chat_id Telegram,
+    поэтому сессии тенанта включают tenant_id; у тенанта, которого webhook-и
+    обслуживали до маршрутизации, формат прежний, чтобы не потерять историю
+    диалогов.
+    """
+    if tenant_id == LEGACY_SESSION_TENANT_ID:
+        return f"{channel}-{user_ref}"
+    return f"{channel}-{tenant_id}-{user_ref}"
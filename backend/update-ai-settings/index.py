@@ -1,8 +1,9 @@
 import json
-import os
-import psycopg2
 from datetime import datetime
 from auth_middleware import get_tenant_id_from_request
+from invalidation_bus import notify_invalidation, KIND_SETTINGS
+
+from db import get_connection
 
 def handler(event: dict, context) -> dict:
     """Обновление настроек AI провайдеров"""
@@ -44,7 +45,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
 
         cur.execute("""
@@ -78,7 +79,7 @@ def handler(event: dict, context) -> dict:
         for key, value in settings.items():
             if key in ['temperature', 'top_p', 'frequency_penalty', 'presence_penalty']:
                 ai_settings[key] = str(value)
-            elif key in ['chat_provider', 'chat_model', 'embedding_provider', 'embedding_model', 'system_prompt', 'max_tokens', 'system_priority', 'creative_mode', 'model']:
+            elif key in ['chat_provider', 'chat_model', 'embedding_provider', 'embedding_model', 'system_prompt', 'max_tokens', 'system_priority', 'creative_mode', 'model', 'retrieval_backend', 'answer_cache_enabled', 'answer_cache_threshold']:
                 ai_settings[key] = value
         
         ai_settings_json = json.dumps(ai_settings)
@@ -88,7 +89,17 @@ def handler(event: dict, context) -> dict:
             SET ai_settings = %s::jsonb,
                 updated_at = CURRENT_TIMESTAMP
             WHERE tenant_id = %s
+            RETURNING updated_at
         """, (ai_settings_json, tenant_id))
+        updated_row = cur.fetchone()
+
+        # Ответы, полученные со старыми настройками, больше не переиспользуются
+        cur.execute("""
+            DELETE FROM t_p56134400_telegram_ai_bot_pdf.answer_cache
+            WHERE tenant_id = %s
+        """, (tenant_id,))
+
+        notify_invalidation(cur, tenant_id, KIND_SETTINGS, updated_row[0].isoformat() if updated_row else None)
 
         conn.commit()
         cur.close()
@@ -1,9 +1,9 @@
 import json
-import os
-import psycopg2
 from datetime import datetime
 from auth_middleware import get_tenant_id_from_request
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """Обновление настроек страницы и быстрых вопросов"""
     method = event.get('httpMethod', 'POST')
@@ -37,7 +37,7 @@ def handler(event: dict, context) -> dict:
         settings = body.get('settings', {})
         quick_questions = body.get('quickQuestions', [])
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
 
         # Обновляем page_settings в JSONB
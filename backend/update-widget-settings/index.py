@@ -1,7 +1,8 @@
 import json
-import os
-import psycopg2
 from auth_middleware import get_tenant_id_from_request
+from invalidation_bus import notify_invalidation, KIND_SETTINGS
+
+from db import get_connection
 
 def handler(event: dict, context) -> dict:
     '''Обновление настроек виджета'''
@@ -33,8 +34,7 @@ def handler(event: dict, context) -> dict:
 
         data = json.loads(event.get('body', '{}'))
         
-        dsn = os.environ.get('DATABASE_URL')
-        conn = psycopg2.connect(dsn)
+        conn = get_connection()
         cur = conn.cursor()
     
         # Формируем JSONB объект с настройками виджета
@@ -84,9 +84,12 @@ def handler(event: dict, context) -> dict:
             UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_settings
             SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP
             WHERE tenant_id = %s
+            RETURNING updated_at
         """
         
         cur.execute(query, tuple(update_values))
+        updated_row = cur.fetchone()
+        notify_invalidation(cur, tenant_id, KIND_SETTINGS, updated_row[0].isoformat() if updated_row else None)
     
         conn.commit()
         cur.close()
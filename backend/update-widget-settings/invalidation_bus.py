@@ -0,0 +1,133 @@
+"""
+Шина инвалидации in-process кэшей между тёплыми экземплярами функций (LISTEN/NOTIFY).
+
+Писатели (update-ai-settings, update-widget-settings, manage-api-keys,
+process-pdf, delete-pdf) в своей транзакции вызывают notify_invalidation —
+Postgres доставит уведомление только после COMMIT. Читатели (chat, webhooks)
+держат одно LISTEN-соединение на экземпляр и в начале каждого вызова
+забирают накопившиеся уведомления через drain_invalidations, сбрасывая
+только затронутые записи своих кэшей.
+
+Локальная проверка двумя процессами на одной БД:
+    DATABASE_URL=... python invalidation_bus.py listen
+    DATABASE_URL=... python invalidation_bus.py notify 1 settings
+"""
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import psycopg2
+
+INVALIDATION_CHANNEL = os.environ.get('INVALIDATION_CHANNEL', 'tenant_cache_invalidation')
+
+# Виды изменений: какие кэши читателя они затрагивают, решают обработчики
+KIND_SETTINGS = 'settings'
+KIND_API_KEYS = 'api_keys'
+KIND_CORPUS = 'corpus'
+
+# kind -> обработчики handler(tenant_id, version)
+_handlers: Dict[str, List[Callable[[int, Optional[str]], None]]] = {}
+_listen_conn = None
+_lock = threading.Lock()
+_stats = {'received': 0, 'applied': 0, 'reconnects': 0, 'errors': 0}
+
+
+def notify_invalidation(cur, tenant_id: int, kind: str, version=None):
+    """Поставить уведомление в транзакцию писателя (уйдёт читателям после COMMIT)"""
+    payload = json.dumps({
+        'tenant_id': tenant_id,
+        'kind': kind,
+        'version': str(version) if version is not None else None
+    })
+    cur.execute("SELECT pg_notify(%s, %s)", (INVALIDATION_CHANNEL, payload))
+
+
+def register_handler(kind: str, handler: Callable[[int, Optional[str]], None]):
+    """Подписать сброс кэша на вид изменений; вызывается при импорте модуля функции"""
+    with _lock:
+        _handlers.setdefault(kind, []).append(handler)
+
+
+def _apply(tenant_id: Optional[int], kind: str, version: Optional[str]):
+    for handler in _handlers.get(kind, []):
+        handler(tenant_id, version)
+
+
+def _connect():
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.set_session(autocommit=True)
+    cur = conn.cursor()
+    cur.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+    cur.close()
+    return conn
+
+
+def drain_invalidations() -> Dict:
+    """
+    Забрать все уведомления, пришедшие с прошлого вызова, и сбросить затронутые кэши.
+
+    Не блокирует: conn.poll() только читает то, что уже лежит в сокете.
+    Если LISTEN-соединения ещё нет или оно порвалось, уведомления за это время
+    потеряны, поэтому сбрасываются кэши всех тенантов (tenant_id=None).
+    """
+    global _listen_conn
+    started = time.perf_counter()
+    received = 0
+
+    with _lock:
+        try:
+            if _listen_conn is None or _listen_conn.closed:
+                reconnect = _listen_conn is not None
+                _listen_conn = _connect()
+                for kind in _handlers:
+                    _apply(None, kind, None)
+                if reconnect:
+                    _stats['reconnects'] += 1
+
+            _listen_conn.poll()
+            while _listen_conn.notifies:
+                notification = _listen_conn.notifies.pop(0)
+                received += 1
+                try:
+                    payload = json.loads(notification.payload)
+                    _apply(payload.get('tenant_id'), payload.get('kind'), payload.get('version'))
+                    _stats['applied'] += 1
+                except (ValueError, AttributeError) as e:
+                    print(f"Invalidation bus bad payload {notification.payload!r}: {e}")
+        except Exception as e:
+            # Без шины кэши всё равно сверяют версии, поэтому ошибка не валит вызов
+            print(f"Invalidation bus error: {e}")
+            _stats['errors'] += 1
+            if _listen_conn is not None:
+                try:
+                    _listen_conn.close()
+                except Exception:
+                    pass
+
+        _stats['received'] += received
+        return {**_stats, 'drained': received, 'ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 4 and sys.argv[1] == 'notify':
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+        notify_invalidation(cur, int(sys.argv[2]), sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None)
+        conn.commit()
+        conn.close()
+        print(f"🔔 {sys.argv[3]} для tenant {sys.argv[2]} отправлено в {INVALIDATION_CHANNEL}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'listen':
+        for kind in (KIND_SETTINGS, KIND_API_KEYS, KIND_CORPUS):
+            register_handler(kind, lambda tenant_id, version, kind=kind:
+                             print(f"🧹 сброс {kind}: tenant={tenant_id} version={version}"))
+        print(f"👂 Слушаю {INVALIDATION_CHANNEL}, Ctrl+C для выхода")
+        while True:
+            stats = drain_invalidations()
+            if stats['drained']:
+                print(stats)
+            time.sleep(1)
+    else:
+        print("Использование: invalidation_bus.py listen | notify <tenant_id> <kind> [version]")
@@ -2,10 +2,11 @@ import json
 import os
 import base64
 import boto3
-import psycopg2
 from datetime import datetime
 from auth_middleware import get_tenant_id_from_request
 
+from db import get_connection
+
 def handler(event: dict, context) -> dict:
     """Загрузка PDF файла в S3 и сохранение метаданных в БД"""
     method = event.get('httpMethod', 'POST')
@@ -67,7 +68,7 @@ def handler(event: dict, context) -> dict:
 
         cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{file_key}"
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         
         cur.execute("""
@@ -1,12 +1,14 @@
 import json
-import os
 import sys
-import requests
-import hashlib
-import psycopg2
 
 sys.path.append('/function/code')
-from api_keys_helper import get_tenant_api_key
+from api_keys_helper import get_tenant_api_keys, require_api_key, invalidate_tenant_api_keys
+from invalidation_bus import drain_invalidations, register_handler, KIND_API_KEYS
+from messenger_reply import dispatch_messages
+from tenant_routing import resolve_tenant, channel_session_id
+
+# Ключи, сохранённые через manage-api-keys, сбрасываются во всех тёплых экземплярах
+register_handler(KIND_API_KEYS, lambda tenant_id, version: invalidate_tenant_api_keys(tenant_id))
 
 def handler(event: dict, context) -> dict:
     """Webhook для VK-бота: принимает сообщения и отвечает через AI-консьержа"""
@@ -33,24 +35,22 @@ def handler(event: dict, context) -> dict:
         }
 
     try:
+        drain_invalidations()
         body = json.loads(event.get('body', '{}'))
-        tenant_id = 1
-        
-        secret_key, error = get_tenant_api_key(tenant_id, 'vk', 'secret_key')
-        if not error and secret_key:
-            received_secret = body.get('secret', '')
-            if received_secret != secret_key:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Invalid secret'}),
-                    'isBase64Encoded': False
-                }
+        # Callback API присылает одно событие; пачка событий (формат Bots Long Poll,
+        # его пересылают прокси) приходит списком updates с group_id в каждом
+        updates = body['updates'] if isinstance(body.get('updates'), list) else [body]
 
-        event_type = body.get('type')
+        if body.get('type') == 'confirmation':
+            # Тенант по group_id или secret запроса; secret_key тенанта проверяется там же
+            tenant_id, error = resolve_tenant('vk', event, body)
+            if error:
+                return error
 
-        if event_type == 'confirmation':
-            group_id, error = get_tenant_api_key(tenant_id, 'vk', 'group_id')
+            api_keys, error = get_tenant_api_keys(tenant_id, ['vk'])
+            if error:
+                return error
+            group_id, error = require_api_key(api_keys, 'vk', 'group_id')
             if error:
                 return error
             confirmation_code = f'vk_confirm_{group_id}'
@@ -61,68 +61,55 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        if event_type == 'message_new':
-            obj = body.get('object', {})
-            message = obj.get('message', {})
+        # В пачке updates могут быть события разных сообществ, поэтому тенант — у каждого свой
+        routes = {}
+        messages = []
+        unrouted = 0
+        for update in updates:
+            if update.get('type') != 'message_new':
+                continue
+            message = (update.get('object') or {}).get('message', {})
             user_id = message.get('from_id')
             user_message = message.get('text', '')
-
             if not user_message:
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'text/plain', 'Access-Control-Allow-Origin': '*'},
-                    'body': 'ok',
-                    'isBase64Encoded': False
-                }
+                continue
 
-            session_id = f"vk-{user_id}"
-            chat_function_url = 'https://functions.poehali.dev/7b58f4fb-5db0-4f85-bb3b-55bafa4cbf73'
-
-            chat_response = requests.post(
-                chat_function_url,
-                json={
-                    'message': user_message,
-                    'sessionId': session_id,
-                    'tenantId': tenant_id
-                },
-                headers={'Content-Type': 'application/json'},
-                timeout=30
-            )
-
-            if not chat_response.ok:
-                raise Exception(f'Chat function error: {chat_response.status_code}')
-
-            chat_data = chat_response.json()
-            ai_message = chat_data.get('message', 'Извините, не могу ответить')
-
-            group_token, error = get_tenant_api_key(tenant_id, 'vk', 'group_token')
-            if error:
-                return error
-
-            vk_api_url = 'https://api.vk.com/method/messages.send'
-            vk_response = requests.post(
-                vk_api_url,
-                data={
-                    'user_id': user_id,
-                    'message': ai_message,
-                    'random_id': 0,
-                    'access_token': group_token,
-                    'v': '5.131'
-                },
-                timeout=10
-            )
-
-            vk_data = vk_response.json()
-            if 'error' in vk_data:
-                raise Exception(f'VK API error: {vk_data["error"]["error_msg"]}')
-
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'text/plain', 'Access-Control-Allow-Origin': '*'},
-                'body': 'ok',
-                'isBase64Encoded': False
+            route = {
+                'group_id': update.get('group_id') or body.get('group_id'),
+                'secret': update.get('secret') or body.get('secret')
             }
-
+            route_key = (route['group_id'], route['secret'])
+            if route_key not in routes:
+                routes[route_key] = resolve_tenant('vk', event, route)
+            tenant_id, error = routes[route_key]
+            if error:
+                # Одиночное событие Callback API получает ошибку, как раньше
+                if len(updates) == 1:
+                    return error
+                print(f"VK update {update.get('event_id')} for group {route['group_id']} skipped: "
+                      f"{error['statusCode']} {json.loads(error['body']).get('error')}")
+                unrouted += 1
+                continue
+
+            messages.append({
+                'tenant_id': tenant_id,
+                'channel': 'vk',
+                'session_id': channel_session_id('vk', tenant_id, user_id),
+                'reply_to': user_id,
+                'user_message': user_message,
+                # event_id одинаков у всех повторов одного события Callback API
+                'idempotency_key': f"vk:{update['event_id']}" if update.get('event_id') else None
+            })
+
+        if messages:
+            # Ответы готовит inbound-worker; без очереди (или если запись не удалась) — синхронно
+            response = dispatch_messages(messages, unrouted)
+            if response['statusCode'] != 200:
+                return response
+        elif unrouted:
+            print(f"VK batch: {unrouted} updates without tenant")
+
+        # Callback API считает доставленным только ответ "ok"
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'text/plain', 'Access-Control-Allow-Origin': '*'},
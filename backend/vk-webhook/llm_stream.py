@@ -0,0 +1,98 @@
+"""
+Потоковая генерация ответа LLM для замера времени до первого токена.
+
+stream_openrouter / stream_yandexgpt — генераторы текстовых дельт,
+LLMStream собирает из них ответ и замеряет TTFT на стороне функции.
+Клиенту ответ по-прежнему уходит одним JSON: среда функций отдаёт тело
+ответа целиком, поэтому потоковая отдача клиенту время до первого токена
+у него не сокращает.
+"""
+import json
+import os
+import time
+from typing import Iterable, Iterator, List, Optional
+
+YANDEX_COMPLETION_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
+
+# true — стримить ответ LLM во всех запросах, а не только с {"stream": true}
+CHAT_LLM_STREAM = os.environ.get('CHAT_LLM_STREAM', 'false').lower() == 'true'
+
+
+def wants_stream(body: dict) -> bool:
+    """Получать ответ LLM потоком (ради замера TTFT): {"stream": true} в теле или CHAT_LLM_STREAM"""
+    return CHAT_LLM_STREAM or bool(body.get('stream'))
+
+
+def stream_openrouter(client, model: str, messages: list, usage: Optional[dict] = None, **params) -> Iterator[str]:
+    """Дельты OpenAI-совместимого chat.completions с stream=True; usage заполняется из последнего чанка"""
+    response = client.chat.completions.create(
+        model=model, messages=messages, stream=True,
+        stream_options={'include_usage': True}, **params
+    )
+    for chunk in response:
+        if usage is not None and getattr(chunk, 'usage', None):
+            usage['completion_tokens'] = chunk.usage.completion_tokens
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+def stream_yandexgpt(api_key: str, folder_id: str, completion_options: dict, messages: list,
+                     usage: Optional[dict] = None) -> Iterator[str]:
+    """
+    Дельты YandexGPT: при completionOptions.stream=true API отдаёт JSON-объекты
+    построчно, и в каждом — весь текст ответа на текущий момент, поэтому
+    дельта — это прирост относительно предыдущего объекта.
+    """
+    import requests
+
+    response = requests.post(
+        YANDEX_COMPLETION_URL,
+        headers={
+            'Authorization': f'Api-Key {api_key}',
+            'Content-Type': 'application/json'
+        },
+        json={
+            'modelUri': f'gpt://{folder_id}/yandexgpt/latest',
+            'completionOptions': {**completion_options, 'stream': True},
+            'messages': messages
+        },
+        stream=True
+    )
+    response.raise_for_status()
+
+    sent = ''
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            continue
+        data = json.loads(line)
+        if 'error' in data:
+            raise RuntimeError(f"YandexGPT stream error: {data['error']}")
+        text = data['result']['alternatives'][0]['message']['text']
+        if usage is not None and 'usage' in data['result']:
+            usage['completion_tokens'] = int(data['result']['usage'].get('completionTokens', 0))
+        if len(text) > len(sent):
+            yield text[len(sent):]
+            sent = text
+
+
+class LLMStream:
+    """Собирает дельты LLM в текст ответа и замеряет время до первого токена"""
+
+    def __init__(self, request_started: float):
+        self.request_started = request_started
+        self.parts: List[str] = []
+        self.ttft_ms: Optional[float] = None
+        self.llm_ms: Optional[float] = None
+
+    def consume(self, deltas: Iterable[str]) -> str:
+        """Прогнать генератор дельт до конца; возвращает полный текст ответа"""
+        llm_started = time.monotonic()
+        for delta in deltas:
+            if self.ttft_ms is None:
+                self.ttft_ms = round((time.monotonic() - self.request_started) * 1000, 1)
+            self.parts.append(delta)
+        self.llm_ms = round((time.monotonic() - llm_started) * 1000, 1)
+        return ''.join(self.parts)
@@ -0,0 +1,149 @@
+"""
+Параллельное выполнение независимых стадий чата и поэтапные замеры.
+
+Пока идёт HTTP-запрос за эмбеддингом, индекс тенанта загружается в пуле
+потоков по отдельному соединению; пока генерирует LLM, в пуле пишутся
+сообщение пользователя и строка quality_gate_logs.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from db import get_connection, execute_prepared
+from index_cache import load_tenant_index
+
+# false — стадии выполняются последовательно (для сравнения критического пути)
+CHAT_PIPELINE_CONCURRENT = os.environ.get('CHAT_PIPELINE_CONCURRENT', 'true').lower() == 'true'
+CHAT_PIPELINE_WORKERS = int(os.environ.get('CHAT_PIPELINE_WORKERS', '4'))
+
+# Пул живёт между тёплыми вызовами, как и пул соединений
+_executor = ThreadPoolExecutor(max_workers=CHAT_PIPELINE_WORKERS, thread_name_prefix='chat-stage')
+
+
+class StageTimer:
+    """Длительности стадий вызова в мс; стадии могут идти в разных потоках"""
+
+    def __init__(self, started: float = None):
+        self.started = started if started is not None else time.monotonic()
+        self.stages: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        stage_started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, (time.monotonic() - stage_started) * 1000)
+
+    def record(self, name: str, ms: float):
+        with self.lock:
+            self.stages[name] = round(self.stages.get(name, 0.0) + ms, 1)
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return timed
+
+    def summary(self) -> Dict:
+        """stages_sum_ms — сколько шло бы последовательно, wall_ms — фактический критический путь"""
+        with self.lock:
+            stages = dict(self.stages)
+        return {
+            'stages': stages,
+            'stages_sum_ms': round(sum(stages.values()), 1),
+            'wall_ms': round((time.monotonic() - self.started) * 1000, 1),
+            'concurrent': CHAT_PIPELINE_CONCURRENT
+        }
+
+
+def submit(fn: Callable, *args) -> Future:
+    """Запустить стадию в пуле; при CHAT_PIPELINE_CONCURRENT=false — сразу в текущем потоке"""
+    if CHAT_PIPELINE_CONCURRENT:
+        return _executor.submit(fn, *args)
+
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def prefetch_tenant_index(tenant_id: int):
+    """load_tenant_index по своему соединению из пула, чтобы не делить курсор с основным потоком"""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        return load_tenant_index(cur, tenant_id)
+    finally:
+        cur.close()
+        conn.close()
+
+
+def write_user_turn(conn, tenant_id: int, session_id: str, user_message: str, gate_row: tuple,
+                    timer: StageTimer) -> int:
+    """
+    Сообщение пользователя и лог quality gate одной транзакцией.
+    Основной поток в это время не трогает conn — он ждёт LLM.
+
+    Returns:
+        id строки quality_gate_logs
+    """
+    cur = conn.cursor()
+    with timer.stage('db_user_message'):
+        execute_prepared(cur, 'insert_chat_message', (session_id, 'user', user_message))
+    with timer.stage('db_gate_log'):
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
+            (tenant_id, user_message, context_ok, gate_reason, query_type, lang,
+             best_similarity, context_len, overlap, key_tokens, top_k_used,
+             answer_cache_hit, answer_cache_similarity, streamed)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (tenant_id, *gate_row))
+        gate_log_id = cur.fetchone()[0]
+        conn.commit()
+    cur.close()
+    return gate_log_id
+
+
+def write_chat_timings(conn, request_id: str, tenant_id: int, session_id: str, timings: Dict, extra: Dict):
+    """
+    Поэтапные замеры вызова в chat_timings (ключ — request_id).
+    Ответ пользователю уже сохранён, поэтому ошибка записи замеров только логируется.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_timings
+            (request_id, tenant_id, session_id, stages, stages_sum_ms, wall_ms, concurrent,
+             chunk_count, prompt_chars, completion_tokens, ttft_ms, streamed, answer_cache_hit)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (request_id) DO NOTHING
+        """, (
+            request_id,
+            tenant_id,
+            session_id,
+            json.dumps(timings['stages']),
+            timings['stages_sum_ms'],
+            timings['wall_ms'],
+            timings['concurrent'],
+            extra.get('chunk_count'),
+            extra.get('prompt_chars'),
+            extra.get('completion_tokens'),
+            extra.get('ttft_ms'),
+            extra.get('streamed', False),
+            extra.get('answer_cache_hit', False)
+        ))
+        conn.commit()
+    except Exception as e:
+        print(f"chat_timings write failed: {e}")
+        conn.rollback()
+    finally:
+        cur.close()
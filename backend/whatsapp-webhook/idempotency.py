@@ -0,0 +1,136 @@
+"""
+Идемпотентность chat по ключу канала (update_id Telegram, id сообщения WhatsApp,
+event_id VK, id сообщения MAX).
+
+Мессенджер повторяет доставку, если webhook не ответил вовремя; без ключа
+повтор заново считает эмбеддинг и ответ LLM и отвечает гостю дважды.
+Первый вызов с ключом занимает строку chat_idempotency (in_flight), по
+завершении сохраняет ответ (done). Повтор получает сохранённый ответ или,
+пока первый вызов ещё идёт, отметку in_flight — отвечать гостю будет
+первый вызов. Брошенная in_flight-строка (вызов упал или вышел по таймауту)
+через CHAT_IDEMPOTENCY_INFLIGHT_SECONDS снова доступна для захвата.
+"""
+import json
+import os
+import random
+import threading
+from typing import Dict, Optional, Tuple
+
+from db import get_connection
+
+CHAT_IDEMPOTENCY_TTL = int(os.environ.get('CHAT_IDEMPOTENCY_TTL', str(24 * 3600)))
+# Дольше таймаута вызова chat из webhook-ов (30 с), иначе повтор начнёт второй расчёт
+CHAT_IDEMPOTENCY_INFLIGHT_SECONDS = int(os.environ.get('CHAT_IDEMPOTENCY_INFLIGHT_SECONDS', '90'))
+CHAT_IDEMPOTENCY_EVICT_PROB = float(os.environ.get('CHAT_IDEMPOTENCY_EVICT_PROB', '0.02'))
+
+_lock = threading.Lock()
+_stats = {'claimed': 0, 'duplicate_done': 0, 'duplicate_in_flight': 0, 'errors': 0}
+
+
+def _count(outcome: str) -> Dict:
+    with _lock:
+        _stats[outcome] += 1
+        return dict(_stats)
+
+
+def claim_request(tenant_id: int, idempotency_key: str, session_id: str) -> Tuple[str, Optional[dict], Dict]:
+    """
+    Занять ключ перед обработкой.
+
+    Returns:
+        (state, stored_response, stats): state — claimed (обрабатываем сами),
+        done (stored_response — сохранённый ответ), in_flight (обрабатывает
+        другой вызов) или unavailable (таблица недоступна — обрабатываем без
+        идемпотентности)
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        # Просроченная или брошенная строка перезахватывается тем же INSERT атомарно
+        cur.execute("""
+            INSERT INTO t_p56134400_telegram_ai_bot_pdf.chat_idempotency
+            (tenant_id, idempotency_key, session_id, status, expires_at)
+            VALUES (%s, %s, %s, 'in_flight', NOW() + make_interval(secs => %s))
+            ON CONFLICT (tenant_id, idempotency_key) DO UPDATE
+            SET status = 'in_flight',
+                session_id = EXCLUDED.session_id,
+                response = NULL,
+                started_at = NOW(),
+                completed_at = NULL,
+                expires_at = EXCLUDED.expires_at
+            WHERE chat_idempotency.expires_at <= NOW()
+               OR (chat_idempotency.status = 'in_flight'
+                   AND chat_idempotency.started_at <= NOW() - make_interval(secs => %s))
+            RETURNING status
+        """, (tenant_id, idempotency_key, session_id, CHAT_IDEMPOTENCY_TTL, CHAT_IDEMPOTENCY_INFLIGHT_SECONDS))
+
+        if cur.fetchone():
+            conn.commit()
+            return 'claimed', None, _count('claimed')
+
+        cur.execute("""
+            SELECT status, response
+            FROM t_p56134400_telegram_ai_bot_pdf.chat_idempotency
+            WHERE tenant_id = %s AND idempotency_key = %s
+        """, (tenant_id, idempotency_key))
+        row = cur.fetchone()
+        conn.commit()
+        if row and row[0] == 'done':
+            return 'done', row[1], _count('duplicate_done')
+        return 'in_flight', None, _count('duplicate_in_flight')
+
+    except Exception as e:
+        print(f"Chat idempotency claim error: {e}")
+        return 'unavailable', None, _count('errors')
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def finish_request(tenant_id: int, idempotency_key: str, response: dict):
+    """Сохранить успешный ответ; при ошибке освободить ключ, чтобы повтор посчитал заново"""
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        if response.get('statusCode') == 200:
+            cur.execute("""
+                UPDATE t_p56134400_telegram_ai_bot_pdf.chat_idempotency
+                SET status = 'done', response = %s, completed_at = NOW()
+                WHERE tenant_id = %s AND idempotency_key = %s
+            """, (response.get('body'), tenant_id, idempotency_key))
+        else:
+            cur.execute("""
+                DELETE FROM t_p56134400_telegram_ai_bot_pdf.chat_idempotency
+                WHERE tenant_id = %s AND idempotency_key = %s AND status = 'in_flight'
+            """, (tenant_id, idempotency_key))
+
+        if random.random() < CHAT_IDEMPOTENCY_EVICT_PROB:
+            cur.execute("""
+                DELETE FROM t_p56134400_telegram_ai_bot_pdf.chat_idempotency
+                WHERE expires_at <= NOW()
+            """)
+        conn.commit()
+    except Exception as e:
+        print(f"Chat idempotency store error: {e}")
+        _count('errors')
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def duplicate_response(state: str, stored: Optional[dict], session_id: str, stats: Dict) -> dict:
+    """Ответ на повторную доставку: сохранённый ответ или отметка, что ответ ещё готовится"""
+    if state == 'done' and stored:
+        payload = dict(stored)
+    else:
+        payload = {'message': None, 'sessionId': session_id, 'inFlight': True}
+    payload['duplicate'] = True
+    payload['idempotency'] = stats
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(payload),
+        'isBase64Encoded': False
+    }
@@ -1,11 +1,15 @@
 import json
 import os
 import sys
-import requests
-import psycopg2
 
 sys.path.append('/function/code')
-from api_keys_helper import get_tenant_api_key
+from api_keys_helper import invalidate_tenant_api_keys
+from invalidation_bus import drain_invalidations, register_handler, KIND_API_KEYS
+from messenger_reply import dispatch_messages
+from tenant_routing import resolve_tenant, channel_session_id
+
+# Ключи, сохранённые через manage-api-keys, сбрасываются во всех тёплых экземплярах
+register_handler(KIND_API_KEYS, lambda tenant_id, version: invalidate_tenant_api_keys(tenant_id))
 
 def handler(event: dict, context) -> dict:
     """Webhook для WhatsApp Business API: принимает сообщения и отвечает через AI-консьержа"""
@@ -56,120 +60,52 @@ def handler(event: dict, context) -> dict:
         }
 
     try:
+        drain_invalidations()
         body = json.loads(event.get('body', '{}'))
         
-        # Проверяем структуру webhook от WhatsApp
-        if 'entry' not in body or not body['entry']:
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'ok': True}),
-                'isBase64Encoded': False
-            }
-
-        entry = body['entry'][0]
-        if 'changes' not in entry or not entry['changes']:
+        # Meta группирует несколько сообщений, а иногда и номеров, в один запрос
+        messages = []
+        unrouted = 0
+        for entry in body.get('entry') or []:
+            for change in entry.get('changes') or []:
+                value = change.get('value') or {}
+                # Обрабатываем только текстовые сообщения
+                texts = [m for m in value.get('messages') or [] if m.get('type') == 'text']
+                if not texts:
+                    continue
+
+                # Тенант по phone_number_id именно этого change: номера в пачке могут быть разных тенантов
+                # Номер без тенанта не должен лишать ответа остальные сообщения пачки
+                tenant_id, error = resolve_tenant('whatsapp', event, {'entry': [{'changes': [change]}]})
+                if error:
+                    phone_number_id = (value.get('metadata') or {}).get('phone_number_id')
+                    print(f"WhatsApp change for phone_number_id {phone_number_id} skipped: "
+                          f"{error['statusCode']} {json.loads(error['body']).get('error')}")
+                    unrouted += len(texts)
+                    continue
+
+                for message in texts:
+                    user_phone = message['from']
+                    messages.append({
+                        'tenant_id': tenant_id,
+                        'channel': 'whatsapp',
+                        'session_id': channel_session_id('whatsapp', tenant_id, user_phone),
+                        'reply_to': user_phone,
+                        'user_message': message['text']['body'],
+                        # Meta повторяет доставку с тем же id сообщения (wamid)
+                        'idempotency_key': f"whatsapp:{message['id']}" if message.get('id') else None
+                    })
+
+        if not messages:
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'ok': True}),
+                'body': json.dumps({'ok': True, 'unrouted': unrouted} if unrouted else {'ok': True}),
                 'isBase64Encoded': False
             }
 
-        change = entry['changes'][0]
-        if 'value' not in change:
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'ok': True}),
-                'isBase64Encoded': False
-            }
-
-        value = change['value']
-        
-        # Обрабатываем только текстовые сообщения
-        if 'messages' not in value or not value['messages']:
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'ok': True}),
-                'isBase64Encoded': False
-            }
-
-        message = value['messages'][0]
-        
-        # Игнорируем не текстовые сообщения
-        if message.get('type') != 'text':
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'ok': True}),
-                'isBase64Encoded': False
-            }
-
-        user_phone = message['from']
-        user_message = message['text']['body']
-        
-        session_id = f"whatsapp-{user_phone}"
-        tenant_id = 1
-
-        # Вызываем chat функцию
-        chat_function_url = 'https://functions.poehali.dev/7b58f4fb-5db0-4f85-bb3b-55bafa4cbf73'
-
-        chat_response = requests.post(
-            chat_function_url,
-            json={
-                'message': user_message,
-                'sessionId': session_id,
-                'tenantId': tenant_id
-            },
-            headers={'Content-Type': 'application/json'},
-            timeout=30
-        )
-
-        if not chat_response.ok:
-            raise Exception(f'Chat function error: {chat_response.status_code}')
-
-        chat_data = chat_response.json()
-        ai_message = chat_data.get('message', 'Извините, не могу ответить')
-
-        # Получаем данные для WhatsApp API из tenant_api_keys
-        phone_number_id, error = get_tenant_api_key(tenant_id, 'whatsapp', 'phone_number_id')
-        if error:
-            return error
-        access_token, error = get_tenant_api_key(tenant_id, 'whatsapp', 'access_token')
-        if error:
-            return error
-
-        # Отправляем ответ через WhatsApp API
-        whatsapp_api_url = f'https://graph.facebook.com/v18.0/{phone_number_id}/messages'
-        
-        whatsapp_response = requests.post(
-            whatsapp_api_url,
-            json={
-                'messaging_product': 'whatsapp',
-                'to': user_phone,
-                'type': 'text',
-                'text': {
-                    'body': ai_message
-                }
-            },
-            headers={
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            },
-            timeout=10
-        )
-
-        if not whatsapp_response.ok:
-            raise Exception(f'WhatsApp API error: {whatsapp_response.status_code} - {whatsapp_response.text}')
-
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'ok': True}),
-            'isBase64Encoded': False
-        }
+        # Ответы готовит inbound-worker; без очереди (или если запись не удалась) — синхронно
+        return dispatch_messages(messages, unrouted)
 
     except Exception as e:
         print(f'Webhook error: {e}')
@@ -0,0 +1,133 @@
+"""Кэш подготовленных индексов эмбеддингов тенантов между тёплыми вызовами функции"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from bm25 import BM25Index
+from db import execute_prepared
+from retrieval import EmbeddingIndex
+
+INDEX_CACHE_MAX_BYTES = int(os.environ.get('INDEX_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# tenant_id -> (corpus_version, index, size_bytes); порядок — от самого давнего использования
+_entries: 'OrderedDict[int, Tuple[str, EmbeddingIndex, int]]' = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+
+def get_corpus_version(cur, tenant_id: int) -> str:
+    """
+    Дешёвая версия корпуса тенанта: число чанков и максимальный id.
+    Переиндексация удаляет и вставляет строки заново, поэтому max(id) меняется.
+    """
+    execute_prepared(cur, 'tenant_corpus_version', (tenant_id,))
+    count, max_id = cur.fetchone()
+    return f"{count}:{max_id}"
+
+
+def index_size_bytes(index: EmbeddingIndex) -> int:
+    """Оценка памяти, занимаемой индексом (матрица, нормы и тексты чанков)"""
+    texts = sum(sys.getsizeof(t) for t in index.chunk_texts)
+    bm25 = index.bm25.nbytes if index.bm25 is not None else 0
+    return index.matrix.nbytes + index.norms.nbytes + texts + bm25
+
+
+def fetch_tenant_index(cur, tenant_id: int) -> EmbeddingIndex:
+    """Загрузить все чанки тенанта из БД и построить индекс"""
+    execute_prepared(cur, 'tenant_chunks', (tenant_id,))
+    rows = cur.fetchall()
+    index = EmbeddingIndex.from_rows([row[2:] for row in rows])
+    index.bm25 = fetch_tenant_bm25(cur, tenant_id, rows)
+    return index
+
+
+def fetch_tenant_bm25(cur, tenant_id: int, rows) -> Optional[BM25Index]:
+    """
+    Постинги BM25 тенанта (tenant_chunk_terms) в разметке строк индекса.
+    None, если постингов нет (документы не переиндексированы) или таблицы ещё нет.
+    """
+    cur.execute("SAVEPOINT bm25_postings")
+    try:
+        execute_prepared(cur, 'tenant_chunk_terms', (tenant_id,))
+        postings = cur.fetchall()
+        cur.execute("RELEASE SAVEPOINT bm25_postings")
+    except Exception as e:
+        print(f"BM25 postings read error: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT bm25_postings")
+        return None
+
+    if not postings:
+        return None
+
+    chunk_rows = {row[0]: i for i, row in enumerate(rows)}
+    doc_lens = np.asarray([row[1] for row in rows], dtype=np.float32)
+    return BM25Index.from_rows(postings, chunk_rows, doc_lens)
+
+
+def get_cached_index(tenant_id: int, version: str) -> Optional[EmbeddingIndex]:
+    with _lock:
+        entry = _entries.get(tenant_id)
+        if entry is None or entry[0] != version:
+            return None
+        _entries.move_to_end(tenant_id)
+        return entry[1]
+
+
+def put_index(tenant_id: int, version: str, index: EmbeddingIndex):
+    """Положить индекс в кэш, вытесняя давно неиспользуемых тенантов сверх бюджета"""
+    size = index_size_bytes(index)
+    with _lock:
+        old = _entries.pop(tenant_id, None)
+        if old is not None:
+            _stats['bytes'] -= old[2]
+
+        if size > INDEX_CACHE_MAX_BYTES:
+            return
+
+        while _entries and _stats['bytes'] + size > INDEX_CACHE_MAX_BYTES:
+            _, (_, _, evicted_size) = _entries.popitem(last=False)
+            _stats['bytes'] -= evicted_size
+            _stats['evictions'] += 1
+
+        _entries[tenant_id] = (version, index, size)
+        _stats['bytes'] += size
+
+
+def invalidate_tenant(tenant_id: Optional[int]):
+    """Сбросить индекс тенанта; None — сбросить все"""
+    with _lock:
+        tenant_ids = list(_entries) if tenant_id is None else [tenant_id]
+        for key in tenant_ids:
+            entry = _entries.pop(key, None)
+            if entry is not None:
+                _stats['bytes'] -= entry[2]
+
+
+def cache_stats() -> Dict:
+    with _lock:
+        return {**_stats, 'entries': len(_entries), 'max_bytes': INDEX_CACHE_MAX_BYTES}
+
+
+def load_tenant_index(cur, tenant_id: int) -> Tuple[EmbeddingIndex, Dict]:
+    """
+    Индекс тенанта из кэша, если версия корпуса не изменилась, иначе из БД.
+
+    Returns:
+        (index, cache_info) - индекс и данные для rag_debug_log
+    """
+    version = get_corpus_version(cur, tenant_id)
+    index = get_cached_index(tenant_id, version)
+    hit = index is not None
+
+    with _lock:
+        _stats['hits' if hit else 'misses'] += 1
+
+    if not hit:
+        index = fetch_tenant_index(cur, tenant_id)
+        put_index(tenant_id, version, index)
+
+    return index, {'hit': hit, 'version': version, **cache_stats()}
@@ -1,12 +1,13 @@
 import json
 import os
-import psycopg2
 import hashlib
 import secrets
 import string
 import requests
 from datetime import datetime, timedelta
 
+from db import get_connection
+
 SEND_EMAIL_URL = 'https://functions.poehali.dev/38938588-b119-4fcc-99d9-952e16dd8d6a'
 
 def handler(event: dict, context) -> dict:
@@ -52,7 +53,7 @@ def handler(event: dict, context) -> dict:
                 'isBase64Encoded': False
             }
 
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = get_connection()
         cur = conn.cursor()
         schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
 
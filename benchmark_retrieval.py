@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарки retrieval и quality gate из backend/chat — полностью офлайн.
+
+Строит синтетических тенантов (русский текст в духе документов отеля,
+случайные нормализованные эмбеддинги, постинги BM25) и замеряет каждую
+стадию отдельно и весь путь целиком: ops/sec, время на операцию и пиковый
+объём памяти, выделенной за одну операцию (tracemalloc).
+
+    python benchmark_retrieval.py
+    python benchmark_retrieval.py --sizes 100,1000 --dims 256 --output before.json
+    python benchmark_retrieval.py --sizes 100,1000 --dims 256 --compare before.json
+
+Нужен только numpy; БД и ключи провайдеров не используются.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'chat'))
+from bm25 import BM25Index
+from quality_gate import (
+    build_context_with_scores,
+    detect_lang_simple,
+    index_terms,
+    keyword_overlap_ratio,
+    quality_gate,
+    sanitize_chunk,
+    tokenize,
+    RAG_TOPK_DEFAULT,
+    RAG_HYBRID_CANDIDATES
+)
+from retrieval import EmbeddingIndex
+
+ROOM_TYPES = ['Стандарт', 'Стандарт одноместный', 'Комфорт', 'Люкс', 'Семейный номер', 'Апартаменты']
+MEALS = ['без питания', 'завтрак', 'полный пансион', 'полупансион']
+SERVICES = ['бассейн', 'сауна', 'спа-центр', 'трансфер из аэропорта', 'парковка', 'детская комната',
+            'прокат велосипедов', 'экскурсии', 'ресторан', 'конференц-зал', 'прачечная', 'Wi-Fi']
+SENTENCES = [
+    "Стоимость проживания в номере категории «{room}» с питанием «{meal}» составляет {price} рублей за сутки.",
+    "С {day1} июня по {day2} августа действует летний тариф: {room} — {price} руб. за ночь, {meal}.",
+    "Заезд с 14:00, выезд до 12:00. Ранний заезд оплачивается дополнительно — {small} рублей.",
+    "Для гостей отеля работает {service}; часы работы с {hour1}:00 до {hour2}:00.",
+    "Дети до {age} лет размещаются бесплатно без предоставления дополнительного места.",
+    "Дополнительное место для взрослого стоит {small} рублей в сутки, для ребёнка — {small2} рублей.",
+    "При отмене бронирования менее чем за {days} суток удерживается стоимость первых суток проживания.",
+    "В номере запрещено курить; штраф за нарушение составляет {price} рублей.",
+    "Услуга «{service}» предоставляется по предварительной записи на стойке регистрации.",
+    "Отель расположен в {minutes} минутах ходьбы от моря, на территории есть {service}.",
+    "Размещение с домашними животными возможно по согласованию, доплата {small} рублей за сутки.",
+    "Документы, удостоверяющие личность, предъявляются при заселении; см. стр. {page}.",
+]
+NOISE = ["page_number: {page}", "file_name: prices_{page}.pdf", "id: {page}{age}", "страница {page}"]
+QUERIES = [
+    "Сколько стоит номер Комфорт с завтраком на 3 ночи в июле?",
+    "Во сколько заезд и выезд?",
+    "Есть ли у вас бассейн и сауна?",
+    "Можно ли приехать с собакой?",
+    "Какие условия отмены бронирования?",
+    "Дети до скольки лет живут бесплатно?",
+    "Есть ли трансфер из аэропорта и сколько стоит?",
+    "Можно ли курить в номере?",
+    "What time is check-in?",
+    "Сколько минут идти до моря?",
+]
+
+
+def make_chunk(rng: random.Random, target_chars: int = 1200) -> str:
+    parts = []
+    while sum(len(p) for p in parts) < target_chars:
+        values = {
+            'room': rng.choice(ROOM_TYPES), 'meal': rng.choice(MEALS), 'service': rng.choice(SERVICES),
+            'price': rng.randrange(3000, 25000, 100), 'small': rng.randrange(500, 3000, 100),
+            'small2': rng.randrange(300, 1500, 100), 'day1': rng.randint(1, 15), 'day2': rng.randint(16, 31),
+            'hour1': rng.randint(7, 11), 'hour2': rng.randint(18, 23), 'age': rng.randint(3, 12),
+            'days': rng.randint(1, 14), 'minutes': rng.randint(2, 20), 'page': rng.randint(1, 40),
+        }
+        template = rng.choice(NOISE) if rng.random() < 0.08 else rng.choice(SENTENCES)
+        parts.append(template.format(**values))
+    return " ".join(parts)
+
+
+def random_unit_vectors(rng: np.random.Generator, count: int, dim: int) -> np.ndarray:
+    matrix = rng.standard_normal((count, dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def build_bm25(chunk_texts):
+    """Постинги в том же виде, что process-pdf пишет в tenant_chunk_terms"""
+    rows = []
+    doc_lens = np.zeros(len(chunk_texts), dtype=np.float32)
+    for row, text in enumerate(chunk_texts):
+        terms = Counter(index_terms(text))
+        doc_lens[row] = sum(terms.values())
+        rows.extend((row, term, tf) for term, tf in terms.items())
+    return BM25Index.from_rows(rows, {i: i for i in range(len(chunk_texts))}, doc_lens)
+
+
+def make_tenant(n_chunks: int, dim: int, seed: int = 42):
+    rng = random.Random(seed)
+    # Уникальных текстов немного: для скоринга важен объём, а генерация 50k текстов заметно дольше самих замеров
+    unique = [make_chunk(rng) for _ in range(min(n_chunks, 2000))]
+    chunk_texts = [unique[i % len(unique)] for i in range(n_chunks)]
+    matrix = random_unit_vectors(np.random.default_rng(seed), n_chunks, dim)
+    return chunk_texts, matrix
+
+
+def measure(fn, min_time: float, max_iterations: int = 100000):
+    """Гоняет fn не меньше min_time секунд; время каждой итерации — для перцентилей"""
+    fn()
+    durations = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < min_time and len(durations) < max_iterations:
+        op_started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - op_started)
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    durations.sort()
+    total = sum(durations)
+    return {
+        'iterations': len(durations),
+        'ops_per_sec': round(len(durations) / total, 1) if total else None,
+        'mean_us': round(total / len(durations) * 1e6, 2),
+        'p50_us': round(durations[len(durations) // 2] * 1e6, 2),
+        'p95_us': round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1e6, 2),
+        'peak_alloc_kib': round((peak - baseline) / 1024, 1),
+    }
+
+
+def bench_size(n_chunks: int, dim: int, min_time: float):
+    chunk_texts, matrix = make_tenant(n_chunks, dim)
+
+    build_started = time.perf_counter()
+    index = EmbeddingIndex(chunk_texts, matrix, np.ones(n_chunks, dtype=bool))
+    index.bm25 = build_bm25(chunk_texts)
+    build_seconds = time.perf_counter() - build_started
+
+    queries = [(q, detect_lang_simple(q)) for q in QUERIES]
+    query_terms = [tokenize(q, lang) for q, lang in queries]
+    candidates = max(RAG_HYBRID_CANDIDATES, RAG_TOPK_DEFAULT)
+
+    # Вектор запроса кладём рядом с лучшим по BM25 чанком: со случайным вектором
+    # gate отсекает всё по low_similarity и до проверки overlap не доходит
+    noise = random_unit_vectors(np.random.default_rng(7), len(QUERIES), dim)
+    query_vectors = np.empty_like(noise)
+    for i, terms in enumerate(query_terms):
+        anchor = matrix[int(np.argmax(index.bm25.scores(terms)))]
+        vector = 0.8 * anchor + 0.2 * noise[i]
+        query_vectors[i] = vector / np.linalg.norm(vector)
+
+    # Состояние для стадий, которые в проде получают вход от предыдущей стадии
+    state = {'i': 0}
+    scored = [index.hybrid_search(v, t, top_k=RAG_TOPK_DEFAULT, candidates=candidates)
+              for v, t in zip(query_vectors, query_terms)]
+    contexts = [build_context_with_scores(s, top_k=RAG_TOPK_DEFAULT, presorted=True) for s in scored]
+
+    def next_i():
+        state['i'] = (state['i'] + 1) % len(QUERIES)
+        return state['i']
+
+    def end_to_end():
+        i = next_i()
+        query, lang = queries[i]
+        terms = tokenize(query, lang)
+        chunks = index.hybrid_search(query_vectors[i], terms, top_k=RAG_TOPK_DEFAULT, candidates=candidates)
+        context, sims = build_context_with_scores(chunks, top_k=RAG_TOPK_DEFAULT, presorted=True)
+        return quality_gate(query, context, sims)
+
+    stages = {
+        'tokenize_query': lambda: tokenize(*queries[next_i()]),
+        'index_terms_chunk': lambda: index_terms(chunk_texts[next_i()]),
+        'sanitize_chunk': lambda: sanitize_chunk(chunk_texts[next_i()]),
+        'cosine_scores': lambda: index.scores(query_vectors[next_i()]),
+        'vector_search': lambda: index.search(query_vectors[next_i()], top_k=RAG_TOPK_DEFAULT),
+        'bm25_scores': lambda: index.bm25.scores(query_terms[next_i()]),
+        'hybrid_search': lambda: (lambda i: index.hybrid_search(
+            query_vectors[i], query_terms[i], top_k=RAG_TOPK_DEFAULT, candidates=candidates))(next_i()),
+        'build_context': lambda: build_context_with_scores(scored[next_i()], top_k=RAG_TOPK_DEFAULT, presorted=True),
+        'keyword_overlap': lambda: (lambda i: keyword_overlap_ratio(
+            queries[i][0], contexts[i][0], queries[i][1]))(next_i()),
+        'quality_gate': lambda: (lambda i: quality_gate(queries[i][0], *contexts[i]))(next_i()),
+        'end_to_end': end_to_end,
+    }
+
+    results = {'index_build_seconds': round(build_seconds, 3), 'stages': {}}
+    for name, fn in stages.items():
+        results['stages'][name] = measure(fn, min_time)
+        print(f"  {name:<18} {results['stages'][name]['ops_per_sec']:>12} ops/s  "
+              f"p95 {results['stages'][name]['p95_us']:>10} us  "
+              f"alloc {results['stages'][name]['peak_alloc_kib']:>9} KiB")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(previous: dict, current: dict):
+    """Изменение ops/sec по стадиям относительно сохранённого прогона"""
+    old_runs = {(r['chunks'], r['dim']): r for r in previous['runs']}
+    for run in current['runs']:
+        old = old_runs.get((run['chunks'], run['dim']))
+        if old is None:
+            continue
+        print(f"\n📊 {run['chunks']} чанков × {run['dim']}: изменение ops/sec к {previous['meta'].get('git') or 'прошлому прогону'}")
+        for name, stats in run['stages'].items():
+            old_stats = old['stages'].get(name)
+            if not old_stats or not old_stats['ops_per_sec']:
+                continue
+            delta = (stats['ops_per_sec'] / old_stats['ops_per_sec'] - 1) * 100
+            print(f"  {name:<18} {delta:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки retrieval и quality gate')
+    parser.add_argument('--sizes', default='100,1000,10000,50000', help='Размеры корпуса тенанта в чанках')
+    parser.add_argument('--dims', default='256,1536', help='Размерности эмбеддингов')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Секунд на замер одной стадии')
+    parser.add_argument('--output', help='Сохранить результаты в JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'min_time': args.min_time,
+        },
+        'runs': []
+    }
+
+    for dim in [int(d) for d in args.dims.split(',')]:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            print(f"🏨 {size} чанков × {dim}")
+            report['runs'].append({'chunks': size, 'dim': dim, **bench_size(size, dim, args.min_time)})
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+-- Бинарное хранение эмбеддингов: упакованный little-endian float32 (или float16) вместо JSON-текста
+-- embedding_text остаётся на период двойного чтения: chat читает embedding_bin, если он заполнен, иначе embedding_text
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+ADD COLUMN IF NOT EXISTS embedding_bin BYTEA,
+ADD COLUMN IF NOT EXISTS embedding_dtype VARCHAR(10);
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.document_chunks
+ADD COLUMN IF NOT EXISTS embedding_bin BYTEA,
+ADD COLUMN IF NOT EXISTS embedding_dtype VARCHAR(10);
+
+-- Backfill tenant_chunks: JSON массив -> float4send (big-endian) -> разворот байтов в little-endian
+UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_chunks c
+SET embedding_bin = packed.bin,
+    embedding_dtype = 'float32'
+FROM (
+    SELECT src.id,
+           string_agg(
+               substring(float4send(e.value::float4) FROM 4 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 3 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 2 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 1 FOR 1),
+               ''::bytea ORDER BY e.ord
+           ) AS bin
+    FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks src
+    CROSS JOIN LATERAL jsonb_array_elements_text(src.embedding_text::jsonb) WITH ORDINALITY AS e(value, ord)
+    WHERE src.embedding_text IS NOT NULL AND src.embedding_bin IS NULL
+    GROUP BY src.id
+) packed
+WHERE c.id = packed.id;
+
+-- Backfill document_chunks: JSON массив -> float4send (big-endian) -> разворот байтов в little-endian
+UPDATE t_p56134400_telegram_ai_bot_pdf.document_chunks c
+SET embedding_bin = packed.bin,
+    embedding_dtype = 'float32'
+FROM (
+    SELECT src.id,
+           string_agg(
+               substring(float4send(e.value::float4) FROM 4 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 3 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 2 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 1 FOR 1),
+               ''::bytea ORDER BY e.ord
+           ) AS bin
+    FROM t_p56134400_telegram_ai_bot_pdf.document_chunks src
+    CROSS JOIN LATERAL jsonb_array_elements_text(src.embedding_text::jsonb) WITH ORDINALITY AS e(value, ord)
+    WHERE src.embedding_text IS NOT NULL AND src.embedding_bin IS NULL
+    GROUP BY src.id
+) packed
+WHERE c.id = packed.id;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.embedding_bin IS 'Эмбеддинг чанка: упакованный little-endian массив (тип в embedding_dtype)';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.embedding_dtype IS 'Тип элементов embedding_bin: float32 или float16';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.document_chunks.embedding_bin IS 'Эмбеддинг чанка: упакованный little-endian массив (тип в embedding_dtype)';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.document_chunks.embedding_dtype IS 'Тип элементов embedding_bin: float32 или float16';
\ No newline at end of file
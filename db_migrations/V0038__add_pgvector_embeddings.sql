@@ -0,0 +1,39 @@
+-- Опциональный ANN-поиск внутри Postgres через pgvector
+-- Колонка без фиксированной размерности: у провайдеров разные размеры (OpenAI 1536, Yandex 256),
+-- поэтому HNSW-индексы строятся частичными, по выражению с приведением к нужной размерности
+-- Без расширения vector на сервере миграция ничего не делает: поиск и индексация работают в функциях,
+-- а embedding_vec пишется только тенантам с ai_settings.retrieval_backend = pgvector
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'vector') THEN
+        RAISE NOTICE 'pgvector недоступен, embedding_vec не создаётся';
+        RETURN;
+    END IF;
+
+    CREATE EXTENSION IF NOT EXISTS vector;
+
+    -- Тип vector появляется только после CREATE EXTENSION, поэтому дальше — динамический SQL
+    EXECUTE 'ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        ADD COLUMN IF NOT EXISTS embedding_vec vector,
+        ADD COLUMN IF NOT EXISTS embedding_dim INTEGER';
+
+    EXECUTE 'UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        SET embedding_vec = embedding_text::vector,
+            embedding_dim = jsonb_array_length(embedding_text::jsonb)
+        WHERE embedding_text IS NOT NULL AND embedding_vec IS NULL';
+
+    EXECUTE 'CREATE INDEX IF NOT EXISTS idx_tenant_chunks_embedding_vec_1536
+        ON t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        USING hnsw ((embedding_vec::vector(1536)) vector_cosine_ops)
+        WHERE embedding_dim = 1536';
+
+    EXECUTE 'CREATE INDEX IF NOT EXISTS idx_tenant_chunks_embedding_vec_256
+        ON t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+        USING hnsw ((embedding_vec::vector(256)) vector_cosine_ops)
+        WHERE embedding_dim = 256';
+
+    EXECUTE 'COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.embedding_vec IS
+        ''Эмбеддинг чанка для ANN-поиска pgvector (ai_settings.retrieval_backend = pgvector)''';
+    EXECUTE 'COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.embedding_dim IS
+        ''Размерность embedding_vec, выбирает частичный HNSW-индекс''';
+END $$;
@@ -0,0 +1,88 @@
+-- Эмбеддинги нормализуются по L2 при записи: близость в chat — чистое скалярное произведение
+-- Флаг embedding_normalized хранит факт нормализации для каждого чанка
+-- Backfill идёт по embedding_text: строки только с embedding_bin (записаны с EMBEDDING_WRITE_JSON=false)
+-- SQL не распаковать (float16), они остаются с embedding_normalized = false. chat считает для них
+-- нормы при построении индекса, поэтому близость верная; нормализуются они переобработкой документа
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+ADD COLUMN IF NOT EXISTS embedding_normalized BOOLEAN NOT NULL DEFAULT FALSE;
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.document_chunks
+ADD COLUMN IF NOT EXISTS embedding_normalized BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Backfill tenant_chunks, шаг 1: делим JSON-вектор на его L2-норму
+UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_chunks c
+SET embedding_text = n.normalized::text
+FROM (
+    SELECT src.id, jsonb_agg(e.value::float8 / norm.value ORDER BY e.ord) AS normalized
+    FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks src
+    CROSS JOIN LATERAL (
+        SELECT sqrt(sum(x.value::float8 * x.value::float8)) AS value
+        FROM jsonb_array_elements_text(src.embedding_text::jsonb) AS x(value)
+    ) norm
+    CROSS JOIN LATERAL jsonb_array_elements_text(src.embedding_text::jsonb) WITH ORDINALITY AS e(value, ord)
+    WHERE src.embedding_text IS NOT NULL AND NOT src.embedding_normalized AND norm.value > 0
+    GROUP BY src.id
+) n
+WHERE c.id = n.id;
+
+-- Backfill tenant_chunks, шаг 2: перепаковываем бинарное представление из нормализованного JSON и ставим флаг
+-- embedding_vec (если есть) не трогаем: косинусное расстояние pgvector от нормы не зависит
+UPDATE t_p56134400_telegram_ai_bot_pdf.tenant_chunks c
+SET embedding_bin = packed.bin,
+    embedding_dtype = 'float32',
+    embedding_normalized = TRUE
+FROM (
+    SELECT src.id,
+           string_agg(
+               substring(float4send(e.value::float4) FROM 4 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 3 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 2 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 1 FOR 1),
+               ''::bytea ORDER BY e.ord
+           ) AS bin
+    FROM t_p56134400_telegram_ai_bot_pdf.tenant_chunks src
+    CROSS JOIN LATERAL jsonb_array_elements_text(src.embedding_text::jsonb) WITH ORDINALITY AS e(value, ord)
+    WHERE src.embedding_text IS NOT NULL AND NOT src.embedding_normalized
+    GROUP BY src.id
+) packed
+WHERE c.id = packed.id;
+
+-- Backfill document_chunks, шаг 1: делим JSON-вектор на его L2-норму
+UPDATE t_p56134400_telegram_ai_bot_pdf.document_chunks c
+SET embedding_text = n.normalized::text
+FROM (
+    SELECT src.id, jsonb_agg(e.value::float8 / norm.value ORDER BY e.ord) AS normalized
+    FROM t_p56134400_telegram_ai_bot_pdf.document_chunks src
+    CROSS JOIN LATERAL (
+        SELECT sqrt(sum(x.value::float8 * x.value::float8)) AS value
+        FROM jsonb_array_elements_text(src.embedding_text::jsonb) AS x(value)
+    ) norm
+    CROSS JOIN LATERAL jsonb_array_elements_text(src.embedding_text::jsonb) WITH ORDINALITY AS e(value, ord)
+    WHERE src.embedding_text IS NOT NULL AND NOT src.embedding_normalized AND norm.value > 0
+    GROUP BY src.id
+) n
+WHERE c.id = n.id;
+
+-- Backfill document_chunks, шаг 2: перепаковываем бинарное представление из нормализованного JSON и ставим флаг
+UPDATE t_p56134400_telegram_ai_bot_pdf.document_chunks c
+SET embedding_bin = packed.bin,
+    embedding_dtype = 'float32',
+    embedding_normalized = TRUE
+FROM (
+    SELECT src.id,
+           string_agg(
+               substring(float4send(e.value::float4) FROM 4 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 3 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 2 FOR 1) ||
+               substring(float4send(e.value::float4) FROM 1 FOR 1),
+               ''::bytea ORDER BY e.ord
+           ) AS bin
+    FROM t_p56134400_telegram_ai_bot_pdf.document_chunks src
+    CROSS JOIN LATERAL jsonb_array_elements_text(src.embedding_text::jsonb) WITH ORDINALITY AS e(value, ord)
+    WHERE src.embedding_text IS NOT NULL AND NOT src.embedding_normalized
+    GROUP BY src.id
+) packed
+WHERE c.id = packed.id;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.embedding_normalized IS 'Эмбеддинг нормализован по L2 (норма = 1), близость считается без деления на нормы';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.document_chunks.embedding_normalized IS 'Эмбеддинг нормализован по L2 (норма = 1), близость считается без деления на нормы';
\ No newline at end of file
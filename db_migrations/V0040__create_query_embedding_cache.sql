@@ -0,0 +1,16 @@
+-- Персистентный кэш эмбеддингов запросов пользователей (второй уровень после in-process LRU в chat)
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.query_embedding_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    embedding_provider VARCHAR(50) NOT NULL,
+    embedding_model VARCHAR(100) NOT NULL,
+    query_text TEXT NOT NULL,
+    embedding_bin BYTEA NOT NULL,
+    hits INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_query_embedding_cache_last_used
+ON t_p56134400_telegram_ai_bot_pdf.query_embedding_cache(last_used_at);
+
+COMMENT ON TABLE t_p56134400_telegram_ai_bot_pdf.query_embedding_cache IS 'Кэш эмбеддингов запросов: ключ sha256(provider, model, нормализованный текст), вектор float32 little-endian';
@@ -0,0 +1,25 @@
+-- Семантический кэш ответов: готовый ответ ассистента переиспользуется для близкого по смыслу вопроса,
+-- пока не изменились корпус документов тенанта (corpus_version) и его ai_settings (settings_hash)
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.answer_cache (
+    id SERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    corpus_version VARCHAR(50) NOT NULL,
+    settings_hash VARCHAR(64) NOT NULL,
+    query_text TEXT NOT NULL,
+    query_embedding BYTEA NOT NULL,
+    answer TEXT NOT NULL,
+    gate_reason VARCHAR(100),
+    hits INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_answer_cache_lookup
+ON t_p56134400_telegram_ai_bot_pdf.answer_cache(tenant_id, corpus_version, settings_hash);
+
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
+ADD COLUMN IF NOT EXISTS answer_cache_hit BOOLEAN DEFAULT FALSE,
+ADD COLUMN IF NOT EXISTS answer_cache_similarity DECIMAL(5,4);
+
+COMMENT ON TABLE t_p56134400_telegram_ai_bot_pdf.answer_cache IS 'Кэш ответов chat (opt-in через ai_settings.answer_cache_enabled), query_embedding — нормализованный float32 little-endian';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.quality_gate_logs.answer_cache_hit IS 'Ответ взят из answer_cache без вызова LLM';
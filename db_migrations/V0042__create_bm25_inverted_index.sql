@@ -0,0 +1,18 @@
+-- Инвертированный индекс для гибридного поиска (BM25 + вектор): постинги считаются в process-pdf при индексации,
+-- chat загружает их вместе с эмбеддингами тенанта и кэширует в памяти
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunks
+ADD COLUMN IF NOT EXISTS token_count INTEGER;
+
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.tenant_chunk_terms (
+    tenant_id INTEGER NOT NULL,
+    chunk_id INTEGER NOT NULL REFERENCES t_p56134400_telegram_ai_bot_pdf.tenant_chunks(id) ON DELETE CASCADE,
+    term TEXT NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (chunk_id, term)
+);
+
+CREATE INDEX IF NOT EXISTS idx_tenant_chunk_terms_tenant
+ON t_p56134400_telegram_ai_bot_pdf.tenant_chunk_terms(tenant_id, term);
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.tenant_chunks.token_count IS 'Длина чанка в терминах BM25 (без стоп-слов), NULL — чанк проиндексирован до гибридного поиска';
+COMMENT ON TABLE t_p56134400_telegram_ai_bot_pdf.tenant_chunk_terms IS 'Постинги BM25: частота термина tf в чанке chunk_id';
@@ -0,0 +1,10 @@
+-- Время до первого токена и длительность генерации рядом с метриками quality gate:
+-- chat дописывает их в ту же строку лога после ответа LLM (ttft_ms — только в потоковом режиме)
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
+ADD COLUMN IF NOT EXISTS ttft_ms REAL,
+ADD COLUMN IF NOT EXISTS llm_ms REAL,
+ADD COLUMN IF NOT EXISTS streamed BOOLEAN DEFAULT false;
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.quality_gate_logs.ttft_ms IS 'Миллисекунды от получения запроса до первого токена ответа; NULL, если ответ LLM не стримился';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.quality_gate_logs.llm_ms IS 'Длительность генерации ответа LLM, мс';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.quality_gate_logs.streamed IS 'Ответ LLM получен потоком (замер времени до первого токена)';
@@ -0,0 +1,26 @@
+-- Поэтапные замеры обработки сообщения чатом: одна строка на вызов (ключ — request_id функции).
+-- stages — {стадия: мс}, по нему get-chat-stats считает p50/p95/p99 по тенанту за окно
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.chat_timings (
+    request_id TEXT PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    session_id TEXT,
+    stages JSONB NOT NULL,
+    stages_sum_ms REAL,
+    wall_ms REAL,
+    concurrent BOOLEAN DEFAULT true,
+    chunk_count INTEGER,
+    prompt_chars INTEGER,
+    completion_tokens INTEGER,
+    ttft_ms REAL,
+    streamed BOOLEAN DEFAULT false,
+    answer_cache_hit BOOLEAN DEFAULT false,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_timings_tenant_created
+ON t_p56134400_telegram_ai_bot_pdf.chat_timings(tenant_id, created_at DESC);
+
+COMMENT ON TABLE t_p56134400_telegram_ai_bot_pdf.chat_timings IS 'Длительности стадий chat по вызовам: settings, api_keys, embedding, chunk_fetch, scoring, gate, llm, db_*';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.chat_timings.stages_sum_ms IS 'Сумма стадий — время при последовательном выполнении';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.chat_timings.wall_ms IS 'Фактическое время вызова (критический путь)';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.chat_timings.ttft_ms IS 'Время до первого токена LLM; NULL, если ответ не стримился';
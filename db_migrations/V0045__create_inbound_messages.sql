@@ -0,0 +1,32 @@
+-- Очередь входящих сообщений мессенджеров: webhook сохраняет сообщение и сразу отвечает 200,
+-- inbound-worker забирает строки через FOR UPDATE SKIP LOCKED, вызывает chat и отправляет ответ.
+-- status: pending -> processing -> done; после INBOUND_MAX_ATTEMPTS неудач — dead
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.inbound_messages (
+    id BIGSERIAL PRIMARY KEY,
+    tenant_id INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    reply_to JSONB NOT NULL,
+    user_message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_at TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Выборка воркера: готовые к обработке строки по порядку поступления
+CREATE INDEX IF NOT EXISTS idx_inbound_messages_pending
+ON t_p56134400_telegram_ai_bot_pdf.inbound_messages(next_attempt_at, id)
+WHERE status = 'pending';
+
+-- Занятость тенантов и сессий при выборке, повторный захват зависших строк
+CREATE INDEX IF NOT EXISTS idx_inbound_messages_processing
+ON t_p56134400_telegram_ai_bot_pdf.inbound_messages(locked_at)
+WHERE status = 'processing';
+
+COMMENT ON TABLE t_p56134400_telegram_ai_bot_pdf.inbound_messages IS 'Очередь входящих сообщений telegram/vk/whatsapp/max для inbound-worker';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.inbound_messages.reply_to IS 'Адресат ответа в канале: chat_id, user_id VK или телефон WhatsApp';
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.inbound_messages.status IS 'pending, processing, done, dead';
@@ -0,0 +1,27 @@
+-- Идемпотентность chat по id сообщения канала: повторная доставка не пересчитывает ответ.
+-- status: in_flight (первый вызов ещё считает) -> done (response — сохранённый ответ).
+-- Строки живут CHAT_IDEMPOTENCY_TTL, просроченные удаляет сам chat
+CREATE TABLE IF NOT EXISTS t_p56134400_telegram_ai_bot_pdf.chat_idempotency (
+    tenant_id INTEGER NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    session_id TEXT,
+    status TEXT NOT NULL DEFAULT 'in_flight',
+    response JSONB,
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    completed_at TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (tenant_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_idempotency_expires
+ON t_p56134400_telegram_ai_bot_pdf.chat_idempotency(expires_at);
+
+COMMENT ON TABLE t_p56134400_telegram_ai_bot_pdf.chat_idempotency IS 'Ключи идемпотентности chat: telegram:<update_id>, whatsapp:<message id>, vk:<event_id>, max:<message id>';
+
+-- Повторная доставка не ставит сообщение в очередь второй раз
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.inbound_messages
+ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_inbound_messages_idempotency
+ON t_p56134400_telegram_ai_bot_pdf.inbound_messages(tenant_id, idempotency_key)
+WHERE idempotency_key IS NOT NULL;
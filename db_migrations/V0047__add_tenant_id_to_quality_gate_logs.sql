@@ -0,0 +1,9 @@
+-- Тенант строки лога quality gate: статистика и реплей читают только запросы своего тенанта.
+-- Строки до миграции тенанта не знают (NULL) и в выборки по тенанту не попадают
+ALTER TABLE t_p56134400_telegram_ai_bot_pdf.quality_gate_logs
+ADD COLUMN IF NOT EXISTS tenant_id INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_quality_gate_logs_tenant_created
+ON t_p56134400_telegram_ai_bot_pdf.quality_gate_logs(tenant_id, created_at DESC);
+
+COMMENT ON COLUMN t_p56134400_telegram_ai_bot_pdf.quality_gate_logs.tenant_id IS 'Тенант запроса (tenantId в chat); NULL — строка записана до V0047';
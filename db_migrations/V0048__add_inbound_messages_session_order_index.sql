@@ -0,0 +1,5 @@
+-- Порядок сообщений в сессии: воркер берёт строку, только если в её сессии нет более ранней
+-- незавершённой (pending, в том числе отложенной до next_attempt_at, или processing)
+CREATE INDEX IF NOT EXISTS idx_inbound_messages_session_open
+ON t_p56134400_telegram_ai_bot_pdf.inbound_messages(tenant_id, session_id, id)
+WHERE status IN ('pending', 'processing');
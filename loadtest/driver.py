@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный драйвер для router.py: кейсы tests.json и синтетический поток гостей.
+
+    # 1. заглушки и роутер (DATABASE_URL — локальный Postgres с db_migrations)
+    python loadtest/stubs.py &
+    DATABASE_URL=... python loadtest/router.py &
+    # 2. проверка кейсов tests.json и нагрузка
+    python loadtest/driver.py --tests
+    python loadtest/driver.py --duration 60 --concurrency 16 \\
+        --mix chat=6,telegram-webhook=2,vk-webhook=1,whatsapp-webhook=1,max-webhook=1 --output run.json
+
+Отчёт по каждой функции: запросы, ошибки, throughput, p50/p95/p99 и доля
+холодных стартов (заголовки X-Cold-Start / X-Function-Ms от роутера).
+
+A/B двух конфигураций (например, CHAT_IN_PROCESS=false и true у роутера):
+
+    python loadtest/driver.py --duration 60 --mix telegram-webhook=1 --output http.json
+    python loadtest/driver.py --duration 60 --mix telegram-webhook=1 --compare http.json
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GUEST_QUESTIONS = [
+    "Сколько стоит номер Стандарт на двоих с 10 по 15 июля?",
+    "Во сколько заезд и выезд?",
+    "Есть ли у вас бассейн?",
+    "Можно ли с собакой?",
+    "Какие условия отмены бронирования?",
+    "Дети до скольки лет бесплатно?",
+    "Есть трансфер из аэропорта Симферополя?",
+    "Сколько идти до моря?",
+    "Завтрак включен в стоимость?",
+    "Есть ли парковка и сколько стоит?",
+    "Можно ли поздний выезд?",
+    "Привет",
+]
+
+
+def synthetic_request(function: str, rng: random.Random):
+    """(method, body, query) для одного сообщения гостя в формате канала"""
+    guest = rng.randint(1, 5000)
+    text = rng.choice(GUEST_QUESTIONS)
+    if function == 'chat':
+        return 'POST', {'message': text, 'sessionId': f'load-{guest}', 'tenantId': 1}, None
+    # Уникальные id доставки, как у настоящих платформ (ключи идемпотентности chat)
+    delivery_id = rng.getrandbits(48)
+    if function == 'telegram-webhook':
+        return 'POST', {'update_id': delivery_id, 'message': {'chat': {'id': guest}, 'text': text}}, None
+    if function == 'max-webhook':
+        return 'POST', {'message': {'message_id': delivery_id, 'chat': {'id': guest}, 'text': text}}, None
+    if function == 'vk-webhook':
+        return 'POST', {'type': 'message_new', 'event_id': f'{delivery_id:x}',
+                        'object': {'message': {'from_id': guest, 'text': text}}}, None
+    if function == 'whatsapp-webhook':
+        return 'POST', {'entry': [{'changes': [{'value': {'messages': [{
+            'id': f'wamid.{delivery_id:x}', 'from': f'7978{guest:07d}', 'type': 'text', 'text': {'body': text}
+        }]}}]}]}, None
+    raise ValueError(f'Нет синтетического трафика для {function}')
+
+
+def send(base_url: str, function: str, method: str, body, query=None, timeout: float = 60):
+    url = f"{base_url}/{function}" + (f"?{urlencode(query)}" if query else '')
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, headers, payload = response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        status, headers, payload = e.code, e.headers, e.read()
+    except Exception as e:
+        return {'status': None, 'ms': (time.perf_counter() - started) * 1000, 'error': str(e)}
+    return {
+        'status': status,
+        'ms': (time.perf_counter() - started) * 1000,
+        'function_ms': float(headers.get('X-Function-Ms') or 0) or None,
+        'cold': headers.get('X-Cold-Start') == 'true',
+        'payload': payload,
+    }
+
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))], 1)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, function: str, result: dict):
+        with self.lock:
+            self.samples.setdefault(function, []).append(result)
+
+    def report(self, elapsed: float) -> dict:
+        report = {}
+        for function, samples in sorted(self.samples.items()):
+            latencies = [s['ms'] for s in samples]
+            errors = sum(1 for s in samples if s['status'] is None or s['status'] >= 500)
+            report[function] = {
+                'requests': len(samples),
+                'errors': errors,
+                'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+                'p50_ms': percentile(latencies, 0.5),
+                'p95_ms': percentile(latencies, 0.95),
+                'p99_ms': percentile(latencies, 0.99),
+                'function_p95_ms': percentile([s['function_ms'] for s in samples if s.get('function_ms')], 0.95),
+                'cold_starts': sum(1 for s in samples if s.get('cold')),
+            }
+        return report
+
+
+def matches(expected, actual_raw: bytes, matcher: str) -> bool:
+    try:
+        actual = json.loads(actual_raw)
+    except ValueError:
+        actual = actual_raw.decode('utf-8', errors='replace')
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if matcher == 'exact':
+            return expected == actual
+        # partial: ключи есть, "string" в ожидании означает любую строку
+        for key, value in expected.items():
+            if key not in actual:
+                return False
+            if value == 'string' and isinstance(actual[key], str):
+                continue
+            if value != 'string' and value != actual[key] and not isinstance(value, (dict, list)):
+                return False
+        return True
+    return expected == actual
+
+
+def run_tests(base_url: str, recorder: Recorder, functions=None):
+    """Прогнать кейсы backend/*/tests.json; возвращает список несовпадений"""
+    failures = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'backend', '*', 'tests.json'))):
+        function = os.path.basename(os.path.dirname(path))
+        if functions and function not in functions:
+            continue
+        with open(path) as f:
+            cases = json.load(f).get('tests', [])
+        for case in cases:
+            result = send(base_url, function, case.get('method', 'POST'), case.get('body'), case.get('queryParams'))
+            recorder.add(function, result)
+            ok = result['status'] == case.get('expectedStatus', 200)
+            if ok and 'expectedBody' in case:
+                ok = matches(case['expectedBody'], result.get('payload', b''), case.get('bodyMatcher', 'partial'))
+            print(f"{'✅' if ok else '❌'} {function}: {case.get('name')} — {result['status']}, {result['ms']:.0f} ms")
+            if not ok:
+                failures.append({'function': function, 'case': case.get('name'), 'status': result['status'],
+                                 'body': (result.get('payload') or b'')[:300].decode('utf-8', errors='replace')})
+    return failures
+
+
+def run_load(base_url: str, recorder: Recorder, mix: dict, duration: float, concurrency: int, seed: int):
+    functions = list(mix)
+    weights = [mix[f] for f in functions]
+    deadline = time.monotonic() + duration
+
+    def guest(worker_id: int):
+        rng = random.Random(seed + worker_id)
+        while time.monotonic() < deadline:
+            function = rng.choices(functions, weights)[0]
+            method, body, query = synthetic_request(function, rng)
+            recorder.add(function, send(base_url, function, method, body, query))
+
+    threads = [threading.Thread(target=guest, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in filter(None, value.split(',')):
+        function, _, weight = item.partition('=')
+        mix[function.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон функций через локальный роутер')
+    parser.add_argument('--url', default=os.environ.get('LOADTEST_ROUTER_URL', 'http://127.0.0.1:8787'))
+    parser.add_argument('--tests', action='store_true', help='Прогнать кейсы backend/*/tests.json')
+    parser.add_argument('--functions', default='', help='Ограничить --tests списком функций через запятую')
+    parser.add_argument('--duration', type=float, default=0, help='Секунд синтетической нагрузки (0 — без неё)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Одновременных гостей')
+    parser.add_argument('--mix', default='chat=6,telegram-webhook=2,vk-webhook=1,whatsapp-webhook=1,max-webhook=1',
+                        help='Доли функций в синтетическом трафике')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Сохранить отчёт в JSON')
+    parser.add_argument('--compare', help='Отчёт прошлого прогона: разница p50/p95 по функциям')
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    failures = []
+
+    if args.tests:
+        functions = set(filter(None, args.functions.split(',')))
+        failures = run_tests(args.url, recorder, functions)
+    if args.duration:
+        print(f"🚀 {args.concurrency} гостей, {args.duration:.0f} c, mix {args.mix}")
+        run_load(args.url, recorder, parse_mix(args.mix), args.duration, args.concurrency, args.seed)
+
+    elapsed = time.perf_counter() - started
+    report = {'elapsed_seconds': round(elapsed, 2), 'endpoints': recorder.report(elapsed), 'test_failures': failures}
+
+    print(f"\n{'function':<22}{'req':>7}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'cold':>6}")
+    for function, stats in report['endpoints'].items():
+        print(f"{function:<22}{stats['requests']:>7}{stats['errors']:>6}{stats['rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}{stats['cold_starts']:>6}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['endpoints']
+        print(f"\n{'function':<22}{'p50 было':>10}{'p50':>9}{'Δ ms':>9}{'p95 было':>10}{'p95':>9}{'Δ ms':>9}")
+        for function, stats in report['endpoints'].items():
+            before = baseline.get(function)
+            if not before or stats['p50_ms'] is None or before['p50_ms'] is None:
+                continue
+            print(f"{function:<22}{before['p50_ms']:>10}{stats['p50_ms']:>9}{stats['p50_ms'] - before['p50_ms']:>+9.1f}"
+                  f"{before['p95_ms']:>10}{stats['p95_ms']:>9}{stats['p95_ms'] - before['p95_ms']:>+9.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчёт сохранён в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Перенаправление исходящих HTTP-запросов функций на локальные заглушки.
+
+Код функций ходит на захардкоженные адреса провайдеров и на
+functions.poehali.dev. В процессе-воркере install() подменяет отправку
+в requests и httpx (его использует клиент openai): запросы к провайдерам
+уходят на stubs.py, а вызовы других функций — на локальный router.py.
+Код самих функций при этом не меняется.
+"""
+import os
+from urllib.parse import urlsplit
+
+STUB_URL = os.environ.get('LOADTEST_STUB_URL', 'http://127.0.0.1:8788')
+ROUTER_URL = os.environ.get('LOADTEST_ROUTER_URL', 'http://127.0.0.1:8787')
+
+# Хосты, которые обслуживает stubs.py (первый сегмент пути заглушки — исходный хост)
+STUB_HOSTS = {
+    'llm.api.cloud.yandex.net',
+    'openrouter.ai',
+    'api.openai.com',
+    'api.telegram.org',
+    'api.vk.com',
+    'graph.facebook.com',
+    'platform-api.max.ru',
+}
+FUNCTIONS_HOST = 'functions.poehali.dev'
+
+
+def rewrite_url(url: str) -> str:
+    parts = urlsplit(url)
+    host = parts.hostname or ''
+    tail = parts.path + (f'?{parts.query}' if parts.query else '')
+    if host in STUB_HOSTS:
+        return f"{STUB_URL}/{host}{tail}"
+    if host == FUNCTIONS_HOST:
+        return f"{ROUTER_URL}{tail}"
+    return url
+
+
+def install():
+    """Подменить отправку в requests и httpx; вызывается воркером до импорта функции"""
+    try:
+        import requests.sessions
+    except ImportError:
+        requests = None
+
+    if requests is not None:
+        original_request = requests.sessions.Session.request
+
+        def request(self, method, url, *args, **kwargs):
+            return original_request(self, method, rewrite_url(url), *args, **kwargs)
+
+        requests.sessions.Session.request = request
+
+    try:
+        import httpx
+    except ImportError:
+        return
+
+    original_send = httpx.Client.send
+
+    def send(self, request, *args, **kwargs):
+        target = rewrite_url(str(request.url))
+        if target != str(request.url):
+            request.url = httpx.URL(target)
+            request.headers['host'] = request.url.netloc.decode()
+        return original_send(self, request, *args, **kwargs)
+
+    httpx.Client.send = send
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Детерминированные заглушки провайдеров для нагрузочных прогонов.
+
+Один HTTP-сервер отвечает за всех провайдеров; первый сегмент пути — исходный
+хост (так их переписывает redirect.py):
+
+    /llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding
+    /llm.api.cloud.yandex.net/foundationModels/v1/completion   (и stream)
+    /openrouter.ai/api/v1/{embeddings,chat/completions}        (и stream)
+    /api.openai.com/v1/{embeddings,chat/completions}
+    /api.telegram.org/bot<token>/<method>
+    /api.vk.com/method/<method>
+    /graph.facebook.com/<version>/<phone_number_id>/messages
+    /platform-api.max.ru/...
+
+Эмбеддинг зависит только от текста, ответ LLM — только от вопроса, поэтому
+прогоны воспроизводимы. Задержки задаются по провайдерам:
+
+    python loadtest/stubs.py --latency yandex=0.4,openrouter=0.8,telegram=0.05 --jitter 0.2
+
+GET /__stats — число запросов по провайдерам.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROVIDERS = {
+    'llm.api.cloud.yandex.net': 'yandex',
+    'openrouter.ai': 'openrouter',
+    'api.openai.com': 'openai',
+    'api.telegram.org': 'telegram',
+    'api.vk.com': 'vk',
+    'graph.facebook.com': 'whatsapp',
+    'platform-api.max.ru': 'max',
+}
+DEFAULT_LATENCY = {
+    'yandex': 0.3, 'openrouter': 0.6, 'openai': 0.15,
+    'telegram': 0.05, 'vk': 0.05, 'whatsapp': 0.08, 'max': 0.05,
+}
+# Доля задержки LLM до первого токена; остальное растягивается на поток дельт
+LLM_FIRST_TOKEN_SHARE = 0.3
+STREAM_CHUNKS = 12
+
+ANSWER_TEMPLATE = ("Спасибо за вопрос «{question}». По данным отеля: заезд с 14:00, выезд до 12:00, "
+                   "на территории есть бассейн и парковка. Подскажите, пожалуйста, даты поездки и "
+                   "количество гостей — я рассчитаю стоимость проживания.")
+
+
+def stable_embedding(text: str, dim: int) -> list:
+    """Единичный вектор, зависящий только от текста"""
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def stable_answer(question: str) -> str:
+    return ANSWER_TEMPLATE.format(question=question.strip()[:80])
+
+
+def split_stream(text: str, chunks: int):
+    step = max(1, math.ceil(len(text) / chunks))
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+class Stubs:
+    def __init__(self, latency: dict, jitter: float, dim: int, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.dim = dim
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.message_id = 0
+
+    def delay(self, provider: str) -> float:
+        base = self.latency.get(provider, 0.0)
+        with self.lock:
+            spread = self.rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, base * (1 + spread))
+
+    def count(self, provider: str, kind: str):
+        with self.lock:
+            key = f'{provider}.{kind}'
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def next_message_id(self) -> int:
+        with self.lock:
+            self.message_id += 1
+            return self.message_id
+
+
+def last_user_text(messages: list) -> str:
+    for message in reversed(messages or []):
+        if message.get('role') == 'user':
+            return message.get('content') or message.get('text') or ''
+    return ''
+
+
+def make_handler(stubs: Stubs):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def send_json(self, payload: dict, status: int = 200):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_stream(self, content_type: str, lines, total_delay: float):
+            """HTTP/1.0 без Content-Length: клиент читает до закрытия соединения"""
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.end_headers()
+            time.sleep(total_delay * LLM_FIRST_TOKEN_SHARE)
+            pause = total_delay * (1 - LLM_FIRST_TOKEN_SHARE) / max(1, len(lines))
+            for line in lines:
+                self.wfile.write(line.encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(pause)
+
+        def do_GET(self):
+            if self.path == '/__stats':
+                with stubs.lock:
+                    self.send_json(dict(stubs.stats))
+                return
+            self.handle_request({})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            try:
+                payload = json.loads(raw) if raw else {}
+            except ValueError:
+                payload = {}
+            self.handle_request(payload)
+
+        def handle_request(self, payload: dict):
+            host, _, path = self.path.lstrip('/').partition('/')
+            path = '/' + path.split('?', 1)[0]
+            provider = PROVIDERS.get(host)
+            if provider is None:
+                self.send_json({'error': f'unknown host {host}'}, 404)
+                return
+
+            delay = stubs.delay(provider)
+
+            if provider == 'yandex':
+                self.yandex(path, payload, delay)
+            elif provider in ('openrouter', 'openai'):
+                self.openai(provider, path, payload, delay)
+            else:
+                stubs.count(provider, 'send')
+                time.sleep(delay)
+                self.send_json(self.messenger_response(provider))
+
+        def yandex(self, path: str, payload: dict, delay: float):
+            if path.endswith('/textEmbedding'):
+                stubs.count('yandex', 'embedding')
+                time.sleep(delay)
+                text = payload.get('text', '')
+                self.send_json({'embedding': stable_embedding(text, stubs.dim),
+                                'numTokens': str(len(text.split())), 'modelVersion': 'stub'})
+                return
+
+            stubs.count('yandex', 'completion')
+            answer = stable_answer(last_user_text(payload.get('messages')))
+            usage = {'inputTextTokens': '0', 'completionTokens': str(len(answer.split())),
+                     'totalTokens': str(len(answer.split()))}
+
+            if (payload.get('completionOptions') or {}).get('stream'):
+                # Каждый объект несёт накопленный текст, как и настоящий API
+                lines, sent = [], ''
+                for part in split_stream(answer, STREAM_CHUNKS):
+                    sent += part
+                    final = len(sent) == len(answer)
+                    lines.append(json.dumps({'result': {
+                        'alternatives': [{'message': {'role': 'assistant', 'text': sent},
+                                          'status': 'ALTERNATIVE_STATUS_FINAL' if final else 'ALTERNATIVE_STATUS_PARTIAL'}],
+                        'usage': usage, 'modelVersion': 'stub'
+                    }}, ensure_ascii=False) + '\n')
+                self.send_stream('application/json', lines, delay)
+                return
+
+            time.sleep(delay)
+            self.send_json({'result': {
+                'alternatives': [{'message': {'role': 'assistant', 'text': answer},
+                                  'status': 'ALTERNATIVE_STATUS_FINAL'}],
+                'usage': usage, 'modelVersion': 'stub'
+            }})
+
+        def openai(self, provider: str, path: str, payload: dict, delay: float):
+            if path.endswith('/embeddings'):
+                stubs.count(provider, 'embedding')
+                time.sleep(delay)
+                texts = payload.get('input', '')
+                texts = texts if isinstance(texts, list) else [texts]
+                self.send_json({
+                    'object': 'list',
+                    'model': payload.get('model', 'stub'),
+                    'data': [{'object': 'embedding', 'index': i, 'embedding': stable_embedding(t, stubs.dim)}
+                             for i, t in enumerate(texts)],
+                    'usage': {'prompt_tokens': 0, 'total_tokens': 0}
+                })
+                return
+
+            stubs.count(provider, 'completion')
+            answer = stable_answer(last_user_text(payload.get('messages')))
+            completion_id = f'chatcmpl-stub-{stubs.next_message_id()}'
+            usage = {'prompt_tokens': 0, 'completion_tokens': len(answer.split()), 'total_tokens': len(answer.split())}
+            base = {'id': completion_id, 'created': int(time.time()), 'model': payload.get('model', 'stub')}
+
+            if payload.get('stream'):
+                lines = [
+                    'data: ' + json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [
+                        {'index': 0, 'delta': {'content': part}, 'finish_reason': None}
+                    ]}, ensure_ascii=False) + '\n\n'
+                    for part in split_stream(answer, STREAM_CHUNKS)
+                ]
+                if (payload.get('stream_options') or {}).get('include_usage'):
+                    lines.append('data: ' + json.dumps({**base, 'object': 'chat.completion.chunk',
+                                                        'choices': [], 'usage': usage}) + '\n\n')
+                lines.append('data: [DONE]\n\n')
+                self.send_stream('text/event-stream', lines, delay)
+                return
+
+            time.sleep(delay)
+            self.send_json({**base, 'object': 'chat.completion', 'usage': usage, 'choices': [{
+                'index': 0, 'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': answer}
+            }]})
+
+        @staticmethod
+        def messenger_response(provider: str) -> dict:
+            message_id = stubs.next_message_id()
+            if provider == 'telegram':
+                return {'ok': True, 'result': {'message_id': message_id, 'date': int(time.time())}}
+            if provider == 'vk':
+                return {'response': message_id}
+            if provider == 'whatsapp':
+                return {'messaging_product': 'whatsapp', 'messages': [{'id': f'wamid.stub{message_id}'}]}
+            return {'message': {'body': {'mid': f'mid.stub{message_id}'}}}
+
+    return Handler
+
+
+def parse_latency(value: str) -> dict:
+    latency = dict(DEFAULT_LATENCY)
+    for item in filter(None, (value or '').split(',')):
+        provider, _, seconds = item.partition('=')
+        latency[provider.strip()] = float(seconds)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушки YandexGPT, OpenAI/OpenRouter и мессенджеров')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8788)
+    parser.add_argument('--latency', default='', help='provider=секунды через запятую, например yandex=0.4,telegram=0.05')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Разброс задержки, доля от базовой')
+    parser.add_argument('--dim', type=int, default=256, help='Размерность эмбеддингов')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    stubs = Stubs(parse_latency(args.latency), args.jitter, args.dim, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(stubs))
+    print(f"🧪 Заглушки провайдеров на http://{args.host}:{args.port}, задержки: {stubs.latency}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Процесс одного экземпляра функции для router.py.
+
+Как и на платформе, каждый экземпляр — отдельный процесс со своими
+глобальными кэшами и пулом соединений; первый вызов — холодный старт.
+Протокол: по строке JSON {"event", "request_id"} на stdin, по строке
+JSON {"response", "ms", "error"} в исходный stdout. print() обработчика
+уходит в stderr, чтобы не смешиваться с протоколом.
+
+    python loadtest/worker.py backend/chat
+"""
+import importlib.util
+import json
+import os
+import sys
+import time
+import traceback
+
+
+class Context:
+    """Минимальный context платформы: обработчики читают только request_id"""
+
+    def __init__(self, request_id: str, function_name: str):
+        self.request_id = request_id
+        self.function_name = function_name
+        self.memory_limit_in_mb = 128
+
+
+def main():
+    function_dir = os.path.abspath(sys.argv[1])
+    function_name = os.path.basename(function_dir)
+
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    sys.stdout = sys.stderr
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from redirect import install
+    install()
+
+    sys.path.insert(0, function_dir)
+    spec = importlib.util.spec_from_file_location('index', os.path.join(function_dir, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['index'] = module
+    spec.loader.exec_module(module)
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        started = time.perf_counter()
+        try:
+            response = module.handler(request['event'], Context(request['request_id'], function_name))
+            error = None
+        except Exception:
+            response = None
+            error = traceback.format_exc()
+        protocol.write(json.dumps({
+            'response': response,
+            'ms': round((time.perf_counter() - started) * 1000, 2),
+            'error': error
+        }, ensure_ascii=False, default=str) + '\n')
+        protocol.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Офлайн-реплей запросов из quality_gate_logs через retrieval + quality gate.
+
+Шаг 1 (нужна БД): снимок корпуса тенанта и окна залогированных запросов.
+Эмбеддинги запросов берутся из query_embedding_cache; недостающие с
+--fetch-missing один раз запрашиваются у провайдера тенанта и сохраняются
+в снимок — дальше реплей их не запрашивает.
+
+    DATABASE_URL=... python replay_quality_gate.py snapshot --tenant 1 \\
+        --since 2026-10-01 --until 2026-10-15 --out snapshots/tenant1 --fetch-missing
+
+Шаг 2 (офлайн, нужен только numpy): прогон запросов через тот же путь, что
+в chat (векторный или гибридный поиск, build_context_with_scores,
+quality_gate и fallback на RAG_TOPK_FALLBACK при low_overlap). Отчёт:
+распределение задержек по стадиям и как изменились исходы gate относительно
+логов и, с --baseline, относительно прошлого реплея.
+
+    python replay_quality_gate.py replay --snapshot snapshots/tenant1 --output before.json
+    # ... изменения в retrieval ...
+    python replay_quality_gate.py replay --snapshot snapshots/tenant1 --baseline before.json
+
+Окно запросов — строки quality_gate_logs тенанта из --tenant; строки,
+записанные до V0047 (tenant_id IS NULL), в снимок не попадают.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'chat'))
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'shared'))
+from bm25 import BM25Index
+from quality_gate import (
+    build_context_with_scores,
+    detect_lang_simple,
+    quality_gate,
+    tokenize,
+    RAG_TOPK_DEFAULT,
+    RAG_TOPK_FALLBACK,
+    RAG_HYBRID_CANDIDATES
+)
+from query_embedding_cache import make_cache_key, put_query_embedding
+from retrieval import EmbeddingIndex
+
+SCHEMA = 't_p56134400_telegram_ai_bot_pdf'
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def fetch_query_embedding(provider: str, model: str, text: str, keys: dict):
+    """Эмбеддинг запроса так же, как его считает chat (для Yandex — text-search-query)"""
+    import requests
+
+    if provider == 'yandexgpt':
+        response = requests.post(
+            'https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding',
+            headers={'Authorization': f"Api-Key {keys['api_key']}", 'Content-Type': 'application/json'},
+            json={'modelUri': f"emb://{keys['folder_id']}/text-search-query/latest", 'text': text},
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.json()['embedding']
+
+    base_url = 'https://openrouter.ai/api/v1' if provider == 'openrouter' else 'https://api.openai.com/v1'
+    response = requests.post(
+        f'{base_url}/embeddings',
+        headers={'Authorization': f"Bearer {keys['api_key']}", 'Content-Type': 'application/json'},
+        json={'model': model, 'input': text},
+        timeout=30
+    )
+    response.raise_for_status()
+    return response.json()['data'][0]['embedding']
+
+
+def snapshot(args):
+    # Те же запросы, что читает chat, чтобы снимок не расходился с продом
+    import psycopg2
+    from db import PREPARED_STATEMENTS
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    os.makedirs(args.out, exist_ok=True)
+
+    cur.execute(PREPARED_STATEMENTS['tenant_ai_settings'], (args.tenant,))
+    row = cur.fetchone()
+    settings = (row[0] if row else None) or {}
+    provider = settings.get('embedding_provider', 'openai')
+    model = settings.get('embedding_model', 'text-embedding-3-small')
+
+    cur.execute(PREPARED_STATEMENTS['tenant_chunks'], (args.tenant,))
+    rows = cur.fetchall()
+    index = EmbeddingIndex.from_rows([r[2:] for r in rows])
+    np.save(os.path.join(args.out, 'matrix.npy'), index.matrix)
+    with open(os.path.join(args.out, 'chunks.json'), 'w') as f:
+        json.dump([{'id': r[0], 'token_count': r[1], 'text': r[2], 'normalized': bool(r[6])} for r in rows],
+                  f, ensure_ascii=False)
+
+    cur.execute(PREPARED_STATEMENTS['tenant_chunk_terms'], (args.tenant,))
+    with open(os.path.join(args.out, 'postings.json'), 'w') as f:
+        json.dump(cur.fetchall(), f, ensure_ascii=False)
+
+    # Запросы из кэша ответов retrieval не проходили — сравнивать нечего
+    cur.execute(f"""
+        SELECT id, user_message, context_ok, gate_reason, best_similarity, overlap, top_k_used, created_at
+        FROM {SCHEMA}.quality_gate_logs
+        WHERE tenant_id = %s AND created_at >= %s AND created_at < %s
+          AND NOT COALESCE(answer_cache_hit, false)
+        ORDER BY created_at
+        LIMIT %s
+    """, (args.tenant, args.since, args.until, args.limit))
+    queries = [{
+        'id': r[0], 'message': r[1], 'context_ok': r[2], 'gate_reason': r[3],
+        'best_similarity': float(r[4]) if r[4] is not None else None,
+        'overlap': float(r[5]) if r[5] is not None else None,
+        'top_k_used': r[6], 'created_at': r[7].isoformat() if r[7] else None,
+        'cache_key': make_cache_key(provider, model, r[1])
+    } for r in cur.fetchall()]
+    with open(os.path.join(args.out, 'queries.json'), 'w') as f:
+        json.dump(queries, f, ensure_ascii=False, indent=1)
+
+    embeddings = load_query_embeddings(args.out)
+    missing = sorted({q['cache_key'] for q in queries} - set(embeddings))
+    if missing:
+        cur.execute(f"""
+            SELECT cache_key, embedding_bin
+            FROM {SCHEMA}.query_embedding_cache
+            WHERE cache_key = ANY(%s)
+        """, (missing,))
+        for cache_key, embedding_bin in cur.fetchall():
+            embeddings[cache_key] = np.frombuffer(bytes(embedding_bin), dtype='<f4')
+
+    missing = [q for q in queries if q['cache_key'] not in embeddings]
+    if missing and args.fetch_missing:
+        cur.execute(f"""
+            SELECT key_name, key_value
+            FROM {SCHEMA}.tenant_api_keys
+            WHERE tenant_id = %s AND provider = %s AND is_active = true
+        """, (args.tenant, provider if provider in ('yandexgpt', 'openrouter') else 'openai'))
+        keys = dict(cur.fetchall())
+        for q in missing:
+            if q['cache_key'] in embeddings:
+                continue
+            try:
+                embedding = fetch_query_embedding(provider, model, q['message'], keys)
+            except Exception as e:
+                print(f"⚠️ Эмбеддинг для запроса {q['id']} не получен: {e}")
+                continue
+            embeddings[q['cache_key']] = np.asarray(embedding, dtype=np.float32)
+            # В общий кэш тоже: следующий снимок и сам chat возьмут его оттуда
+            put_query_embedding(cur, provider, model, q['message'], embedding)
+        conn.commit()
+    save_query_embeddings(args.out, embeddings)
+
+    cur.close()
+    conn.close()
+
+    covered = sum(1 for q in queries if q['cache_key'] in embeddings)
+    meta = {
+        'tenant_id': args.tenant, 'embedding_provider': provider, 'embedding_model': model,
+        'since': args.since, 'until': args.until, 'created_at': datetime.utcnow().isoformat(),
+        'chunks': len(rows), 'postings': os.path.getsize(os.path.join(args.out, 'postings.json')),
+        'queries': len(queries), 'queries_with_embedding': covered
+    }
+    with open(os.path.join(args.out, 'meta.json'), 'w') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    print(f"📸 Снимок tenant {args.tenant}: {len(rows)} чанков, {len(queries)} запросов, "
+          f"с эмбеддингом {covered} → {args.out}")
+
+
+def load_query_embeddings(path: str) -> dict:
+    file = os.path.join(path, 'query_embeddings.npz')
+    if not os.path.exists(file):
+        return {}
+    data = np.load(file)
+    return {key: data['vectors'][i, :data['dims'][i]] for i, key in enumerate(data['keys'])}
+
+
+def save_query_embeddings(path: str, embeddings: dict):
+    keys = sorted(embeddings)
+    dim = max((len(v) for v in embeddings.values()), default=0)
+    vectors = np.zeros((len(keys), dim), dtype=np.float32)
+    for i, key in enumerate(keys):
+        vectors[i, :len(embeddings[key])] = embeddings[key]
+    np.savez_compressed(os.path.join(path, 'query_embeddings.npz'), keys=np.array(keys), vectors=vectors,
+                        dims=np.array([len(embeddings[k]) for k in keys], dtype=np.int32))
+
+
+def load_index(path: str) -> EmbeddingIndex:
+    with open(os.path.join(path, 'chunks.json')) as f:
+        chunks = json.load(f)
+    matrix = np.load(os.path.join(path, 'matrix.npy'))
+    index = EmbeddingIndex([c['text'] for c in chunks], matrix, np.array([c['normalized'] for c in chunks], dtype=bool))
+
+    with open(os.path.join(path, 'postings.json')) as f:
+        postings = json.load(f)
+    if postings:
+        chunk_rows = {c['id']: i for i, c in enumerate(chunks)}
+        doc_lens = np.asarray([c['token_count'] for c in chunks], dtype=np.float32)
+        index.bm25 = BM25Index.from_rows(postings, chunk_rows, doc_lens)
+    return index
+
+
+def replay_query(index: EmbeddingIndex, message: str, embedding: np.ndarray, hybrid: bool):
+    """Тот же путь, что в chat после получения эмбеддинга; старт всегда с RAG_TOPK_DEFAULT"""
+    timings = {}
+    candidates_top_k = max(RAG_TOPK_DEFAULT, RAG_TOPK_FALLBACK)
+
+    started = time.perf_counter()
+    if hybrid and index.bm25 is not None:
+        query_terms = tokenize(message, detect_lang_simple(message))
+        scored = index.hybrid_search(embedding, query_terms, top_k=candidates_top_k,
+                                     candidates=max(RAG_HYBRID_CANDIDATES, candidates_top_k))
+        presorted = True
+    else:
+        scored = index.search(embedding, top_k=candidates_top_k)
+        presorted = False
+    timings['retrieval'] = time.perf_counter() - started
+
+    if not scored:
+        return {'context_ok': False, 'gate_reason': 'no_chunks', 'top_k_used': None}, timings
+
+    started = time.perf_counter()
+    context, sims = build_context_with_scores(scored, top_k=RAG_TOPK_DEFAULT, presorted=presorted)
+    context_ok, gate_reason, gate_debug = quality_gate(message, context, sims)
+    top_k_used = RAG_TOPK_DEFAULT
+    if 'low_overlap' in gate_reason and RAG_TOPK_DEFAULT < RAG_TOPK_FALLBACK:
+        context, sims = build_context_with_scores(scored, top_k=RAG_TOPK_FALLBACK, presorted=presorted)
+        context_ok, gate_reason, gate_debug = quality_gate(message, context, sims)
+        top_k_used = RAG_TOPK_FALLBACK
+    timings['gate'] = time.perf_counter() - started
+
+    return {
+        'context_ok': context_ok,
+        'gate_reason': gate_reason,
+        'top_k_used': top_k_used,
+        'best_similarity': gate_debug.get('best_similarity'),
+        'overlap': gate_debug.get('overlap')
+    }, timings
+
+
+def reason_kind(reason: str) -> str:
+    """low_similarity:tariffs:0.21 -> low_similarity:tariffs (без чисел, чтобы сравнивать категории)"""
+    return ':'.join(p for p in (reason or '').split(':') if not p.replace('.', '', 1).isdigit())
+
+
+def distribution(values_ms):
+    if not values_ms:
+        return {}
+    values = np.asarray(values_ms)
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3),
+        'mean_ms': round(float(values.mean()), 3),
+    }
+
+
+def compare_outcomes(reference: dict, results: list, label: str, show: int):
+    """Переходы ok/fail и смены категории причины относительно reference: {query_id: outcome}"""
+    transitions = Counter()
+    flips = []
+    reason_changes = 0
+    for r in results:
+        ref = reference.get(r['id'])
+        if ref is None:
+            continue
+        transitions[f"{'ok' if ref['context_ok'] else 'fail'}->{'ok' if r['context_ok'] else 'fail'}"] += 1
+        if reason_kind(ref['gate_reason']) != reason_kind(r['gate_reason']):
+            reason_changes += 1
+        if bool(ref['context_ok']) != bool(r['context_ok']):
+            flips.append({'id': r['id'], 'message': r['message'],
+                          'before': ref['gate_reason'], 'after': r['gate_reason']})
+
+    compared = sum(transitions.values())
+    print(f"\n🔁 Относительно {label}: сравнено {compared}, смен исхода {len(flips)}, смен причины {reason_changes}")
+    for key in ('ok->ok', 'ok->fail', 'fail->ok', 'fail->fail'):
+        print(f"  {key:<11}{transitions.get(key, 0):>7}")
+    for flip in flips[:show]:
+        print(f"  #{flip['id']} {flip['before']} → {flip['after']}: {flip['message'][:80]}")
+    return {'compared': compared, 'transitions': dict(transitions), 'reason_changes': reason_changes, 'flips': flips}
+
+
+def replay(args):
+    with open(os.path.join(args.snapshot, 'meta.json')) as f:
+        meta = json.load(f)
+    with open(os.path.join(args.snapshot, 'queries.json')) as f:
+        queries = json.load(f)
+    embeddings = load_query_embeddings(args.snapshot)
+
+    started = time.perf_counter()
+    index = load_index(args.snapshot)
+    load_seconds = time.perf_counter() - started
+    hybrid = not args.no_hybrid
+
+    results, skipped = [], 0
+    stage_ms = {'retrieval': [], 'gate': [], 'total': []}
+    for q in queries:
+        embedding = embeddings.get(q['cache_key'])
+        if embedding is None:
+            skipped += 1
+            continue
+        for _ in range(args.repeat):
+            outcome, timings = replay_query(index, q['message'], embedding, hybrid)
+            for stage, seconds in timings.items():
+                stage_ms[stage].append(seconds * 1000)
+            stage_ms['total'].append(sum(timings.values()) * 1000)
+        results.append({'id': q['id'], 'message': q['message'], **outcome})
+
+    report = {
+        'meta': {
+            'snapshot': meta, 'git': git_revision(), 'timestamp': datetime.utcnow().isoformat(),
+            'hybrid': hybrid, 'repeat': args.repeat, 'index_load_seconds': round(load_seconds, 3),
+            'topk_default': RAG_TOPK_DEFAULT, 'topk_fallback': RAG_TOPK_FALLBACK
+        },
+        'replayed': len(results),
+        'skipped_without_embedding': skipped,
+        'latency': {stage: distribution(values) for stage, values in stage_ms.items()},
+        'results': results
+    }
+
+    print(f"▶️ Реплей {len(results)} запросов (без эмбеддинга пропущено {skipped}), "
+          f"индекс {len(index)} чанков, hybrid={hybrid}")
+    for stage, stats in report['latency'].items():
+        if stats:
+            print(f"  {stage:<10} p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  "
+                  f"p99 {stats['p99_ms']:>8} ms  max {stats['max_ms']:>8} ms")
+
+    logged = {q['id']: q for q in queries}
+    report['vs_logs'] = compare_outcomes(logged, results, 'логов', args.show)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['vs_baseline'] = compare_outcomes({r['id']: r for r in baseline['results']}, results,
+                                                 f"реплея {baseline['meta'].get('git') or args.baseline}", args.show)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены в {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Офлайн-реплей quality_gate_logs через retrieval и quality gate')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    snap = sub.add_parser('snapshot', help='Снять корпус тенанта и окно запросов из БД')
+    snap.add_argument('--tenant', type=int, default=1)
+    snap.add_argument('--since', required=True, help='Начало окна (включительно), например 2026-10-01')
+    snap.add_argument('--until', default=datetime.utcnow().isoformat(), help='Конец окна (не включительно)')
+    snap.add_argument('--limit', type=int, default=10000)
+    snap.add_argument('--out', required=True, help='Каталог снимка')
+    snap.add_argument('--fetch-missing', action='store_true',
+                      help='Запросить у провайдера эмбеддинги, которых нет в query_embedding_cache')
+
+    rep = sub.add_parser('replay', help='Прогнать запросы снимка офлайн')
+    rep.add_argument('--snapshot', required=True)
+    rep.add_argument('--no-hybrid', action='store_true', help='Только векторный поиск')
+    rep.add_argument('--repeat', type=int, default=1, help='Прогонов каждого запроса (для устойчивых перцентилей)')
+    rep.add_argument('--baseline', help='JSON прошлого реплея для сравнения исходов')
+    rep.add_argument('--show', type=int, default=10, help='Сколько сменившихся запросов показать')
+    rep.add_argument('--output', help='Сохранить результаты в JSON')
+
+    args = parser.parse_args()
+    snapshot(args) if args.command == 'snapshot' else replay(args)
+
+
+if __name__ == '__main__':
+    main()
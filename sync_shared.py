@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Копирование общих модулей в каталоги функций backend.
+
+Каждая функция деплоится отдельно: на платформу уходит только её каталог
+(/function/code), поэтому всё, что она импортирует, должно лежать рядом с
+index.py. Исходники общих модулей — backend/shared (db, api_keys_helper,
+invalidation_bus, очередь и маршрутизация мессенджеров) и backend/chat
+(конвейер chat для вызова из webhook-ов в процессе); в остальных каталогах
+лежат их точные копии, которые руками не правятся (кроме KEEP_LOCAL).
+
+Какие модули нужны функции, определяется по её import-ам, включая
+транзитивные импорты самих общих модулей.
+
+    python sync_shared.py          # обновить копии после правки backend/shared или backend/chat
+    python sync_shared.py --check  # перед деплоем: 1, если копия устарела или отсутствует
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
+# Порядок важен: модуль из shared главнее одноимённой копии в chat
+SOURCE_DIRS = ('shared', 'chat')
+
+# Копии, которые расходятся с исходником намеренно и не перезаписываются:
+# у этих функций свои тексты ошибок доступа, которые видят пользователи
+KEEP_LOCAL = {
+    ('get-ai-settings', 'auth_middleware'),
+    ('manage-api-keys', 'auth_middleware'),
+    ('messenger-auto-messages', 'auth_middleware'),
+}
+
+IMPORT_RE = re.compile(r'^\s*(?:from\s+(\w+)\s+import|import\s+(\w+))', re.MULTILINE)
+
+
+def source_path(module: str):
+    for source in SOURCE_DIRS:
+        path = os.path.join(BACKEND_DIR, source, f'{module}.py')
+        if module != 'index' and os.path.exists(path):
+            return source, path
+    return None, None
+
+
+def module_imports(path: str) -> set:
+    with open(path, encoding='utf-8') as f:
+        return {a or b for a, b in IMPORT_RE.findall(f.read())}
+
+
+def required_modules(function: str) -> dict:
+    """module -> путь исходника для всех общих модулей, нужных функции"""
+    function_dir = os.path.join(BACKEND_DIR, function)
+    pending = []
+    for name in os.listdir(function_dir):
+        if not name.endswith('.py'):
+            continue
+        # Копии общих модулей не в счёт: иначе ненужная копия тянула бы сама себя
+        path = source_path(name[:-3])[1]
+        if path is None or os.path.dirname(path) == function_dir:
+            pending.extend(module_imports(os.path.join(function_dir, name)))
+
+    required = {}
+    while pending:
+        module = pending.pop()
+        if module in required:
+            continue
+        path = source_path(module)[1]
+        if path is None:
+            continue
+        required[module] = path
+        pending.extend(module_imports(path))
+    # Собственные модули каталога-исходника не копируются в него же
+    return {m: p for m, p in required.items() if os.path.dirname(p) != function_dir}
+
+
+def functions():
+    for name in sorted(os.listdir(BACKEND_DIR)):
+        if name != 'shared' and os.path.exists(os.path.join(BACKEND_DIR, name, 'index.py')):
+            yield name
+
+
+def same_file(a: str, b: str) -> bool:
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        return fa.read() == fb.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='только проверить, ничего не копировать')
+    args = parser.parse_args()
+
+    outdated = []
+    for function in functions():
+        for module, path in sorted(required_modules(function).items()):
+            if (function, module) in KEEP_LOCAL:
+                continue
+            target = os.path.join(BACKEND_DIR, function, f'{module}.py')
+            if os.path.exists(target) and same_file(path, target):
+                continue
+            outdated.append(os.path.relpath(target, os.path.dirname(BACKEND_DIR)))
+            if not args.check:
+                shutil.copyfile(path, target)
+
+    for target in outdated:
+        print(f"{'outdated' if args.check else 'updated'}: {target}")
+    if args.check and outdated:
+        print(f"{len(outdated)} копий устарели, запустите python sync_shared.py")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()